@@ -0,0 +1,125 @@
+"""Microbenchmark of the CORRECT.LP parser: the GUI's original two reads against read_correctlp and the header index.
+
+    python benchmarks/bench_correctlp.py [--files 300] [--size-kb 130] [--repeat 3]
+    python benchmarks/bench_correctlp.py --dir /path/to/datasets
+
+Without --dir, synthetic CORRECT.LP files are written to a temporary directory:
+a provisional statistics table early on, the final one at the end, padded with
+per-frame lines to the given size. Times are per file and per pass, with the
+files in the page cache after the first pass.
+"""
+import argparse
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from codgas_engine import HeaderIndex, find_files, load_correctlp, read_correctlp  # noqa: E402
+
+TABLE_HEADER = (
+    " SUBSET OF INTENSITY DATA WITH SIGNAL/NOISE >= -3.0 AS FUNCTION OF RESOLUTION\n"
+    " RESOLUTION     NUMBER OF REFLECTIONS    COMPLETENESS R-FACTOR  R-FACTOR COMPARED I/SIGMA   R-meas  CC(1/2)  Anomal  SigAno   Nano\n"
+    "   LIMIT     OBSERVED  UNIQUE  POSSIBLE     OF DATA   observed  expected                                      Corr\n"
+    "\n")
+
+
+def synthetic_table(rng, isig):
+    table = TABLE_HEADER
+    for resolution in (8.87, 6.29, 5.14, 4.45, 3.98, 3.64, 3.37, 3.15, 2.97, 2.82, None):
+        label = "    total" if resolution is None else f"{resolution:9.2f}"
+        table += (f"{label}{rng.randint(1000, 9000):12d}{rng.randint(100, 900):8d}{rng.randint(100, 900):10d}"
+                  f"{rng.uniform(90, 100):11.1f}%{rng.uniform(2, 60):10.1f}%{rng.uniform(2, 60):10.1f}%"
+                  f"{rng.randint(1000, 9000):9d}{isig if resolution is None else rng.uniform(1, 50):8.2f}"
+                  f"{rng.uniform(2, 60):10.1f}%{rng.uniform(30, 100):8.1f}*{rng.randint(-20, 40):6d}"
+                  f"{rng.uniform(0.5, 1.5):9.3f}{rng.randint(10, 900):8d}\n")
+    return table
+
+
+def synthetic_correctlp(seed, size_kb):
+    rng = random.Random(seed)
+    filler = "  per-frame statistics  1234  5678  0.123  4.56  7.89\n"
+    text = (" ***** CORRECT *****\n SPACE_GROUP_NUMBER=   0\n"
+            " UNIT_CELL_CONSTANTS=    70.000    70.000    30.000  90.000  90.000  90.000\n")
+    text += filler * (size_kb * 1024 * 3 // 4 // len(filler))
+    text += synthetic_table(rng, rng.uniform(5, 40))
+    text += "     a        b          ISa\n   1.089E+00  3.012E-03   27.84\n"
+    text += filler * (size_kb * 1024 // 4 // len(filler))
+    text += " SPACE_GROUP_NUMBER=   96\n UNIT_CELL_CONSTANTS=    78.270    78.270    37.059  90.000  90.000  90.000\n"
+    text += " STATISTICS OF SAVED DATA SET\n" + synthetic_table(rng, rng.uniform(5, 40))
+    return text + "\n cpu time used  12.3 sec\n"
+
+
+def original_two_reads(path):
+    """What the GUI did before read_correctlp: extract_correctlp_table, then grep_total, each a full read."""
+    table = []
+    look_for_total = False
+    checkpoint = re.sub(r'\s+', ' ', TABLE_HEADER.splitlines()[1]).strip()
+    with open(path, 'r') as file:
+        for line in file:
+            if checkpoint in re.sub(r'\s+', ' ', line).strip():
+                look_for_total = True
+                next(file)
+                next(file)
+            if look_for_total and line.strip()[:1].isdigit():
+                table.append(line.strip())
+            if 'total' in line and look_for_total:
+                table.append(line.strip())
+                break
+    totals = []
+    with open(path, 'r') as file:
+        for line in file:
+            if 'total' in line:
+                totals.append((path, line.strip()))
+    return table, totals
+
+
+def per_file_us(function, files, repeat):
+    for path in files:  # warm the page cache, the index
+        function(path)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in files:
+            function(path)
+    return (time.perf_counter() - start) / repeat / len(files) * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", help="time the CORRECT.LP files below this directory instead of synthetic ones")
+    parser.add_argument("--files", type=int, default=300)
+    parser.add_argument("--size-kb", type=int, default=130)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    tmp = None
+    if args.dir:
+        files = find_files(args.dir, "**/CORRECT.LP")
+    else:
+        tmp = tempfile.mkdtemp(prefix="bench_correctlp.")
+        files = []
+        for i in range(args.files):
+            path = os.path.join(tmp, f"{i:04d}_CORRECT.LP")
+            with open(path, "w") as f:
+                f.write(synthetic_correctlp(i, args.size_kb))
+            files.append(path)
+    try:
+        if not files:
+            sys.exit("no CORRECT.LP found")
+        size = sum(os.path.getsize(path) for path in files) / len(files)
+        print(f"{len(files)} files, {size / 1024:.0f} kB on average")
+        index = HeaderIndex(":memory:")
+        for label, function in (("original, two full reads + regex per line", original_two_reads),
+                                ("read_correctlp, one backwards pass", read_correctlp),
+                                ("load_correctlp, warm header index", lambda path: load_correctlp(path, index))):
+            print(f"  {label:<44} {per_file_us(function, files, args.repeat):9.1f} us/file")
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
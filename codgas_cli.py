@@ -0,0 +1,231 @@
+"""Command-line batch mode for CODGAS, for cluster nodes without a display.
+
+    python codgas_cli.py scan  DIR [--pattern XDS_ASCII.HKL] [--format json|csv]
+    python codgas_cli.py stats DIR [--pattern XDS_ASCII.HKL] [--format json|csv]
+    python codgas_cli.py rank  DIR [--metric isig | --weights isig=1,cc12=1] [--top N]
+    python codgas_cli.py ref   DIR [--reference CORRECT.LP] [--sg N] [--cell A B C] [--dest REF.hkl]
+    python codgas_cli.py reprocess DIR --script mesh_collect_reproc.perl --ref REF.hkl [--jobs N] [--executor slurm]
+
+Results go to stdout (or --output) as JSON or CSV. Only codgas_engine and
+codgas_mcr are imported, never tkinter, customtkinter or matplotlib, so a
+call costs little more than the Python start-up.
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+
+from codgas_engine import (DEFAULT_MAX_DEPTH, DEFAULT_WORKERS, RANKING_METRICS, SHELL_DTYPE, CELL_FIELDS, HeaderIndex,
+                           scan_datasets, cell_statistics, find_files, load_correctlp, rank_references,
+                           write_reference_hkl)
+from codgas_mcr import (MCR_DATASET_PATTERN, MCR_EXECUTORS, MCR_RETRIES, MCR_STATE_FILE, MCR_MAX_CPU, MCR_MIN_FREE_MEMORY,
+                        Admission, McrScheduler, find_datasets, make_executor, mcr_command)
+
+
+def _clean(value):
+    """JSON has no NaN/inf: turn them into null, recursively."""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: _clean(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_clean(item) for item in value]
+    return value
+
+
+def _flatten(value, prefix=""):
+    """{"cell": {"a": {"mean": 1}}} -> [("cell.a.mean", 1)], for key,value CSV output."""
+    if isinstance(value, dict):
+        items = []
+        for key, item in value.items():
+            items.extend(_flatten(item, f"{prefix}{key}."))
+        return items
+    return [(prefix[:-1], value)]
+
+
+def emit(result, fmt, out):
+    """Write `result` (a list of flat dicts, or a nested dict) as JSON or CSV."""
+    result = _clean(result)
+    if fmt == "json":
+        json.dump(result, out, indent=2)
+        out.write("\n")
+        return
+    if isinstance(result, dict):
+        result = [{"key": key, "value": value} for key, value in _flatten(result)]
+    writer = csv.DictWriter(out, fieldnames=list(result[0]) if result else ["path"], lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(result)
+
+
+def _index(args):
+    return None if args.no_cache else HeaderIndex()
+
+
+def _scan(args):
+    return scan_datasets(args.directory, args.pattern, max_depth=args.max_depth, workers=args.workers, index=_index(args))
+
+
+def cmd_scan(args):
+    scan = _scan(args)
+    for file_path, error in scan.errors:
+        print(f"{file_path}: {error}", file=sys.stderr)
+    return [dict(path=record.path, sg=record.sg, **{name: getattr(record, name) for name in CELL_FIELDS})
+            for record in scan.records]
+
+
+def cmd_stats(args):
+    scan = _scan(args)
+    stats = cell_statistics(scan.table)
+    stats["files_found"] = scan.files_found
+    stats["errors"] = len(scan.errors)
+    return stats
+
+
+def _parse_weights(text):
+    weights = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight) if weight else 1.0
+    return weights
+
+
+def _rank(args):
+    files = find_files(args.directory, args.correctlp)
+    weights = _parse_weights(args.weights) if args.weights else None
+    return rank_references(files, metric=args.metric, weights=weights, top_k=args.top, index=_index(args))
+
+
+def cmd_rank(args):
+    rows = []
+    for i, ref in enumerate(_rank(args)):
+        if ref.total is None:
+            continue
+        total = dict(zip(SHELL_DTYPE.names, ref.total))
+        row = {"rank": i, "path": ref.path, "score": ref.score, "isa": ref.correctlp.isa}
+        row.update((name, total[name]) for name in RANKING_METRICS)
+        rows.append(row)
+    return rows
+
+
+def cmd_ref(args):
+    if args.reference:
+        reference = args.reference
+    else:
+        args.top = 1
+        ranked = [ref for ref in _rank(args) if ref.total is not None]
+        if not ranked:
+            raise SystemExit(f"No CORRECT.LP with a statistics table under {args.directory}")
+        reference = ranked[0].path
+    correctlp = load_correctlp(reference)
+    sg = args.sg if args.sg is not None else correctlp.sg
+    cell = list(correctlp.cell or ())
+    if args.cell:
+        cell[:3] = args.cell
+    if sg is None or len(cell) < 3:
+        raise SystemExit(f"No space group or unit cell for {reference}, give --sg and --cell")
+
+    ascii_file = os.path.join(os.path.dirname(reference), "XDS_ASCII.HKL")
+    dest = args.dest or os.path.join(args.directory, "REF.hkl")
+    nbytes = write_reference_hkl(ascii_file, dest, sg, *cell[:3])
+    return {"reference": reference, "source": ascii_file, "dest": dest, "sg": sg, "a": cell[0], "b": cell[1], "c": cell[2],
+            "bytes": nbytes}
+
+
+def cmd_reprocess(args):
+    datasets = find_datasets(args.directory, args.pattern)
+    argv = mcr_command(args.script, args.ref, args.resolution, args.isig, args.template, autoproc=args.autoproc, anom=args.anom)
+    state = args.state or os.path.join(args.directory, MCR_STATE_FILE)
+    executor = make_executor(args.executor, args.sbatch_options.split())
+    try:
+        local = executor.local and not args.no_admission
+        admission = Admission(max_cpu=args.max_cpu, min_free=args.min_free_memory) if local else None
+    except ImportError:
+        print("codgas_cli: psutil is not installed, runs are started without checking CPU and memory", file=sys.stderr)
+        admission = None
+    scheduler = McrScheduler(datasets, argv, state, concurrency=args.jobs, retries=args.retries, skipdone=not args.no_skipdone,
+                             admission=admission, executor=executor)
+    while True:
+        try:
+            event = scheduler.events.get()
+        except KeyboardInterrupt:
+            print("codgas_cli: stopping, the unfinished datasets stay pending", file=sys.stderr)
+            scheduler.stop()
+            continue
+        if event[0] == "output":
+            print(event[2], file=sys.stderr)
+        elif event[0] == "exit":
+            return scheduler.summary
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="codgas_cli", description=__doc__.split("\n")[0])
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("directory", help="directory holding the datasets")
+    common.add_argument("--format", choices=("json", "csv"), default="json")
+    common.add_argument("--output", "-o", help="write here instead of stdout")
+    common.add_argument("--no-cache", action="store_true", help="do not use the header index")
+
+    scanning = argparse.ArgumentParser(add_help=False)
+    scanning.add_argument("--pattern", default="XDS_ASCII.HKL", help="file name to look for (default: %(default)s)")
+    scanning.add_argument("--max-depth", type=int, default=DEFAULT_MAX_DEPTH)
+    scanning.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+
+    ranking = argparse.ArgumentParser(add_help=False)
+    ranking.add_argument("--correctlp", default="**/CORRECT.LP", help="glob of the candidates (default: %(default)s)")
+    ranking.add_argument("--metric", choices=sorted(RANKING_METRICS), default="isig")
+    ranking.add_argument("--weights", help="weighted ranking, e.g. isig=1,cc12=1,rmeas=0.5")
+    ranking.add_argument("--top", type=int, help="only the best N")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("scan", parents=[common, scanning], help="space group and cell of every dataset").set_defaults(func=cmd_scan)
+    commands.add_parser("stats", parents=[common, scanning], help="space group counts and cell statistics").set_defaults(func=cmd_stats)
+    commands.add_parser("rank", parents=[common, ranking], help="rank CORRECT.LP files as references").set_defaults(func=cmd_rank)
+    ref = commands.add_parser("ref", parents=[common, ranking], help="write REF.hkl from the best (or a given) reference")
+    ref.add_argument("--reference", help="CORRECT.LP of the reference, instead of the best ranked one")
+    ref.add_argument("--sg", type=int, help="space group (default: the reference's)")
+    ref.add_argument("--cell", type=float, nargs=3, metavar=("A", "B", "C"), help="cell lengths (default: the reference's)")
+    ref.add_argument("--dest", help="REF.hkl to write (default: DIRECTORY/REF.hkl)")
+    ref.set_defaults(func=cmd_ref)
+    reprocess = commands.add_parser("reprocess", parents=[common], help="run mesh_collect_reproc in every dataset, in parallel")
+    reprocess.add_argument("--script", required=True, help="mesh_collect_reproc script")
+    reprocess.add_argument("--ref", required=True, help="reference passed to the script")
+    reprocess.add_argument("--resolution", default="1.4", help="high resolution cutoff (default: %(default)s)")
+    reprocess.add_argument("--isig", default="1", help="I/sigma cutoff (default: %(default)s)")
+    reprocess.add_argument("--template", default="id232control", help="template host (default: %(default)s)")
+    reprocess.add_argument("--autoproc", action="store_true")
+    reprocess.add_argument("--anom", action="store_true")
+    reprocess.add_argument("--pattern", default=MCR_DATASET_PATTERN, help="file marking a dataset directory (default: %(default)s)")
+    reprocess.add_argument("--executor", choices=MCR_EXECUTORS, default="local",
+                           help="where the runs go: this machine, Slurm jobs, or a local Slurm stand-in (default: %(default)s)")
+    reprocess.add_argument("--sbatch-options", default="", help='extra sbatch options, e.g. --sbatch-options="--partition=mx --time=2:00:00"')
+    reprocess.add_argument("--jobs", "-j", type=int, help="runs at a time (default: the CPU count, 64 queued batch jobs)")
+    reprocess.add_argument("--retries", type=int, default=MCR_RETRIES, help="extra attempts after a failure (default: %(default)s)")
+    reprocess.add_argument("--state", help=f"job state file (default: DIRECTORY/{MCR_STATE_FILE})")
+    reprocess.add_argument("--no-skipdone", action="store_true", help="run datasets again that the state file has as done")
+    reprocess.add_argument("--max-cpu", type=float, default=MCR_MAX_CPU, help="start no run above this CPU %% (default: %(default)s)")
+    reprocess.add_argument("--min-free-memory", type=float, default=MCR_MIN_FREE_MEMORY,
+                           help="fraction of the RAM to keep available (default: %(default)s)")
+    reprocess.add_argument("--no-admission", action="store_true", help="start runs without checking CPU and memory")
+    reprocess.set_defaults(func=cmd_reprocess)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        result = args.func(args)
+    except (OSError, ValueError) as e:
+        print(f"codgas_cli: {e}", file=sys.stderr)
+        return 1
+    if args.output:
+        with open(args.output, "w", newline="") as out:
+            emit(result, args.format, out)
+    else:
+        emit(result, args.format, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
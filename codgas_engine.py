@@ -0,0 +1,860 @@
+"""Headless data engine for the CODGAS GUI: bounded file readers, dataset scanning, header parsing,
+the header index, the in-memory unit cell table and its histograms, reference ranking and the REF.hkl writer.
+
+Nothing in here may import tkinter, customtkinter or matplotlib, so the same
+code can run on display-less cluster nodes.
+"""
+import os
+import re
+import glob
+import errno
+import heapq
+import json
+import mmap
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+from codgas_metrics import metrics
+
+
+SG_PATTERN = "SPACE_GROUP_NUMBER="
+UCC_PATTERN = "UNIT_CELL_CONSTANTS"
+DEFAULT_MAX_DEPTH = 2
+DEFAULT_WORKERS = 16  # directory listing on GPFS is latency bound, not CPU bound
+UCC_KIND = "sg_ucc_v2"  # header index kinds, bump when what their parser returns changes
+CORRECTLP_KIND = "correctlp_v1"
+HKL_HEADER_END = b"!END_OF_HEADER"
+HKL_HEADER_LIMIT = 1 << 20  # XDS headers are a few kB, never look further than this for their end
+COPY_BUFFER = 1 << 20  # buffer for the read/write fallback when the kernel cannot copy for us
+# filesystems where SQLite's WAL shared memory is unsafe; the header index uses the rollback journal there
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "gpfs", "lustre", "beegfs", "ceph", "glusterfs",
+                       "afs", "9p", "fuse.sshfs", "fuse.glusterfs", "fuse.cephfs"}
+CORRECTLP_TABLE_HEADER = "RESOLUTION NUMBER OF REFLECTIONS COMPLETENESS R-FACTOR R-FACTOR COMPARED I/SIGMA R-meas CC(1/2) Anomal SigAno Nano"
+
+# sg is an int, the six cell constants are floats
+UccRecord = namedtuple("UccRecord", "path sg a b c alpha beta gamma")
+
+# One row per dataset; path_id indexes ScanResult.paths, mtime is in seconds since the epoch
+UCC_DTYPE = np.dtype([
+    ("path_id", np.int32), ("sg", np.int16),
+    ("a", np.float64), ("b", np.float64), ("c", np.float64),
+    ("alpha", np.float64), ("beta", np.float64), ("gamma", np.float64),
+    ("mtime", np.float64),
+])
+
+
+class ScanResult:
+    def __init__(self, table, paths, files_found, errors, elapsed, cache_hits=0, cache_misses=0, bytes_read=None):
+        self.table = table                # UCC_DTYPE structured array, sorted by path
+        self.paths = paths                # table["path_id"] -> file path
+        self.files_found = files_found    # number of matching files that could be read
+        self.errors = errors              # list of (path, message)
+        self.elapsed = elapsed            # seconds
+        self.cache_hits = cache_hits      # files answered by the header index
+        self.cache_misses = cache_misses  # files that had to be parsed
+        self.bytes_read = bytes_read or {}  # path -> bytes read, for the files that were parsed
+
+    @property
+    def total_bytes_read(self):
+        return sum(self.bytes_read.values())
+
+    @property
+    def records(self):
+        """The table as a list of UccRecord, for callers that want one object per dataset."""
+        return [UccRecord(self.paths[row[0]], int(row[1]), *map(float, row.tolist()[2:8])) for row in self.table]
+
+    def __repr__(self):
+        return (f"ScanResult({len(self.table)} records, {self.files_found} files, {len(self.errors)} errors, "
+                f"{self.cache_hits} hits, {self.cache_misses} misses, {self.total_bytes_read} bytes read, {self.elapsed:.3f}s)")
+
+
+def build_ucc_table(rows):
+    """Build (table, paths) from (path, signature, UccRecord) rows, sorted by path."""
+    rows = sorted(rows, key=lambda row: row[0])
+    paths = [row[0] for row in rows]
+    table = np.array([(i, record.sg, *record[2:], sig[0] * 1e-9) for i, (_, sig, record) in enumerate(rows)], dtype=UCC_DTYPE)
+    return table, paths
+
+
+def export_ucc_log(scan, log_path):
+    """Write a scan as cell_param_<pattern>.log: 'path:<TAB>SG  a b c alpha beta gamma', tab separated."""
+    with open(log_path, "w") as log_file:
+        for row in scan.table:
+            UCC = '\t'.join(map(str, row.tolist()[2:8]))
+            log_file.write(f"{scan.paths[row['path_id']]}:\t{row['sg']}  {UCC} \n")
+
+
+CELL_FIELDS = ("a", "b", "c", "alpha", "beta", "gamma")
+
+
+def cell_statistics(table):
+    """Summary of a UCC_DTYPE table: dataset count, datasets per space group and mean/std/min/max of each cell constant."""
+    sgs, counts = np.unique(table["sg"], return_counts=True)
+    stats = {"datasets": int(len(table)), "space_groups": {int(sg): int(n) for sg, n in zip(sgs, counts)}, "cell": {}}
+    for name in CELL_FIELDS:
+        column = table[name]
+        if len(column):
+            stats["cell"][name] = {"mean": float(np.mean(column)), "std": float(np.std(column)),
+                                   "min": float(np.min(column)), "max": float(np.max(column))}
+        else:
+            stats["cell"][name] = dict.fromkeys(("mean", "std", "min", "max"), float("nan"))
+    return stats
+
+
+HISTOGRAM_BINS = 100
+
+# Everything a unit cell histogram is drawn from: the values, np.histogram counts and edges,
+# and the min/max/mean/std marked on it. Computed once per scan, redrawn at any size or DPI.
+HistogramModel = namedtuple("HistogramModel", "name values counts edges min max mean std")
+
+
+def histogram_model(name, values, bins=HISTOGRAM_BINS):
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        nan = float("nan")
+        return HistogramModel(name, values, np.zeros(bins, dtype=np.int64), np.linspace(0.0, 1.0, bins + 1), nan, nan, nan, nan)
+    counts, edges = np.histogram(values, bins=bins)
+    return HistogramModel(name, values, counts, edges, float(values.min()), float(values.max()),
+                          float(values.mean()), float(values.std()))
+
+
+def find_files(directory, pattern):
+    """Files matching a glob pattern ('**' recursive) under `directory`, sorted."""
+    return sorted(set(glob.glob(os.path.join(directory, pattern), recursive=True)))
+
+
+def default_cache_dir():
+    """$CODGAS_CACHE_DIR, or codgas/ under $XDG_CACHE_HOME (~/.cache by default)."""
+    if os.environ.get("CODGAS_CACHE_DIR"):
+        return os.environ["CODGAS_CACHE_DIR"]
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "codgas")
+
+
+def filesystem_type(path):
+    """Type of the filesystem `path` is on, as in /proc/mounts (Linux), or None when it cannot be told."""
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount = fields[1].replace("\\040", " ")
+                inside = path == mount or path.startswith(mount.rstrip("/") + "/")
+                if inside and len(mount) >= len(best):
+                    best, fstype = mount, fields[2]
+    except OSError:
+        return None
+    return fstype
+
+
+def file_signature(stat_result):
+    """What has to be unchanged for a parsed header to still be valid."""
+    return (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+
+
+class HeaderIndex:
+    """Persistent SQLite index of parsed file headers, keyed by path and parser kind.
+
+    An entry is only trusted while the file's (mtime, size, inode) signature is
+    unchanged, so a second scan of the same tree costs a stat per file and no reads.
+    Payloads are stored as JSON. Paths are stored absolute, whatever form they are
+    given in; entries of files that are gone are removed by prune(), which
+    scan_datasets calls, and entries of outdated kinds when the index is opened.
+    `hits` and `misses` count lookups since creation.
+    """
+
+    def __init__(self, db_path=None):
+        if db_path is None:
+            db_path = os.path.join(default_cache_dir(), "header_index.sqlite")
+        try:
+            if db_path != ":memory:":
+                os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            # WAL needs shared memory that NFS/GPFS cannot provide; unknown filesystems keep the default journal
+            local = db_path == ":memory:" or filesystem_type(os.path.dirname(db_path)) not in NETWORK_FILESYSTEMS | {None}
+            self._conn.execute(f"PRAGMA journal_mode={'WAL' if local else 'DELETE'}")
+        except (OSError, sqlite3.Error) as e:
+            print(f"Header index unavailable at {db_path} ({e}), keeping it in memory")
+            db_path = ":memory:"
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS headers ("
+                "path TEXT NOT NULL, kind TEXT NOT NULL, "
+                "mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, inode INTEGER NOT NULL, "
+                "payload TEXT, PRIMARY KEY (path, kind))")
+            self._conn.execute("DELETE FROM headers WHERE kind NOT IN (?, ?)", (UCC_KIND, CORRECTLP_KIND))
+
+    @staticmethod
+    def _range(directory):
+        """(absolute prefix, upper bound) of the paths below `directory`."""
+        prefix = os.path.abspath(directory).rstrip(os.sep) + os.sep
+        # every path starting with prefix sorts between prefix and prefix with its last character bumped
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    def load_prefix(self, kind, directory):
+        """Return {path: (signature, payload)} for every `kind` entry below `directory`.
+
+        The paths are given below `directory` as it was passed, relative or not,
+        the way os.path.join(directory, ...) spells them during a scan.
+        """
+        prefix, upper = self._range(directory)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, mtime_ns, size, inode, payload FROM headers WHERE kind = ? AND path >= ? AND path < ?",
+                (kind, prefix, upper)).fetchall()
+        given = directory.rstrip(os.sep) + os.sep
+        if given == prefix:
+            return {path: ((mtime_ns, size, inode), payload) for path, mtime_ns, size, inode, payload in rows}
+        return {given + path[len(prefix):]: ((mtime_ns, size, inode), payload) for path, mtime_ns, size, inode, payload in rows}
+
+    def store_many(self, kind, entries):
+        """Insert or replace (path, signature, payload) entries in one transaction."""
+        rows = [(os.path.abspath(path), kind, sig[0], sig[1], sig[2], json.dumps(payload)) for path, sig, payload in entries]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def get_or_parse(self, kind, path, parser):
+        """Return parser(path), served from the index while the file is unchanged."""
+        sig = file_signature(os.stat(path))
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT mtime_ns, size, inode, payload FROM headers WHERE path = ? AND kind = ?",
+                (os.path.abspath(path), kind)).fetchone()
+            hit = row is not None and tuple(row[:3]) == sig
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if hit:
+            metrics.count("index.hits")
+            return json.loads(row[3])
+        metrics.count("index.misses")
+        payload = parser(path)
+        self.store_many(kind, [(path, sig, payload)])
+        return payload
+
+    def count_lookups(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+        metrics.count("index.hits", hits)
+        metrics.count("index.misses", misses)
+
+    def prune(self, kind, directory, seen):
+        """Delete the `kind` entries below `directory` that are not in `seen` and whose file is gone.
+
+        A file that exists but was not seen (deeper than the scan went) keeps its entry.
+        Returns the number of entries deleted.
+        """
+        prefix, upper = self._range(directory)
+        # below an absolute, normalised directory, the paths a scan joins are already what is stored
+        seen = set(seen) if directory.rstrip(os.sep) + os.sep == prefix else {os.path.abspath(path) for path in seen}
+        with self._lock:
+            paths = [path for (path,) in self._conn.execute(
+                "SELECT path FROM headers WHERE kind = ? AND path >= ? AND path < ?", (kind, prefix, upper))]
+        gone = [(path, kind) for path in paths if path not in seen and not os.path.exists(path)]
+        if gone:
+            with self._lock, self._conn:
+                self._conn.executemany("DELETE FROM headers WHERE path = ? AND kind = ?", gone)
+        return len(gone)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM headers")
+            self.hits = 0
+            self.misses = 0
+
+    def close(self):
+        self._conn.close()
+
+
+class IOStats:
+    """Running totals of what the bounded readers touched, for the whole process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.files = 0
+        self.bytes_read = 0   # bytes of the files actually searched or copied out
+        self.bytes_total = 0  # sizes of those files
+
+    def record(self, nbytes, file_size):
+        with self._lock:
+            self.files += 1
+            self.bytes_read += nbytes
+            self.bytes_total += file_size
+
+    def fraction_read(self):
+        return self.bytes_read / self.bytes_total if self.bytes_total else 0.0
+
+
+io_stats = IOStats()
+
+# Last 'SPACE_GROUP_NUMBER=' and 'UNIT_CELL_CONSTANTS=' lines, ISa value line and statistics table
+# of a CORRECT.LP. table holds the resolution shell lines followed by the 'total' line, stripped.
+CorrectLpTail = namedtuple("CorrectLpTail", "sg_line ucc_line isa_line table")
+
+
+@contextmanager
+def _map_file(path, advice=None):
+    """Memory-map a file read-only (empty files give b"")."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if advice is not None and hasattr(mm, "madvise"):
+                mm.madvise(advice)
+            yield mm
+        finally:
+            mm.close()
+
+
+def _line_at(mm, pos):
+    """Return the decoded line of `mm` containing byte offset `pos`."""
+    start = mm.rfind(b"\n", 0, pos) + 1
+    end = mm.find(b"\n", pos)
+    return mm[start:end if end >= 0 else len(mm)].decode(errors="replace")
+
+
+def read_hkl_header(path, limit=HKL_HEADER_LIMIT):
+    """Return (header text, bytes read) of an XDS_ASCII.HKL-style file, up to and including !END_OF_HEADER.
+
+    Without the marker, the first `limit` bytes are returned.
+    """
+    with _map_file(path, getattr(mmap, "MADV_SEQUENTIAL", None)) as mm:
+        window = min(len(mm), limit)
+        end = mm.find(HKL_HEADER_END, 0, window)
+        if end < 0:
+            end = window
+        else:
+            eol = mm.find(b"\n", end, window)
+            end = window if eol < 0 else eol + 1
+        header = mm[:end].decode(errors="replace")
+        io_stats.record(end, len(mm))
+    return header, end
+
+
+def read_correctlp_tail(path):
+    """Return (CorrectLpTail, bytes read) of a CORRECT.LP, searching backwards from the end of the file.
+
+    Only the part of the file after the earliest of the things looked for is
+    touched, which for a normal CORRECT.LP is its final statistics section.
+    """
+    with _map_file(path, getattr(mmap, "MADV_RANDOM", None)) as mm:
+        size = len(mm)
+        lowest = size
+        sg_line = ucc_line = isa_line = None
+        pos = mm.rfind(b"SPACE_GROUP_NUMBER=")
+        if pos >= 0:
+            sg_line, lowest = _line_at(mm, pos), min(lowest, pos)
+        pos = mm.rfind(b"UNIT_CELL_CONSTANTS=")
+        if pos >= 0:
+            ucc_line, lowest = _line_at(mm, pos), min(lowest, pos)
+        # "     a        b          ISa" with the values on the next line
+        pos = mm.rfind(b"ISa")
+        eol = mm.find(b"\n", pos) if pos >= 0 else -1
+        if eol >= 0:
+            isa_line, lowest = _line_at(mm, eol + 1), min(lowest, pos)
+
+        # the last table header, checked with whitespace normalised since XDS versions pad differently
+        table = []
+        end = size
+        while True:
+            pos = mm.rfind(b"SigAno", 0, end)
+            if pos < 0:
+                lowest = 0
+                break
+            header = _line_at(mm, pos)
+            if CORRECTLP_TABLE_HEADER in " ".join(header.split()):
+                lowest = min(lowest, pos)
+                total_at = mm.find(b"total", pos)
+                stop = mm.find(b"\n", total_at) if total_at >= 0 else size
+                for line in mm[pos:stop if stop >= 0 else size].decode(errors="replace").splitlines()[1:]:
+                    line = line.strip()
+                    if line[:1].isdigit() or line.startswith("total"):
+                        table.append(line)
+                break
+            end = pos
+        io_stats.record(size - lowest, size)
+    return CorrectLpTail(sg_line, ucc_line, isa_line, table), size - lowest
+
+
+# One row of a CORRECT.LP statistics table; resolution is NaN on the 'total' row.
+# Percentages are stored without their '%', CC(1/2) without its '*'.
+SHELL_DTYPE = np.dtype([
+    ("resolution", np.float64), ("observed", np.int64), ("unique", np.int64), ("possible", np.int64),
+    ("completeness", np.float64), ("r_observed", np.float64), ("r_expected", np.float64), ("compared", np.int64),
+    ("isig", np.float64), ("rmeas", np.float64), ("cc12", np.float64), ("anomal_corr", np.float64),
+    ("sigano", np.float64), ("nano", np.int64),
+])
+
+# What a reference can be ranked on, with +1 where higher is better.
+# "isig" is column 8 of the 'total' line, what the GUI has always ranked on.
+RANKING_METRICS = {"isig": 1, "cc12": 1, "completeness": 1, "rmeas": -1, "sigano": 1}
+
+RankedReference = namedtuple("RankedReference", "path score total correctlp")  # total: SHELL_DTYPE row as a tuple, or None
+
+# Everything the GUI uses from one CORRECT.LP. sg, cell (six floats) and isa are None when
+# missing; lines are the raw statistics table lines and shells the same rows typed, 'total' last.
+CorrectLp = namedtuple("CorrectLp", "path sg cell isa lines shells")
+
+
+def parse_shell_line(line):
+    """Parse one statistics table line into a tuple matching SHELL_DTYPE, or None if it is malformed."""
+    tokens = line.split()
+    if len(tokens) != len(SHELL_DTYPE.names):
+        return None
+    try:
+        values = [float("nan") if tokens[0] == "total" else float(tokens[0])]
+        values += [float(token.rstrip("%*")) for token in tokens[1:]]
+    except ValueError:
+        return None
+    return tuple(values)
+
+
+def _value_after(line, index, cast):
+    try:
+        return cast(line.split("=", 1)[-1].split()[index])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def read_correctlp(file_path):
+    """Return (payload, bytes read) of a CORRECT.LP in one backwards pass; the payload is JSON friendly.
+
+    payload = {"sg": int, "cell": [6 floats], "isa": float, "lines": [table lines], "rows": [typed rows]}
+    """
+    tail, nbytes = read_correctlp_tail(file_path)
+    cell = [_value_after(tail.ucc_line, i, float) for i in range(6)]
+    rows = (parse_shell_line(line) for line in tail.table)
+    payload = {
+        "sg": _value_after(tail.sg_line, 0, int),
+        "cell": None if None in cell else cell,
+        "isa": _value_after(tail.isa_line, -1, float),
+        "lines": tail.table,
+        "rows": [list(row) for row in rows if row is not None],
+    }
+    return payload, nbytes
+
+
+def correctlp_from_payload(file_path, payload):
+    return CorrectLp(file_path, payload["sg"], payload["cell"] and tuple(payload["cell"]), payload["isa"],
+                     payload["lines"], shells_array(payload["rows"]))
+
+
+def load_correctlp(file_path, index=None):
+    """Return the CorrectLp of a file, from the header index when one is given and the file is unchanged."""
+    if index is not None:
+        payload = index.get_or_parse(CORRECTLP_KIND, file_path, lambda path: read_correctlp(path)[0])
+    else:
+        payload = read_correctlp(file_path)[0]
+    return correctlp_from_payload(file_path, payload)
+
+
+def shells_array(rows):
+    return np.array([tuple(row) for row in rows], dtype=SHELL_DTYPE)
+
+
+def correctlp_total(correctlp):
+    """The 'total' row of a CorrectLp as a tuple, or None."""
+    shells = correctlp.shells
+    return tuple(shells[-1].tolist()) if len(shells) and np.isnan(shells["resolution"][-1]) else None
+
+
+def rank_references(files, metric="isig", weights=None, top_k=None, index=None, progress=None):
+    """Rank CORRECT.LP files as reference candidates, best first, reading each file once.
+
+    The score is the 'total' row value of `metric` (negated where lower is
+    better). With `weights` ({metric: weight}), it is instead the weighted sum
+    of each metric's z-score across the candidates. Files without a 'total'
+    row score -inf and come last. With `top_k`, only the best `top_k` are
+    returned, picked with a heap instead of a full sort.
+    `progress(done, total)` is called after each file is read.
+    """
+    start = time.perf_counter()
+    weights = dict(weights) if weights else {metric: 1.0}
+    unknown = set(weights) - set(RANKING_METRICS)
+    if unknown:
+        raise ValueError(f"Unknown ranking metric(s): {', '.join(sorted(unknown))}")
+
+    files = list(files)
+    totals, records = [], []
+    for i, file_path in enumerate(files):
+        try:
+            record = load_correctlp(file_path, index)
+        except OSError:
+            record = None
+        records.append(record)
+        totals.append(correctlp_total(record) if record is not None else None)
+        if progress is not None:
+            progress(i + 1, len(files))
+
+    valid = np.array([total is not None for total in totals], dtype=bool)
+    # files without a 'total' row keep NaN in the float columns, which are all RANKING_METRICS can be
+    table = np.zeros(len(files), dtype=SHELL_DTYPE)
+    for name in SHELL_DTYPE.names:
+        if SHELL_DTYPE[name].kind == "f":
+            table[name] = np.nan
+    table[valid] = shells_array([total for total in totals if total is not None])
+    scores = np.zeros(len(files))
+    for name, weight in weights.items():
+        column = table[name] * RANKING_METRICS[name]
+        if len(weights) > 1:
+            # z-scores, so metrics on different scales can be summed
+            candidates = column[valid]
+            std = candidates.std() if candidates.size else 0.0
+            column = (column - candidates.mean()) / std if std > 0 else np.zeros_like(column)
+        scores += weight * column
+    scores[~valid | np.isnan(scores)] = -np.inf
+
+    order = range(len(files))
+    if top_k is not None:
+        order = heapq.nlargest(top_k, order, key=scores.__getitem__)
+    else:
+        order = sorted(order, key=scores.__getitem__, reverse=True)
+    metrics.timing("rank", time.perf_counter() - start)
+    return [RankedReference(files[i], float(scores[i]), totals[i], records[i]) for i in order]
+
+
+def _sg_ucc_from_lines(file_path, lines):
+    sg = None
+    for line in lines:
+        if SG_PATTERN in line:
+            sg = line.split()[1]
+        if UCC_PATTERN in line:
+            ucc = line.split()[1:7]
+            if sg is None or len(ucc) != 6:
+                return None
+            return UccRecord(file_path, int(sg), *map(float, ucc))
+    return None
+
+
+def parse_sg_ucc(file_path):
+    """Return (UccRecord or None, bytes read) for an XDS file.
+
+    *.HKL files are read up to the end of their header, *.LP files from the end
+    (the last space group and refined cell), anything else line by line up to
+    the first UNIT_CELL_CONSTANTS.
+    """
+    name = os.path.basename(file_path).upper()
+    if name.endswith(".HKL"):
+        header, nbytes = read_hkl_header(file_path)
+        return _sg_ucc_from_lines(file_path, header.splitlines()), nbytes
+    if name.endswith(".LP"):
+        payload, nbytes = read_correctlp(file_path)
+        return _correctlp_payload_to_record(file_path, payload), nbytes
+
+    nbytes = 0
+    lines = []
+    with open(file_path, 'rb') as f:
+        for line in f:
+            nbytes += len(line)
+            line = line.decode(errors="replace")
+            lines.append(line)
+            if UCC_PATTERN in line:
+                break
+        io_stats.record(nbytes, os.fstat(f.fileno()).st_size)
+    return _sg_ucc_from_lines(file_path, lines), nbytes
+
+
+def _read_sg_ucc(file_path):
+    record, nbytes = parse_sg_ucc(file_path)
+    return _record_to_payload(record), nbytes
+
+
+def _record_to_payload(record):
+    return None if record is None else list(record[1:])
+
+
+def _payload_to_record(path, payload):
+    return None if payload is None else UccRecord(path, *payload)
+
+
+def _correctlp_payload_to_record(path, payload):
+    if payload is None or payload["sg"] is None or payload["cell"] is None:
+        return None
+    return UccRecord(path, payload["sg"], *payload["cell"])
+
+
+def _parser_for(filename_pattern):
+    """(index kind, read(path) -> (payload, bytes read), payload -> UccRecord) for the files scanned.
+
+    *.LP files go through the full CORRECT.LP parser, so the scanner, the
+    reference ranking and the statistics table all share one index entry.
+    """
+    if filename_pattern.upper().endswith(".LP"):
+        return CORRECTLP_KIND, read_correctlp, _correctlp_payload_to_record
+    return UCC_KIND, _read_sg_ucc, _payload_to_record
+
+
+def _list_dir(path, filename_pattern):
+    """List one directory with os.scandir, using DirEntry type info only.
+
+    Matches are (path, signature) pairs, which costs one stat per match and
+    none for the other entries.
+    """
+    subdirs, matches = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name == filename_pattern and not entry.is_dir():
+                        # like os.walk, symlinked directories are neither files nor descended into
+                        matches.append((entry.path, file_signature(entry.stat())))
+                except OSError:
+                    continue
+    except OSError as e:
+        return subdirs, matches, [(path, str(e))]
+    return subdirs, matches, []
+
+
+def _parse_batch(matches, read):
+    """Parse a batch of (path, signature) matches with `read`.
+
+    Every match becomes a (path, signature, payload, error, was_parsed, bytes read) tuple,
+    the same shape _split_known gives to matches answered by the index.
+    """
+    results = []
+    for file_path, sig in matches:
+        try:
+            payload, nbytes = read(file_path)
+            results.append((file_path, sig, payload, None, True, nbytes))
+        except Exception as e:
+            results.append((file_path, sig, None, str(e), True, 0))
+    return results
+
+
+def _split_known(matches, known):
+    """Separate matches whose index entry is still valid from the ones that need parsing."""
+    cached, todo = [], []
+    for file_path, sig in matches:
+        entry = known.get(file_path)
+        if entry is not None and entry[0] == sig:
+            cached.append((file_path, sig, json.loads(entry[1]), None, False, 0))
+        else:
+            todo.append((file_path, sig))
+    return cached, todo
+
+
+def _scan_dirs(paths, filename_pattern, read, known):
+    """List a batch of directories, parsing their matches too with `read` unless it is None."""
+    subdirs, found, errors = [], [], []
+    for path in paths:
+        path_subdirs, path_matches, path_errors = _list_dir(path, filename_pattern)
+        subdirs.extend(path_subdirs)
+        errors.extend(path_errors)
+        if read is None:
+            found.extend(path_matches)
+            continue
+        if known is not None:
+            cached, path_matches = _split_known(path_matches, known)
+            found.extend(cached)
+        found.extend(_parse_batch(path_matches, read))
+    return subdirs, found, errors
+
+
+def _batches(items, n_batches):
+    size = max(1, -(-len(items) // n_batches))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def scan_datasets(directory, filename_pattern, max_depth=DEFAULT_MAX_DEPTH, workers=DEFAULT_WORKERS, use_processes=False, chunk_size=256, index=None,
+                  progress=None):
+    """Find every `filename_pattern` file up to `max_depth` levels below `directory` and tabulate its SG and cell.
+
+    Directories are listed level by level on a thread pool, a few batches of
+    directories per worker so the pool overhead stays small next to the I/O.
+    With threads, the task listing a directory also parses its matches. With
+    `use_processes`, the matches are parsed afterwards on a process pool, in
+    chunks of `chunk_size` files.
+
+    With a HeaderIndex, files whose signature is unchanged are answered from
+    it, and only new or modified files are parsed and written back; entries
+    of files deleted from the tree are dropped.
+    `progress(done, total)` is called after each batch of directories is
+    listed: `done` is the number of levels listed, a fraction within the
+    current one, out of max_depth + 1 levels. An exception it raises (a
+    cancelled job) drops the batches not started yet and is passed on.
+    """
+    start = time.perf_counter()
+    directory = directory.rstrip(os.sep) or os.sep
+    parsed, errors, matches = [], [], []
+    kind, read, to_record = _parser_for(filename_pattern)
+    known = index.load_prefix(kind, directory) if index is not None else None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            level = [directory]
+            for depth in range(max_depth + 1):
+                batches = _batches(level, workers * 4)
+                n = len(batches)
+                listings = pool.map(_scan_dirs, batches, [filename_pattern] * n, [None if use_processes else read] * n, [known] * n)
+                level = []
+                for i, (subdirs, found, listing_errors) in enumerate(listings):
+                    if depth < max_depth:
+                        level.extend(subdirs)
+                    if use_processes:
+                        matches.extend(found)
+                    else:
+                        parsed.extend(found)
+                    errors.extend(listing_errors)
+                    if progress is not None:
+                        progress(depth + (i + 1) / n, max_depth + 1)
+                if not level:
+                    break
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)  # only the batches already running are waited for
+            raise
+
+    if matches:
+        if known is not None:
+            cached, matches = _split_known(matches, known)
+            parsed.extend(cached)
+        chunks = [matches[i:i + chunk_size] for i in range(0, len(matches), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for batch in pool.map(_parse_batch, chunks, [read] * len(chunks)):
+                parsed.extend(batch)
+
+    rows, fresh = [], []
+    files_found = misses = 0
+    bytes_read = {}
+    for file_path, sig, payload, error, was_parsed, nbytes in parsed:
+        if error is not None:
+            errors.append((file_path, error))
+            print(f"An error occurred while processing {file_path}: {error}")
+            continue
+        files_found += 1
+        if was_parsed:
+            misses += 1
+            bytes_read[file_path] = nbytes
+            fresh.append((file_path, sig, payload))
+        record = to_record(file_path, payload)
+        if record is not None:
+            rows.append((file_path, sig, record))
+
+    hits = files_found - misses
+    if index is not None:
+        index.store_many(kind, fresh)
+        index.count_lookups(hits, misses)
+        index.prune(kind, directory, (file_path for file_path, *_ in parsed))
+
+    table, paths = build_ucc_table(rows)
+    seconds = time.perf_counter() - start
+    metrics.count("scan.files", files_found)
+    metrics.gauge("scan.files_per_second", files_found / seconds if seconds > 0 else 0.0)
+    metrics.timing("scan", seconds)
+    return ScanResult(table, paths, files_found, errors, seconds,
+                      cache_hits=hits if index is not None else 0, cache_misses=misses, bytes_read=bytes_read)
+
+
+def _rewrite_header_line(line, sg, a, b, c):
+    """Return a REF.hkl header line: the space group and the a, b, c cell lengths replaced, the rest as is."""
+    text = line.decode(errors="replace")
+    if "!SPACE_GROUP_NUMBER=" in text:
+        return f"!SPACE_GROUP_NUMBER=\t{sg}\n".encode()
+    if "!UNIT_CELL_CONSTANTS=" in text:
+        numbers = re.findall(r'\d+\.\d+', text.split('=', 1)[1])
+        numbers[:3] = [str(a), str(b), str(c)]
+        return ("!UNIT_CELL_CONSTANTS=\t" + '\t'.join(numbers) + "\n").encode()
+    return line
+
+
+def _copy_body(src_fd, dst_fd, offset, size):
+    """Append bytes offset..size of src_fd to dst_fd, in the kernel when it can (copy_file_range, sendfile).
+
+    A kernel copy that stops making progress (some FUSE and NFS mounts, old kernels)
+    hands over to pread/write. Raises OSError unless all the bytes were copied.
+    """
+    for kernel_copy in ("copy_file_range", "sendfile"):
+        if not hasattr(os, kernel_copy):
+            continue
+        try:
+            while offset < size:
+                if kernel_copy == "copy_file_range":
+                    n = os.copy_file_range(src_fd, dst_fd, size - offset, offset)
+                else:
+                    n = os.sendfile(dst_fd, src_fd, offset, size - offset)
+                if n == 0:
+                    break  # no progress: the rest goes through the fallback
+                offset += n
+        except OSError as e:
+            # other filesystem, old kernel, not supported for this pair of files: try the next way
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSOCK, errno.EBADF):
+                raise
+        if offset >= size:
+            return
+    while offset < size:
+        chunk = os.pread(src_fd, min(COPY_BUFFER, size - offset), offset)
+        if not chunk:
+            break
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(dst_fd, view):]
+        offset += len(chunk)
+    if offset < size:
+        raise OSError(errno.EIO, f"source ended {size - offset} bytes early while copying")
+
+
+def write_reference_hkl(source, dest, sg, a, b, c):
+    """Write `dest` as a copy of the XDS_ASCII.HKL `source` with its space group and a, b, c replaced.
+
+    Only the header is read and rewritten; the reflections after it are copied
+    as they are without going through Python. The copy is written next to
+    `dest` and renamed over it at the end, so `dest` is never half written.
+    Returns the number of bytes written.
+    """
+    dest_dir = os.path.dirname(os.path.abspath(dest))
+    with open(source, 'rb') as src:
+        size = os.fstat(src.fileno()).st_size
+        header = []
+        offset = 0
+        for line in src:
+            offset += len(line)
+            header.append(_rewrite_header_line(line, sg, a, b, c))
+            if HKL_HEADER_END in line or offset >= HKL_HEADER_LIMIT:
+                break
+        header = b"".join(header)
+
+        fd, tmp_path = tempfile.mkstemp(prefix=".REF.", suffix=".tmp", dir=dest_dir)
+        try:
+            # the source's permissions, but always writable by us: XDS_ASCII.HKL is often read-only
+            os.fchmod(fd, os.fstat(src.fileno()).st_mode & 0o777 | 0o200)
+            os.write(fd, header)
+            _copy_body(src.fileno(), fd, offset, size)
+            os.fsync(fd)
+            os.close(fd)
+            fd = None
+            os.replace(tmp_path, dest)
+        except BaseException:
+            if fd is not None:
+                os.close(fd)
+            os.unlink(tmp_path)
+            raise
+    return len(header) + size - offset
@@ -0,0 +1,769 @@
+"""Running mesh_collect_reproc.perl (MCR) for the CODGAS GUI, without Tk.
+
+McrRun starts the script in a process group of its own and streams its stdout
+and stderr line by line, from two reader threads, into a queue that the GUI
+drains with after(). Lines telling how far the reprocessing is ("3/120 ...",
+"dataset 3 of 120 ...") also become progress events. stop() terminates the
+whole group, so whatever the script started goes with it.
+
+McrScheduler instead runs the script once per dataset directory, at most
+`concurrency` at a time, retrying failures. Its state is kept in a JSON file
+next to the datasets, so a new run resumes where the last one stopped: with
+skipdone, datasets recorded as done are not run again. It puts the same
+events on its queue as McrRun, so the GUI follows either the same way.
+With psutil installed, Admission holds new runs back while the CPU is busy
+or the memory the next run is expected to need (from the peak RSS of the
+runs so far) is not available, and pauses runs when memory gets short.
+
+Where the runs go is up to the scheduler's executor: LocalExecutor starts
+them on this machine, SlurmExecutor submits them with sbatch and follows all
+of them with one squeue call per poll (and one sacct call for those that left
+the queue), not one call per job. MockExecutor is SlurmExecutor pointed at
+a local stand-in of these commands, to run the whole batch flow offline:
+
+    python codgas_cli.py reprocess DIR --script codgas_mcr.py --ref REF.hkl --executor mock
+
+    python codgas_mcr.py [--fake 20] [--delay 0.2] [--fail STATUS] [MCR options...]
+
+is a stand-in for the perl script: it accepts the same options, prints
+synthetic per-dataset progress and a few stderr lines, for trying the GUI
+(select codgas_mcr.py as the script) and McrRun where the real script and
+its data are not available.
+"""
+import collections
+import json
+import os
+import queue
+import re
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from codgas_engine import find_files
+from codgas_metrics import metrics
+
+
+MCR_STOP_GRACE = 5.0  # seconds between SIGTERM and SIGKILL of the process group
+MCR_RETRIES = 1  # extra attempts for a dataset whose run failed
+MCR_SUBMIT_RETRY_DELAY = 30.0  # seconds without submitting after a submission failed (sbatch refused, busy controller)
+MCR_STATE_FILE = "codgas_mcr_state.json"  # per-dataset job state, in the datasets directory
+MCR_DATASET_PATTERN = "XDS_ASCII.HKL"  # a directory holding this file is a dataset
+MCR_MAX_CPU = 90.0  # % of all CPUs in use above which no further run is started
+MCR_MIN_FREE_MEMORY = 0.10  # fraction of the RAM left available after admitting a run
+MCR_PAUSE_FREE_MEMORY = 0.05  # below this fraction available, the newest runs are paused (SIGSTOP)
+MCR_SAMPLE_INTERVAL = 1.0  # seconds between two CPU/memory samples of the scheduler
+MCR_EXECUTORS = ("local", "slurm", "mock")  # see make_executor()
+MCR_BATCH_JOBS = 64  # jobs in the batch queue at a time, unless a concurrency is given
+MCR_BATCH_POLL_INTERVAL = 10.0  # seconds between two squeue calls, one call for all the jobs
+MCR_MOCK_POLL_INTERVAL = 1.0  # the same for the local stand-in, which answers at once
+MCR_BATCH_MISSING = 3  # polls a job may be out of the queue without an sacct record before it counts as failed
+MCR_BATCH_LOG = "codgas_mcr_%j.log"  # a batch job's output, in its dataset directory; %j is the job id
+MCR_SBATCH_OPTIONS = ()  # extra sbatch options, e.g. ("--partition=mx", "--time=2:00:00")
+MCR_INTERPRETERS = {".pl": "perl", ".perl": "perl", ".py": sys.executable}  # for scripts that are not executable
+# "3/120", "[3/120]", "dataset 3 of 120", "Processing dataset 3/120: name", at the start of a line
+MCR_PROGRESS_RE = re.compile(r'^\s*\[?\s*(?:processing\s+)?(?:dataset\s+)?(\d+)\s*(?:/|of)\s*(\d+)\s*\]?[\s:,-]*(.*?)\s*$',
+                             re.IGNORECASE)
+
+
+def mcr_command(mcr_path, ref, resolution, isig, template, autoproc=False, anom=False, skipdone=False):
+    """The argv running mesh_collect_reproc with the GUI's options, valid in any working directory."""
+    mcr_path, ref = (os.path.abspath(path) if os.path.exists(path) else path for path in (str(mcr_path), str(ref)))
+    argv = [mcr_path]
+    interpreter = MCR_INTERPRETERS.get(os.path.splitext(mcr_path)[1].lower())
+    if interpreter and not os.access(mcr_path, os.X_OK):
+        argv.insert(0, interpreter)
+    argv += ["--ref", str(ref), "--resolution", str(resolution), "--i_sig_cut", str(isig)]
+    if autoproc:
+        argv.append("--autoproc")
+    if anom:
+        argv.append("--anom")
+    if skipdone:
+        argv.append("--skipdone")
+    argv += ["--template_host", str(template)]
+    return argv
+
+
+def find_datasets(directory, pattern=MCR_DATASET_PATTERN):
+    """The dataset directories under `directory`: those holding a `pattern` file, sorted."""
+    return sorted({os.path.dirname(path) for path in find_files(directory, os.path.join("**", pattern))})
+
+
+def parse_progress(line):
+    """(done, total, label) if `line` reports progress, else None."""
+    match = MCR_PROGRESS_RE.match(line)
+    if match is None:
+        return None
+    done, total = int(match.group(1)), int(match.group(2))
+    if total == 0 or done > total:
+        return None
+    return done, total, match.group(3)
+
+
+class McrRun:
+    """One run of the MCR script. Events are put on `events` (a queue.Queue):
+
+        ("output", "stdout" | "stderr", line)
+        ("progress", done, total, label)
+        ("exit", returncode)             last event; negative if killed by a signal
+    """
+
+    def __init__(self, argv, cwd=None, events=None):
+        self.argv = list(argv)
+        self.events = events if events is not None else queue.Queue()
+        self.stopping = False
+        self.paused = False
+        self.peak_memory = 0  # highest memory() seen, kept up to date by McrScheduler
+        self.process = subprocess.Popen(self.argv, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, text=True, bufsize=1, errors="replace",
+                                        start_new_session=True)  # its own process group, see stop()
+        readers = [threading.Thread(target=self._read, args=(self.process.stdout, "stdout"), daemon=True),
+                   threading.Thread(target=self._read, args=(self.process.stderr, "stderr"), daemon=True)]
+        for reader in readers:
+            reader.start()
+        threading.Thread(target=self._wait, args=(readers,), daemon=True).start()
+
+    def _read(self, pipe, stream):
+        with pipe:
+            for line in pipe:
+                line = line.rstrip("\n")
+                self.events.put(("output", stream, line))
+                progress = parse_progress(line) if stream == "stdout" else None
+                if progress is not None:
+                    self.events.put(("progress",) + progress)
+
+    def _wait(self, readers):
+        for reader in readers:
+            reader.join()
+        self.events.put(("exit", self.process.wait()))
+
+    @property
+    def running(self):
+        return self.process.poll() is None
+
+    def stop(self, grace=MCR_STOP_GRACE):
+        """SIGTERM the process group, SIGKILL it if still there after `grace` seconds. Does not block."""
+        if not self.running:
+            return
+        self.stopping = True
+        self._signal(signal.SIGTERM)
+        self.resume()  # a paused group only sees the SIGTERM once continued
+        timer = threading.Timer(grace, lambda: self.running and self._signal(signal.SIGKILL))
+        timer.daemon = True
+        timer.start()
+
+    def pause(self):
+        self.paused = True
+        self._signal(signal.SIGSTOP)
+
+    def resume(self):
+        if self.paused:
+            self.paused = False
+            self._signal(signal.SIGCONT)
+
+    def memory(self, psutil):
+        """RSS of the run's processes, its children included, in bytes."""
+        try:
+            parent = psutil.Process(self.process.pid)
+            processes = [parent] + parent.children(recursive=True)
+        except psutil.Error:
+            return 0
+        rss = 0
+        for process in processes:
+            try:
+                rss += process.memory_info().rss
+            except psutil.Error:
+                pass  # exited meanwhile
+        return rss
+
+    def _signal(self, signum):
+        try:
+            os.killpg(self.process.pid, signum)
+        except ProcessLookupError:
+            pass  # already gone
+
+
+class Admission:
+    """Resource checks of McrScheduler, from psutil.
+
+    A new run is admitted while the CPUs are less than `max_cpu` % busy and the
+    available memory, less what the new run is expected to use, stays above
+    `min_free` of the RAM. The expected use is the highest peak RSS of the last
+    runs (their whole process trees), nothing before the first run has ended.
+    With nothing running, a run is always admitted, so the queue moves on.
+    """
+
+    def __init__(self, max_cpu=MCR_MAX_CPU, min_free=MCR_MIN_FREE_MEMORY, pause_free=MCR_PAUSE_FREE_MEMORY):
+        import psutil
+        self.psutil = psutil
+        self.max_cpu = max_cpu
+        self.min_free = min_free
+        self.pause_free = pause_free
+        self.peaks = collections.deque(maxlen=20)
+        self.cpu = psutil.cpu_percent(None)  # the first call only starts the measurement
+        self.memory = psutil.virtual_memory()
+        self.sampled = 0.0
+
+    def sample(self, runs):
+        """Refresh CPU, memory and the runs' peak RSS, at most every MCR_SAMPLE_INTERVAL. True if refreshed."""
+        now = time.monotonic()
+        if now - self.sampled < MCR_SAMPLE_INTERVAL:
+            return False
+        self.sampled = now
+        self.cpu = self.psutil.cpu_percent(None)
+        self.memory = self.psutil.virtual_memory()
+        for run in runs:
+            run.peak_memory = max(run.peak_memory, run.memory(self.psutil))
+        return True
+
+    def record(self, run):
+        if run.peak_memory:
+            self.peaks.append(run.peak_memory)
+
+    def expected_memory(self):
+        return max(self.peaks, default=0)
+
+    def admit(self, running):
+        """None if one more run may start, else why not."""
+        if running == 0:
+            return None
+        if self.cpu > self.max_cpu:
+            return f"CPU {self.cpu:.0f}% busy"
+        if self.memory.available - self.expected_memory() < self.min_free * self.memory.total:
+            return f"{self.memory.available / 2**30:.1f} GiB available, a run needs {self.expected_memory() / 2**30:.2f}"
+        return None
+
+    def memory_short(self):
+        return self.memory.available < self.pause_free * self.memory.total
+
+    def memory_back(self):
+        return self.memory.available - self.expected_memory() >= self.min_free * self.memory.total
+
+
+class _Tagged:
+    """A queue-like object putting (tag, event) on a shared queue, for McrRun(events=...)."""
+
+    def __init__(self, tag, events):
+        self.tag = tag
+        self.events = events
+
+    def put(self, event):
+        self.events.put((self.tag, event))
+
+
+class LocalExecutor:
+    """Runs on this machine, one McrRun each, which reports its output and exit itself."""
+
+    name = "local"
+    local = True  # Admission applies: the runs share this machine's CPUs and memory
+    calls = 0
+
+    def submit(self, dataset, argv, events):
+        return McrRun(argv, cwd=dataset, events=events)
+
+    def poll(self):
+        pass
+
+    def stop(self, runs, grace=MCR_STOP_GRACE):
+        for run in runs:
+            run.stop(grace)
+
+
+class BatchJob:
+    """A run submitted to a batch scheduler, with the McrRun attributes McrScheduler reads."""
+
+    paused = False
+    peak_memory = 0
+
+    def __init__(self, executor, job_id, log, events):
+        self.executor = executor
+        self.job_id = job_id
+        self.log = log
+        self.events = events
+        self.state = "PENDING"
+        self.missing = 0  # polls without a queue entry nor an accounting record
+        self.stopping = False
+
+    @property
+    def running(self):
+        return self.job_id in self.executor.jobs
+
+    def stop(self, grace=MCR_STOP_GRACE):
+        self.executor.stop([self], grace)
+
+
+class SlurmExecutor:
+    """Submits each run as a Slurm job with sbatch, in its dataset directory, and polls the jobs in batches.
+
+    poll(), at most every `interval` seconds, asks squeue for all the submitted
+    jobs at once and sacct for the exit status of those that left the queue,
+    then puts their ("exit", returncode) events. The output of a job is in its
+    MCR_BATCH_LOG; only state changes are reported as output. The commands are
+    argv lists, so that MockExecutor can swap in its stand-in.
+    """
+
+    name = "slurm"
+    local = False
+
+    def __init__(self, options=MCR_SBATCH_OPTIONS, interval=MCR_BATCH_POLL_INTERVAL, sbatch=("sbatch",),
+                 squeue=("squeue",), sacct=("sacct",), scancel=("scancel",)):
+        self.options = list(options)
+        self.interval = interval
+        self.sbatch, self.squeue, self.sacct, self.scancel = (list(command) for command in (sbatch, squeue, sacct, scancel))
+        self.jobs = {}  # job id -> BatchJob, while queued or running
+        self.polled = 0.0
+        self.calls = 0  # scheduler commands run so far
+
+    def _call(self, argv):
+        self.calls += 1
+        return subprocess.run(argv, stdin=subprocess.DEVNULL, capture_output=True, text=True, errors="replace")
+
+    def submit(self, dataset, argv, events):
+        log = os.path.join(dataset, MCR_BATCH_LOG)
+        result = self._call(self.sbatch + ["--parsable", f"--chdir={dataset}", f"--job-name=mcr_{os.path.basename(dataset)}",
+                                           f"--output={log}"] + self.options + ["--wrap", shlex.join(argv)])
+        job_id = result.stdout.strip().split(";")[0]  # --parsable: "id" or "id;cluster"
+        if result.returncode != 0 or not job_id:
+            raise OSError(f"sbatch failed: {result.stderr.strip() or f'exit status {result.returncode}'}")
+        job = BatchJob(self, job_id, log.replace("%j", job_id), events)
+        self.jobs[job_id] = job
+        events.put(("output", "stdout", f"submitted as job {job_id}"))
+        return job
+
+    def poll(self):
+        now = time.monotonic()
+        if not self.jobs or now - self.polled < self.interval:
+            return
+        self.polled = now
+        result = self._call(self.squeue + ["--noheader", "--format=%i %T", f"--jobs={','.join(self.jobs)}"])
+        if result.returncode != 0 and not result.stdout and "Invalid job id" not in result.stderr:
+            next(iter(self.jobs.values())).events.put(("output", "stderr", f"squeue failed: {result.stderr.strip()}"))
+            return  # the controller did not answer, try again next time
+        queued = {}
+        for line in result.stdout.splitlines():
+            fields = line.split()
+            if len(fields) == 2 and fields[0] in self.jobs:
+                queued[fields[0]] = fields[1]
+        for job_id, state in queued.items():
+            job = self.jobs[job_id]
+            if state != job.state:
+                job.state = state
+                job.events.put(("output", "stdout", f"job {job_id} {state.lower()}"))
+        gone = [job_id for job_id in self.jobs if job_id not in queued]
+        if gone:
+            self._finish(gone)
+
+    def _finish(self, job_ids):
+        """Exit events for the jobs `job_ids` that sacct has as ended."""
+        result = self._call(self.sacct + ["--noheader", "--parsable2", "--format=JobID,State,ExitCode",
+                                          f"--jobs={','.join(job_ids)}"])
+        records = {}
+        for line in result.stdout.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[0] in self.jobs:  # not the "id.batch" steps
+                records[fields[0]] = fields[1].split()[0], fields[2]  # "CANCELLED by 1000" -> "CANCELLED"
+        for job_id in job_ids:
+            job = self.jobs[job_id]
+            state, exit_code = records.get(job_id, (None, None))
+            if state in ("PENDING", "RUNNING", "REQUEUED", "RESIZING", "SUSPENDED"):
+                continue  # accounting lags behind squeue
+            if state is None:
+                job.missing += 1
+                if job.missing < MCR_BATCH_MISSING:
+                    continue
+                state, returncode = "UNKNOWN", 1
+            else:
+                code, _, signum = exit_code.partition(":")
+                returncode = -int(signum) if signum.strip("0") else int(code or 0)
+                if returncode == 0 and state != "COMPLETED":
+                    returncode = 1  # TIMEOUT, NODE_FAIL, OUT_OF_MEMORY ...
+            del self.jobs[job_id]
+            job.events.put(("output", "stdout" if returncode == 0 else "stderr", f"job {job_id} {state.lower()}, log {job.log}"))
+            job.events.put(("exit", returncode))
+
+    def stop(self, runs, grace=MCR_STOP_GRACE):
+        """scancel the jobs of `runs`, in one call. Their exits come with the next poll()."""
+        job_ids = [run.job_id for run in runs]
+        for run in runs:
+            run.stopping = True
+        if job_ids:
+            self._call(self.scancel + job_ids)
+            self.polled = 0.0
+
+
+class MockExecutor(SlurmExecutor):
+    """SlurmExecutor against the local stand-in of sbatch, squeue, sacct and scancel (see _mock_batch).
+
+    The jobs run on this machine, their records are files in `spool` (a new
+    temporary directory by default), so the batch flow works without Slurm.
+    """
+
+    name = "mock"
+
+    def __init__(self, spool=None, options=(), interval=MCR_MOCK_POLL_INTERVAL):
+        self.spool = spool or tempfile.mkdtemp(prefix="codgas_mock_batch_")
+        stand_in = [sys.executable, os.path.abspath(__file__), "--mock-batch", self.spool]
+        super().__init__(options, interval, *(stand_in + [command] for command in ("sbatch", "squeue", "sacct", "scancel")))
+
+
+def make_executor(name, options=MCR_SBATCH_OPTIONS):
+    """The executor called `name`, one of MCR_EXECUTORS."""
+    if name == "local":
+        return LocalExecutor()
+    if name == "slurm":
+        return SlurmExecutor(options)
+    if name == "mock":
+        return MockExecutor(options=options)
+    raise ValueError(f"Unknown executor {name!r}, expected one of {', '.join(MCR_EXECUTORS)}")
+
+
+class McrScheduler:
+    """Reprocess `datasets` with one run of `argv` in each dataset directory, `concurrency` at a time.
+
+    A failed run is retried up to `retries` more times. The status of every dataset
+    (pending, running, done, failed, attempts, exit status, seconds) is written to
+    `state_path` after each change; with `skipdone`, datasets already done there are
+    skipped, otherwise they are run again. Events, as McrRun's:
+
+        ("output", stream, "dataset: line")
+        ("progress", finished, total, "N.N datasets/min")
+        ("exit", 0 if every dataset is done, else 1)
+
+    `summary` holds the counts and the throughput once it exits, status() the
+    live counts and resources. With `admission` (an Admission, or True for the
+    default thresholds), runs also wait for CPU and memory, see Admission.
+    The runs go to `executor` (LocalExecutor by default); with a batch
+    executor `concurrency` is the number of jobs in the queue at a time and
+    admission is off, the jobs do not run on this machine.
+    """
+
+    def __init__(self, datasets, argv, state_path, concurrency=None, retries=MCR_RETRIES, skipdone=True, events=None,
+                 admission=True, executor=None):
+        self.datasets = [os.path.abspath(dataset) for dataset in datasets]
+        self.argv = list(argv)
+        self.state_path = state_path
+        self.executor = executor if executor is not None else LocalExecutor()
+        if not self.executor.local:
+            admission = None
+        self.concurrency = max(1, concurrency or (os.cpu_count() if self.executor.local else MCR_BATCH_JOBS) or 1)
+        self.retries = retries
+        self.skipdone = skipdone
+        self.events = events if events is not None else queue.Queue()
+        self.stopping = False
+        self.summary = None
+        self.state = self._load_state()
+        if admission is True:
+            try:
+                admission = Admission()
+            except ImportError:
+                print("psutil is not installed: runs are started without checking CPU and memory")
+                admission = None
+        self.admission = admission or None
+        self.held = None  # why the next run waits, None if it does not
+        self._status = {}
+        self._runs = {}  # dataset -> McrRun or BatchJob, in start order
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._schedule, daemon=True)
+        self._thread.start()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Ignoring {self.state_path}: {e}")
+            return {}
+
+    def _save_state(self):
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp, self.state_path)
+
+    def _output(self, line, stream="stdout"):
+        self.events.put(("output", stream, line))
+
+    def _schedule(self):
+        try:
+            returncode = self._run_all()
+        except Exception as e:
+            self._output(f"MCR scheduler failed: {e}", "stderr")
+            self.stop()
+            returncode = 1
+        self.events.put(("exit", returncode))
+
+    def _run_all(self):
+        start = time.perf_counter()
+        todo = collections.deque()
+        for dataset in self.datasets:
+            entry = self.state.get(dataset)
+            if self.skipdone and entry is not None and entry["status"] == "done":
+                continue
+            self.state[dataset] = {"status": "pending", "attempts": 0}
+            todo.append(dataset)
+        total, skipped = len(todo), len(self.datasets) - len(todo)
+        self._save_state()
+        self._output(f"{total} datasets to reprocess ({skipped} already done), {self.concurrency} at a time ({self.executor.name})")
+
+        exits = queue.Queue()
+        finished = failed = 0
+        changed = False
+        submit_after = 0.0  # perf_counter() before which nothing is submitted, after a failed submission
+        while (todo and not self.stopping) or self._runs:
+            if self.admission is not None and self.admission.sample(self._runs.values()):
+                self._balance_memory()
+            while todo and not self.stopping and len(self._runs) < self.concurrency and time.perf_counter() >= submit_after:
+                self.held = self.admission.admit(len(self._runs)) if self.admission is not None else None
+                if self.held is not None:
+                    break
+                dataset = todo.popleft()
+                entry = self.state[dataset]
+                entry.update(status="running", attempts=entry["attempts"] + 1, started=time.time())
+                changed = True
+                try:
+                    run = self.executor.submit(dataset, self.argv, _Tagged(dataset, exits))
+                except OSError as e:
+                    entry.update(error=str(e))
+                    if entry["attempts"] <= self.retries:  # counts against the retries like a failed run
+                        entry["status"] = "pending"
+                        todo.append(dataset)
+                        submit_after = time.perf_counter() + MCR_SUBMIT_RETRY_DELAY
+                        self._output(f"{dataset}: {e}, retrying in {MCR_SUBMIT_RETRY_DELAY:.0f} s", "stderr")
+                    else:
+                        entry["status"] = "failed"
+                        failed += 1
+                        self._output(f"{dataset}: {e}", "stderr")
+                    continue
+                entry.pop("error", None)  # from a failed submission before
+                with self._lock:
+                    self._runs[dataset] = run
+                if self.stopping:
+                    run.stop()  # stop() came while this one was starting
+            if changed:
+                self._save_state()
+                changed = False
+            minutes = (time.perf_counter() - start) / 60
+            self._update_status(len(todo), finished, failed, finished / minutes if minutes else 0.0)
+            if not self._runs:
+                if todo and not self.stopping:
+                    time.sleep(min(MCR_SAMPLE_INTERVAL, max(0.0, submit_after - time.perf_counter())))
+                continue  # nothing could be started
+
+            self.executor.poll()
+            try:
+                dataset, event = exits.get(timeout=MCR_SAMPLE_INTERVAL)
+            except queue.Empty:
+                continue  # sample the resources again, maybe admit a run
+            if event[0] == "output":
+                self._output(f"{os.path.basename(dataset)}: {event[2]}", event[1])
+                continue
+            if event[0] != "exit":
+                continue  # the script's own progress lines, one dataset here
+            with self._lock:
+                run = self._runs.pop(dataset)
+            if self.admission is not None:
+                self.admission.record(run)
+            entry = self.state[dataset]
+            returncode = event[1]
+            entry.update(returncode=returncode, seconds=round(time.time() - entry.pop("started"), 1))
+            if run.peak_memory:
+                entry["peak_memory"] = run.peak_memory
+            if returncode == 0:
+                entry["status"] = "done"
+                finished += 1
+            elif self.stopping:
+                entry.update(status="pending", attempts=entry["attempts"] - 1)  # stopped, not failed: run again next time
+            elif entry["attempts"] <= self.retries:
+                entry["status"] = "pending"
+                todo.append(dataset)
+                self._output(f"{dataset}: exit status {returncode}, retrying", "stderr")
+            else:
+                entry["status"] = "failed"
+                failed += 1
+            changed = True
+            minutes = (time.perf_counter() - start) / 60
+            self.events.put(("progress", finished + failed, total, f"{finished / minutes:.1f} datasets/min"))
+        self._save_state()
+        elapsed = time.perf_counter() - start
+        self._update_status(0, finished, failed, finished / (elapsed / 60) if elapsed > 0 else 0.0)
+        self.summary = {"datasets": len(self.datasets), "skipped": skipped, "done": finished, "failed": failed,
+                        "pending": total - finished - failed, "seconds": round(elapsed, 1),
+                        "datasets_per_minute": round(finished / (elapsed / 60), 2) if elapsed > 0 else 0.0}
+        self._output(f"{finished} done, {failed} failed, {self.summary['pending']} pending, "
+                     f"{self.summary['datasets_per_minute']} datasets/min, state in {self.state_path}")
+        if not self.executor.local:
+            self._output(f"{self.executor.calls} {self.executor.name} scheduler commands for {total} datasets")
+        return 0 if finished == total else 1
+
+    def _balance_memory(self):
+        """Pause the newest run while memory is short (one per sample), continue the oldest paused one once it is back."""
+        runs = list(self._runs.values())
+        active = [run for run in runs if not run.paused]
+        paused = [run for run in runs if run.paused]
+        if self.admission.memory_short() and len(active) > 1:
+            active[-1].pause()
+            self._output(f"memory short, {len(paused) + 1} run(s) paused", "stderr")
+        elif paused and (self.admission.memory_back() or not active):  # one run always goes on
+            paused[0].resume()
+            self._output(f"memory back, {len(paused) - 1} run(s) still paused", "stderr")
+
+    def _update_status(self, queued, finished, failed, rate):
+        paused = sum(run.paused for run in self._runs.values())
+        status = {"running": len(self._runs) - paused, "paused": paused, "queued": queued, "done": finished,
+                  "failed": failed, "datasets_per_minute": rate, "held": self.held}
+        if self.admission is not None:
+            status.update(cpu=self.admission.cpu, memory_available=self.admission.memory.available,
+                          memory_total=self.admission.memory.total, expected_memory=self.admission.expected_memory())
+        with self._lock:
+            self._status = status
+        metrics.gauge("mcr.running", status["running"])
+        metrics.gauge("mcr.datasets_per_minute", rate)
+
+    def status(self):
+        """Live counts (running, paused, queued, done, failed), datasets/min, why runs are held, CPU % and memory."""
+        with self._lock:
+            return dict(self._status)
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def stop(self, grace=MCR_STOP_GRACE):
+        """Start no more datasets and stop the running ones; they stay pending in the state file."""
+        self.stopping = True
+        with self._lock:
+            runs = list(self._runs.values())
+        self.executor.stop(runs, grace)
+
+
+def _fake_mcr(argv):
+    """The stand-in script, see the module docstring."""
+    import argparse
+    parser = argparse.ArgumentParser(prog="codgas_mcr.py")
+    parser.add_argument("--fake", type=int, default=20, metavar="N", help="number of synthetic datasets")
+    parser.add_argument("--delay", type=float, default=0.2, help="seconds per dataset")
+    parser.add_argument("--fail", type=int, default=0, help="exit with this status after the last dataset")
+    args, mcr_options = parser.parse_known_args(argv)
+    print(f"mesh_collect_reproc stand-in: {' '.join(mcr_options)}", flush=True)
+    for i in range(1, args.fake + 1):
+        time.sleep(args.delay)
+        print(f"dataset {i}/{args.fake}: fake_dataset_{i:04d}", flush=True)
+        if i % 5 == 0:
+            print(f"fake_dataset_{i:04d}: WARNING low completeness", file=sys.stderr, flush=True)
+    return args.fail
+
+
+def _mock_batch(argv):
+    """The batch scheduler stand-in of MockExecutor: codgas_mcr.py --mock-batch SPOOL COMMAND [ARGS...].
+
+    COMMAND is sbatch, squeue, sacct or scancel, taking the options SlurmExecutor
+    passes; each job gets a runner process ("run") in a process group of its own.
+    A job is SPOOL/ID.job (its command), .pid (its runner), .exit (its exit
+    status, once ended) and .cancelled (after scancel).
+    """
+    import argparse
+    spool, command, args = argv[0], argv[1], argv[2:]
+    os.makedirs(spool, exist_ok=True)
+
+    def record(job_id, kind):
+        return os.path.join(spool, f"{job_id}.{kind}")
+
+    def read(job_id, kind):
+        try:
+            with open(record(job_id, kind)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def state(job_id):
+        """(state, "exitcode:signal") as sacct has them."""
+        returncode = read(job_id, "exit")
+        if returncode is not None:
+            returncode = int(returncode)
+            if returncode == 0:
+                return "COMPLETED", "0:0"
+            return "FAILED", f"0:{-returncode}" if returncode < 0 else f"{returncode}:0"
+        if read(job_id, "cancelled") is not None:
+            return "CANCELLED", "0:15"
+        pid = read(job_id, "pid")
+        if pid is None:
+            return "PENDING", "0:0"
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return "FAILED", "1:0"  # the runner died without recording an exit status
+        return "RUNNING", "0:0"
+
+    def job_ids():
+        listed = next((arg.split("=", 1)[1] for arg in args if arg.startswith("--jobs=")), "")
+        return [job_id for job_id in listed.split(",") if read(job_id, "job") is not None]
+
+    if command == "sbatch":
+        parser = argparse.ArgumentParser(prog="sbatch")
+        parser.add_argument("--parsable", action="store_true")
+        parser.add_argument("--chdir", default=os.getcwd())
+        parser.add_argument("--job-name")
+        parser.add_argument("--output", default="slurm-%j.out")
+        parser.add_argument("--wrap", required=True)
+        options, _ = parser.parse_known_args(args)  # --partition, --time ... mean nothing here
+        job_id = 1 + max((int(name.split(".")[0]) for name in os.listdir(spool) if name.endswith(".job")), default=1000)
+        while True:
+            try:
+                fd = os.open(record(job_id, "job"), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                job_id += 1
+        with os.fdopen(fd, "w") as f:
+            f.write(options.wrap)
+        runner = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--mock-batch", spool, "run", str(job_id),
+                                   options.chdir, options.output.replace("%j", str(job_id)), options.wrap],
+                                  stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                  start_new_session=True)
+        with open(record(job_id, "pid"), "w") as f:
+            f.write(str(runner.pid))
+        print(job_id)
+    elif command == "run":
+        job_id, chdir, output, wrap = args
+        if read(job_id, "cancelled") is not None:
+            return 0
+        with open(output, "w") as log:
+            returncode = subprocess.call(wrap, shell=True, cwd=chdir, stdin=subprocess.DEVNULL, stdout=log,
+                                         stderr=subprocess.STDOUT)
+        with open(record(job_id, "exit.tmp"), "w") as f:
+            f.write(str(returncode))
+        os.replace(record(job_id, "exit.tmp"), record(job_id, "exit"))
+    elif command == "squeue":
+        for job_id in job_ids():
+            job_state = state(job_id)[0]
+            if job_state in ("PENDING", "RUNNING"):
+                print(job_id, job_state)
+    elif command == "sacct":
+        for job_id in job_ids():
+            print("|".join((job_id,) + state(job_id)))
+    elif command == "scancel":
+        for job_id in args:
+            if read(job_id, "job") is None or read(job_id, "exit") is not None:
+                continue
+            open(record(job_id, "cancelled"), "w").close()
+            pid = read(job_id, "pid")
+            if pid is None:
+                continue  # sbatch is still starting the runner, which finds .cancelled and does nothing
+            try:
+                os.killpg(int(pid), signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    else:
+        print(f"mock batch scheduler: unknown command {command}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--mock-batch"]:
+        sys.exit(_mock_batch(sys.argv[2:]))
+    sys.exit(_fake_mcr(sys.argv[1:]))
@@ -0,0 +1,96 @@
+"""Process-wide metrics of CODGAS: counters, gauges and timings every part records into.
+
+    from codgas_metrics import metrics
+    metrics.count("scan.files", 120)
+    metrics.gauge("plots.image_bytes", 3 << 20)
+    with metrics.timed("scan"):
+        ...
+
+Recording is a dict update under a lock, cheap enough for any code path and
+any thread. The GUI's telemetry panel reads snapshot() and calls sample()
+once a second, which keeps the snapshot in a bounded history; dump() writes
+that history to a JSON file, to look into the slowdowns of a shift
+afterwards. Only the standard library is used, so the engine, the MCR
+scheduler and the CLI record too.
+"""
+import collections
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+METRICS_HISTORY = 3600  # samples kept by sample(), an hour at the GUI's one per second
+
+
+class Metrics:
+    """Counters (running totals), gauges (last values) and timings (last, count, total, max seconds)."""
+
+    def __init__(self, history=METRICS_HISTORY):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.timings = {}
+        self.last = None  # the last operation timed: {"name", "seconds", "time"}
+        self.history = collections.deque(maxlen=history)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def timing(self, name, seconds, operation=True):
+        """Record a duration; with `operation`, it is also the last operation (not for the many small ones)."""
+        with self._lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = {"last": 0.0, "count": 0, "total": 0.0, "max": 0.0}
+            timing["last"] = seconds
+            timing["count"] += 1
+            timing["total"] += seconds
+            timing["max"] = max(timing["max"], seconds)
+            if operation:
+                self.last = {"name": name, "seconds": seconds, "time": time.time()}
+
+    @contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timing(name, time.perf_counter() - start)
+
+    def hit_rate(self, name):
+        """Share of the counters `name`.hits in `name`.hits + `name`.misses, None before any lookup."""
+        with self._lock:
+            hits, misses = self.counters.get(f"{name}.hits", 0), self.counters.get(f"{name}.misses", 0)
+        return hits / (hits + misses) if hits + misses else None
+
+    def snapshot(self):
+        with self._lock:
+            return {"time": time.time(), "counters": dict(self.counters), "gauges": dict(self.gauges),
+                    "timings": {name: dict(timing) for name, timing in self.timings.items()},
+                    "last": dict(self.last) if self.last else None}
+
+    def sample(self):
+        """snapshot(), also kept in the history."""
+        snapshot = self.snapshot()
+        self.history.append(snapshot)
+        return snapshot
+
+    def dump(self, path):
+        """Write the history and the current values to `path` as JSON."""
+        data = {"started": self.started, "pid": os.getpid(), "samples": list(self.history), "current": self.snapshot()}
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+        return path
+
+
+metrics = Metrics()
@@ -0,0 +1,303 @@
+"""Matplotlib rendering of the engine's models for the CODGAS GUI.
+
+Figures are plain matplotlib Figure objects, never registered with pyplot,
+so they need no plt.close()/gc.collect() and can be drawn by the Agg canvas
+on any thread. No seaborn: a histogram is one filled step artist over the
+counts np.histogram already computed.
+
+PlotRegistry keeps the GUI's rendered plots within a memory budget: renders
+viewed least recently are compressed to PNG, then dropped.
+"""
+import collections
+import io
+import os
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from codgas_metrics import metrics
+
+
+HIST_FACECOLOR = (0.12156862745098039, 0.4666666666666667, 0.7058823529411765)  # "C0", what seaborn used
+HIST_ALPHA = 0.75
+HIST_EDGE_WIDTH = 0.15
+FIGSIZE = (3, 3)
+ADAPTIVE_MIN_VALUES = 1000  # below this, re-binning a zoomed view only gives empty bins
+EXPORT_FORMATS = ("png", "svg", "pdf", "sheet")  # one file per histogram, multi-page PDF, contact-sheet PNG
+PLOT_MEMORY_BUDGET = 256 * 2**20  # bytes of renders PlotRegistry holds, RGBA images and PNGs together
+PLOT_PNG_LEVEL = 1  # zlib level of evicted renders: flat histograms compress well even at the fastest level
+
+
+def draw_histogram(ax, model, fontsize=9):
+    """Draw a HistogramModel on `ax`: the bars, the min/max/mean/std lines, legend, title and labels.
+
+    Returns the bars, a single StepPatch.
+    """
+    bars = ax.stairs(model.counts, model.edges, fill=True, baseline=0, facecolor=HIST_FACECOLOR, edgecolor="black",
+              linewidth=HIST_EDGE_WIDTH, alpha=HIST_ALPHA)
+    ax.axvline(model.min, color='r', linestyle='dashed', linewidth=1, label=f'Min: {model.min}')
+    ax.axvline(model.max, color='g', linestyle='dashed', linewidth=1, label=f'Max: {model.max}')
+    ax.axvline(model.mean, color='b', linestyle='dashed', linewidth=1, label=f'Mean: {model.mean:.2f}')
+    ax.axvline(model.mean + model.std, color='y', linestyle='dashed', linewidth=1, label=f'Std Dev: {model.std:.2f}')
+    ax.axvline(model.mean - model.std, color='y', linestyle='dashed', linewidth=1)
+    ax.legend(fontsize=fontsize - 2, loc='upper right')
+    ax.set_title(f'Unit cell constant {model.name}', fontsize=fontsize)
+    ax.set_xlabel('Value', fontsize=fontsize)
+    ax.set_ylabel('Frequency', fontsize=fontsize)
+    return bars
+
+
+class AdaptiveBins:
+    """Re-bin a histogram's bars to the visible x range whenever it changes (toolbar zoom/pan).
+
+    The view always holds as many bins as the model, so zooming in shows finer
+    detail instead of a few wide bars. The values are sorted once; a re-bin is
+    then a searchsorted of the bin edges, O(bins log N) for any N.
+    """
+
+    def __init__(self, ax, bars, model):
+        self.ax = ax
+        self.bars = bars
+        self.bins = len(model.counts)
+        self.sorted_values = np.sort(model.values)
+        self.full = (model.counts, model.edges)
+        self.cid = None
+
+    def enable(self, on=True):
+        if on and self.cid is None:
+            self.cid = self.ax.callbacks.connect("xlim_changed", self.rebin)
+            self.rebin(self.ax)
+        elif not on and self.cid is not None:
+            self.ax.callbacks.disconnect(self.cid)
+            self.cid = None
+            self.bars.set_data(*self.full)
+
+    def rebin(self, ax):
+        lo, hi = sorted(ax.get_xlim())
+        edges = np.linspace(lo, hi, self.bins + 1)
+        positions = np.searchsorted(self.sorted_values, edges, side="left")
+        positions[-1] = np.searchsorted(self.sorted_values, hi, side="right")  # last bin closed, as np.histogram
+        self.bars.set_data(np.diff(positions), edges)
+
+
+def histogram_figure(model, dpi, figsize=FIGSIZE):
+    """A new Figure with one axes showing `model`."""
+    fig = Figure(figsize=figsize, dpi=dpi)
+    draw_histogram(fig.add_subplot(), model)
+    return fig
+
+
+def render_histogram(model, dpi, size_px):
+    """Render `model` with Agg as a square image of about size_px pixels.
+
+    Returns (width, height, RGBA bytes), all picklable: the GUI runs this in
+    a worker process, where the Agg drawing cannot hold up the Tk main loop.
+    """
+    inches = max(size_px, 1) / dpi
+    fig = histogram_figure(model, dpi, figsize=(inches, inches))
+    canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    width, height = canvas.get_width_height()
+    return width, height, bytes(canvas.buffer_rgba())
+
+
+def save_histogram(model, path, dpi):
+    """Save one histogram to `path`, in the format of its extension (png, svg, ...)."""
+    histogram_figure(model, dpi).savefig(path, dpi=dpi)
+    return path
+
+
+def save_histograms_pdf(histograms, path, dpi):
+    """Save [(pattern, model), ...] as a PDF with one histogram per page."""
+    from matplotlib.backends.backend_pdf import PdfPages
+    with PdfPages(path) as pdf:
+        for pattern, model in histograms:
+            fig = histogram_figure(model, dpi)
+            fig.suptitle(pattern, fontsize=8)
+            pdf.savefig(fig)
+    return path
+
+
+def save_contact_sheet(histograms, path, dpi):
+    """Save [(pattern, model), ...] as one PNG: a row per pattern, a column per cell constant."""
+    rows = {}
+    for pattern, model in histograms:
+        rows.setdefault(pattern, []).append(model)
+    ncols = max(len(models) for models in rows.values())
+    fig = Figure(figsize=(FIGSIZE[0] * ncols, FIGSIZE[1] * len(rows)), dpi=dpi, layout="constrained")
+    axes = fig.subplots(len(rows), ncols, squeeze=False)
+    for ax_row, (pattern, models) in zip(axes, rows.items()):
+        for ax, model in zip(ax_row, models):
+            draw_histogram(ax, model)
+            ax.set_title(f'{pattern}: {model.name}', fontsize=9)
+        for ax in ax_row[len(models):]:
+            ax.set_axis_off()
+    fig.savefig(path, dpi=dpi)
+    return path
+
+
+def export_jobs(entries, directory, dpi, formats):
+    """Plan an export of the plotted histograms as [(function, args), ...] for a process pool.
+
+    `entries` are [model, title, pattern] rows, one per plot on display, as
+    PlotRegistry.plotted() returns them. Should a (pattern, cell constant) come twice,
+    only its last row is exported.
+    Every PNG/SVG is a job of its own, the PDF and the contact sheet are one job each.
+    """
+    histograms = {}
+    for model, title, pattern in entries:
+        histograms[pattern, model.name] = (pattern, title, model)
+    jobs = []
+    for fmt in ("png", "svg"):
+        if fmt in formats:
+            jobs.extend((save_histogram, (model, os.path.join(directory, f"{pattern}_{title}_DPI{dpi}.{fmt}"), dpi))
+                        for pattern, title, model in histograms.values())
+    pages = [(pattern, model) for pattern, title, model in histograms.values()]
+    if "pdf" in formats and pages:
+        jobs.append((save_histograms_pdf, (pages, os.path.join(directory, f"UCC_histograms_DPI{dpi}.pdf"), dpi)))
+    if "sheet" in formats and pages:
+        jobs.append((save_contact_sheet, (pages, os.path.join(directory, f"UCC_contact_sheet_DPI{dpi}.png"), dpi)))
+    return jobs
+
+
+class PlotEntry:
+    """A plot of the GUI's grid: its model, its widget (None once destroyed) and its last render."""
+
+    def __init__(self, key, model):
+        self.key = key
+        self.model = model
+        self.widget = None
+        self.raster = None  # the render, a PIL RGBA image
+        self.png = None  # or the render compressed, once evicted from memory
+        self.size = None  # the plot size the render was made for
+
+
+class PlotRegistry:
+    """Every plot of the grid, keyed by (pattern, cell constant, dpi), with its last render.
+
+    Renders are kept as images while the images and PNGs together fit in
+    `budget` bytes. Over budget, the least recently viewed renders are
+    compressed to PNG (a histogram shrinks about 20 times), and once that is not
+    enough the oldest PNGs are dropped: those plots are rendered again when
+    next viewed. Plots whose widget is gone keep their render the same way, so
+    a pattern plotted again (or the previous DPI) comes back without a render.
+    """
+
+    def __init__(self, budget=PLOT_MEMORY_BUDGET):
+        self.budget = budget
+        self.entries = collections.OrderedDict()  # key -> PlotEntry, least recently viewed first
+        self.raster_bytes = 0
+        self.png_bytes = 0
+        self.hits = self.misses = self.compressed = self.dropped = 0
+
+    def add(self, key, model, widget):
+        """Register `widget` as the plot of `key`; a render of the same model is kept."""
+        entry = self.entries.get(key)
+        if entry is None or entry.model is not model:
+            if entry is not None:
+                self._release(entry)
+            entry = self.entries[key] = PlotEntry(key, model)
+        entry.widget = widget
+        self.entries.move_to_end(key)
+        return entry
+
+    def detach_all(self):
+        """The widgets were destroyed; their renders stay, within the budget."""
+        for key, entry in list(self.entries.items()):
+            entry.widget = None
+            if entry.raster is None and entry.png is None:
+                del self.entries[key]
+
+    def widgets(self):
+        return [entry.widget for entry in self.entries.values() if entry.widget is not None]
+
+    def plotted(self):
+        """[model, title, pattern] of the plots on display, the rows export_jobs() takes."""
+        return [[entry.model, f'Unit cell constant {entry.model.name}', entry.key[0]]
+                for entry in self.entries.values() if entry.widget is not None]
+
+    def store(self, key, raster, size):
+        """Keep `raster`, rendered for a plot `size` pixels wide, as the render of `key`."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        self._release(entry)
+        entry.raster, entry.size = raster, size
+        self.raster_bytes += _image_bytes(raster)
+        self.entries.move_to_end(key)
+        self._evict()
+
+    def has_render(self, key, size):
+        """True if `key` has a render for `size`; counted as a cache hit or miss, and as a view."""
+        entry = self.entries.get(key)
+        if entry is None or entry.size != size or (entry.raster is None and entry.png is None):
+            self.misses += 1
+            metrics.count("render_cache.misses")
+            return False
+        self.hits += 1
+        metrics.count("render_cache.hits")
+        self.entries.move_to_end(key)
+        return True
+
+    def render(self, key):
+        """(image, size rendered for) of `key`, decompressed if evicted; (None, None) if it has no render."""
+        entry = self.entries.get(key)
+        if entry is None or (entry.raster is None and entry.png is None):
+            return None, None
+        raster = entry.raster
+        if raster is None:
+            from PIL import Image
+            raster = Image.open(io.BytesIO(entry.png))
+            raster.load()
+            self.png_bytes -= len(entry.png)
+            entry.png, entry.raster = None, raster
+            self.raster_bytes += _image_bytes(raster)
+            self.entries.move_to_end(key)
+            self._evict()
+        return raster, entry.size
+
+    def stats(self):
+        """Counts and bytes held, for the GUI to report."""
+        rasters = sum(entry.raster is not None for entry in self.entries.values())
+        pngs = sum(entry.png is not None for entry in self.entries.values())
+        return {"plots": len(self.widgets()), "entries": len(self.entries), "images": rasters, "pngs": pngs,
+                "image_bytes": self.raster_bytes, "png_bytes": self.png_bytes, "budget": self.budget,
+                "hits": self.hits, "misses": self.misses, "compressed": self.compressed, "dropped": self.dropped}
+
+    def _release(self, entry):
+        if entry.raster is not None:
+            self.raster_bytes -= _image_bytes(entry.raster)
+        if entry.png is not None:
+            self.png_bytes -= len(entry.png)
+        entry.raster = entry.png = entry.size = None
+
+    def _evict(self):
+        """Over budget: compress the least recently viewed images, then drop the oldest PNGs."""
+        self._shrink()
+        metrics.gauge("plots.image_bytes", self.raster_bytes)
+        metrics.gauge("plots.png_bytes", self.png_bytes)
+
+    def _shrink(self):
+        for entry in self.entries.values():
+            if self.raster_bytes + self.png_bytes <= self.budget:
+                return
+            if entry.raster is not None:
+                buffer = io.BytesIO()
+                entry.raster.save(buffer, "PNG", compress_level=PLOT_PNG_LEVEL)
+                self.raster_bytes -= _image_bytes(entry.raster)
+                entry.raster, entry.png = None, buffer.getvalue()
+                self.png_bytes += len(entry.png)
+                self.compressed += 1
+        for key, entry in list(self.entries.items()):
+            if self.raster_bytes + self.png_bytes <= self.budget:
+                return
+            if entry.png is not None:
+                self._release(entry)
+                self.dropped += 1
+                if entry.widget is None:
+                    del self.entries[key]  # nothing left of it
+
+
+def _image_bytes(image):
+    return image.width * image.height * len(image.getbands())
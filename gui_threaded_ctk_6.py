@@ -1,26 +1,49 @@
+import time
+START_TIME = time.perf_counter()  # --startup-benchmark measures the time to the first window from here
+
 import tkinter as tk
-import sys, os, glob, re, psutil
+import sys, os
 import threading
 import numpy as np
-from tkinter import filedialog, Entry, simpledialog
+from tkinter import filedialog, Entry
 import tkinter.messagebox
 import customtkinter as ctk
-import webbrowser
 import traceback
 from tkinter import messagebox
 from tkinter import StringVar
 from datetime import datetime
-import seaborn as sns
-import matplotlib.pyplot as plt
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 import logging
-import time
-import gc
-from PIL import Image, ImageTk
-import multiprocessing
+import queue
+import collections
 from functools import partial
-
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+# matplotlib (and codgas_plots), PIL, psutil, multiprocessing and webbrowser are imported where
+# they are first used, so the window does not wait for them
+from codgas_engine import (scan_datasets, export_ucc_log, cell_statistics, histogram_model, find_files, load_correctlp,
+                           rank_references, write_reference_hkl, HeaderIndex, default_cache_dir)
+from codgas_metrics import metrics
+
+
+RENDER_WORKERS = 1  # processes drawing histograms with Agg; threads would hold the GIL and stall the Tk loop
+RENDER_POLL_MS = 20  # how often finished images are picked up by the main loop
+RENDER_POLL_BUDGET = 0.015  # seconds of PhotoImage work per poll, so no event waits more than that
+PLOT_PREFETCH = 0.5  # viewport heights above and below the visible plots that are kept rendered
+RESIZE_SETTLE_MS = 300  # the window kept its size this long: the resize is over, visible plots are rendered again
+RESIZE_PREVIEW_BUDGET = 0.010  # seconds of scaled previews per resize step, the other plots wait for the next step
+EXPORT_POLL_MS = 100  # progress refresh of Download all
+MCR_POLL_MS = 100  # how often the output of a running MCR is picked up
+MCR_POLL_LINES = 500  # output lines handled per poll at most, so a chatty script cannot stall the GUI
+MCR_BATCH_EXECUTOR = os.environ.get("CODGAS_MCR_EXECUTOR", "slurm")  # what the Slurm box submits to; "mock" runs offline
+JOB_WORKERS = 2  # threads running App's background jobs (scans, ranking, REF writing)
+JOB_POLL_MS = 50  # how often the main loop picks up job progress and results
+JOB_PROGRESS_INTERVAL = 0.1  # seconds between two progress updates of a job
+TELEMETRY_MS = 1000  # refresh of the sidebar telemetry, each one also a sample of the metrics history
+WATCHDOG_TICK_MS = 100  # heartbeat of the main loop, each tick late by more than WATCHDOG_STALL is a stall
+WATCHDOG_STALL = 0.25  # seconds without a heartbeat before the main thread's stack is sampled
+WATCHDOG_SAMPLE = 0.05  # seconds between two stack samples during a stall
+WATCHDOG_LOG = os.path.join(default_cache_dir(), "stalls.log")  # rotated at WATCHDOG_LOG_BYTES, WATCHDOG_LOG_BACKUPS kept
+WATCHDOG_LOG_BYTES = 2**20
+WATCHDOG_LOG_BACKUPS = 3
 
 ctk.set_appearance_mode("Light")  # Modes: "System" (standard), "Dark", "Light"
 ctk.set_default_color_theme("blue")  # Themes: "blue" (standard), "green", "dark-blue"
@@ -177,146 +200,152 @@ class ScrollbarsStatus:
                 return named_widget.widget
 
 
+class ScrollLayout:
+    """Scrollbar visibility and scrollregion of every ManagedCTkScrollbar canvas, one instance per window.
+
+    <Configure> events and update requests only mark a canvas dirty; a single
+    after_idle flush, run once the event queue is empty, lays out all dirty
+    canvases. A resize storm so costs one pass per idle time however many events
+    it brings, and its last event is always laid out. Canvas sizes come from the
+    events, frame geometry is measured once and kept until the frame's own
+    <Configure>, and scrollbars and scrollregion are only touched when they change.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.canvases = {}  # canvas -> {"scrollbars", "frames", "size": (w, h), "scrollregion"}
+        self.frames = {}  # frame -> (reqwidth, reqheight, grid bbox), None until measured again
+        self.dirty = set()
+        self.flush_id = None
+
+    @classmethod
+    def shared(cls, widget):
+        root = widget._root()
+        if getattr(root, "_scroll_layout", None) is None:
+            root._scroll_layout = cls(root)
+        return root._scroll_layout
+
+    def register(self, scrollbar):
+        canvas = scrollbar.canvas_widget
+        entry = self.canvases.get(canvas)
+        if entry is None:
+            entry = self.canvases[canvas] = {"scrollbars": [], "frames": [], "size": None, "scrollregion": None}
+            canvas.bind("<Configure>", lambda event: self.on_canvas_configure(canvas, event))
+        entry["scrollbars"].append(scrollbar)
+        for frame_name in scrollbar.frames_names:
+            frame = scrollbar.frames[frame_name]
+            if frame not in entry["frames"]:
+                entry["frames"].append(frame)
+            if frame not in self.frames:
+                self.frames[frame] = None
+                frame.bind("<Configure>", lambda event, frame=frame: self.on_frame_configure(frame), add="+")
+
+    def on_canvas_configure(self, canvas, event):
+        self.canvases[canvas]["size"] = (event.width, event.height)
+        self.request(canvas)
+
+    def on_frame_configure(self, frame):
+        self.frames[frame] = None
+        for canvas, entry in self.canvases.items():
+            if frame in entry["frames"]:
+                self.request(canvas)
+
+    def request(self, canvas, content=False):
+        """Lay `canvas` out at the next idle time; with `content`, measure its frames and set the scrollregion again."""
+        if content:
+            self.canvases[canvas]["scrollregion"] = None  # App code sets it directly too
+            for frame in self.canvases[canvas]["frames"]:
+                self.frames[frame] = None
+        self.dirty.add(canvas)
+        if self.flush_id is None:
+            self.flush_id = self.root.after_idle(self.flush)
+
+    def flush(self):
+        self.flush_id = None
+        dirty, self.dirty = self.dirty, set()
+        for canvas in dirty:
+            try:
+                self.layout(canvas)
+            except tk.TclError as e:
+                print(f"An error occurred in the scrollbar layout: {e}")
+
+    def layout(self, canvas):
+        entry = self.canvases[canvas]
+        if entry["size"] is None:
+            entry["size"] = (canvas.winfo_width(), canvas.winfo_height())
+        canvas_width, canvas_height = entry["size"]
+        geometry = []
+        for frame in entry["frames"]:
+            if self.frames[frame] is None:
+                self.frames[frame] = (frame.winfo_reqwidth(), frame.winfo_reqheight(), frame.bbox("all") or (0, 0, 0, 0))
+            geometry.append(self.frames[frame])
+        content_width = max(width for width, height, bbox in geometry)
+        content_height = sum(height for width, height, bbox in geometry)
+
+        shown = {"horizontal": content_width > canvas_width, "vertical": content_height > canvas_height}
+        for scrollbar in entry["scrollbars"]:
+            scrollbar.content_width, scrollbar.content_height = content_width, content_height
+            scrollbar.canvas_width, scrollbar.canvas_height = canvas_width, canvas_height
+            on = shown[scrollbar.orientation]
+            if scrollbar.shown == on:
+                continue
+            scrollbar.shown = on
+            scrollcommand = "xscrollcommand" if scrollbar.orientation == "horizontal" else "yscrollcommand"
+            if on:
+                scrollbar.grid()  # back where it was gridded
+                canvas.configure(**{scrollcommand: scrollbar.set})
+            else:
+                scrollbar.grid_remove()
+                canvas.configure(**{scrollcommand: ""})
+
+        # the frames stacked: widest extent, heights and 20 px gaps added up
+        x1, y1, x2, y2 = geometry[0][2]
+        for width, height, bbox in geometry[1:]:
+            x1 = min(x1, bbox[0])
+            x2 = max(x2, bbox[2])
+            y1 += bbox[1]
+            y2 += bbox[3] + 20
+        if entry["scrollregion"] != (x1, y1, x2, y2):
+            entry["scrollregion"] = (x1, y1, x2, y2)
+            canvas.configure(scrollregion=(x1, y1, x2, y2))
+
+
 class ManagedCTkScrollbar(ctk.CTkScrollbar):
-    def __init__(self, parent, orientation, command, frames_list, canvases_list, frames_names, canvas_name, **kwargs):
+    def __init__(self, parent, orientation, command, frames_list, canvases_list, frames_names, canvas_name, view_command=None, **kwargs):
         super().__init__(parent, orientation=orientation, command=command, **kwargs)
         self.orientation = orientation
+        self.view_command = view_command  # called whenever the canvas view moves (scroll, resize, scrollregion)
         self.frames = {frame['name']: frame['widget'] for frame in frames_list}
         self.canvases = {canvas['name']: canvas['widget'] for canvas in canvases_list}
         self.frames_names = frames_names
         self.canvas_name = canvas_name
 
         self.canvas_widget = self.get_widget_by_name(canvas_name, self.canvases)
-        if not hasattr(self.canvas_widget, '_scrollbars'):
-            self.canvas_widget._scrollbars = []
-        self.canvas_widget._scrollbars.append(self)
 
-        # Debounce variables
-        self.last_resize_time = 0
-        self.debounce_delay = 50  # milliseconds
+        # sizes as last laid out by the ScrollLayout, for the mouse wheel
+        self.content_width = self.content_height = self.canvas_width = self.canvas_height = 0
+        self.shown = None  # gridded or not, None until the first layout
 
-        # Bind the canvas configure event with debounce
-        self.canvas_widget.bind("<Configure>", self.debounced_update)
+        # the canvas and frame <Configure> events go to the window's ScrollLayout
+        self.layout = ScrollLayout.shared(self)
+        self.layout.register(self)
 
         # Bind mouse wheel events
         self.canvas_widget.bind("<Enter>", self.bind_mouse_wheel)  # Bind mouse events when the mouse enters the widget
         self.canvas_widget.bind("<Leave>", self.unbind_mouse_wheel)  # Unbind mouse events when the mouse leaves the widget
 
-        # self.after(100, self.update_scrollbar_visibility)  # Run the checkup 100ms after startup
-        # self.after(100,self.on_mouse_wheel)
+    def set(self, first, last):
+        super().set(first, last)
+        if self.view_command is not None:
+            self.view_command()
 
     def get_widget_by_name(self, name, widgets_dict):
         return widgets_dict.get(name)
 
-    def update_sizes(self):
-        self.content_width = 0
-        self.content_height = 0
-
-
-        canvas_widget = self.get_widget_by_name(self.canvas_name, self.canvases)
-
-        if not canvas_widget:
-            print("Invalid canvas name provided.")
-            return
-        try:
-            self.canvas_width = canvas_widget.winfo_width()
-            self.canvas_height = canvas_widget.winfo_height()
-        except tk.TclError as e:
-            print(f"An error occurred: {e}")
-            return
-        
-        # if not frame_widget:
-        #     print("Invalid frame or canvas name provided.")
-        #     return
-
-        for frame_name in self.frames_names:
-            frame_widget = self.get_widget_by_name(frame_name, self.frames)
-            try: 
-                if self.content_width < frame_widget.winfo_reqwidth():
-                    self.content_width = frame_widget.winfo_reqwidth()
-                if self.content_height == 0: 
-                    self.content_height = frame_widget.winfo_reqheight() 
-                else:
-                    self.content_height += frame_widget.winfo_reqheight()
-            except tk.TclError as e:
-                print(f"An error occurred: {e}")
-                return
-        # print(f"Content width: {self.content_width}, Content height: {self.content_height}")
-        # print(f"Canvas width: {self.canvas_width}, Canvas height: {self.canvas_height}")
-
-        
-
-
     def update_scrollbar_visibility(self, event=None):
-        try:
-            self.update_sizes()
-
-            for scrollbar in self.canvas_widget._scrollbars:
-                orientation = scrollbar.cget("orientation")
-                if orientation == "horizontal":
-                    if self.content_width > self.canvas_width:
-                        scrollbar.grid(row=1, column=0, sticky="ew")  # Enable horizontal scrollbar
-                        self.canvases[self.canvas_name].configure(xscrollcommand=scrollbar.set)
-                        
-                        if event is not None:
-                            try:    
-                                if event.delta < 0:
-                                    self.canvases[self.canvas_name].widget.yview_scroll(1, "units")
-                            except Exception as e:
-                                print(f"Error: {e} - problem with mouswheel on HOR.")
-
-                    else:
-                        scrollbar.grid_remove()  # Disable horizontal scrollbar
-                        self.canvases[self.canvas_name].configure(xscrollcommand="")
-                elif orientation == "vertical":
-                    if self.content_height > self.canvas_height:
-                        scrollbar.grid(row=0, column=1, sticky="ns")  # Enable vertical scrollbar
-                        self.canvases[self.canvas_name].configure(yscrollcommand=scrollbar.set)
-
-                        if event is not None:
-                            try:    
-                                if event.delta > 0:
-                                    self.canvases[self.canvas_name].widget.yview_scroll(-1, "units")
-                            except Exception as e:
-                                print(f"Error: {e} - problem with mouswheel on VER.")
-
-                    else:
-                        scrollbar.grid_remove()  # Disable vertical scrollbar
-                        self.canvases[self.canvas_name].configure(yscrollcommand="")
-
-            # Update the scroll region
-            # Assume frames_list is a list of the frame names/keys you want to include in the scrollregion.
-            frame_bboxes = [self.frames[frame_name].bbox("all") for frame_name in self.frames_names]
-
-
-            # for frame_name, bbox in zip(self.frames_names, frame_bboxes):
-            #     print(f"{frame_name} bbox: {bbox}")
-
-
-
-            # Initialize the combined bounding box with the first frame's bounding box
-            x1, y1, x2, y2 = frame_bboxes[0]
-
-            # Loop through the rest of the bounding boxes to find the overall bounding box
-            for bbox in frame_bboxes[1:]:
-                x1 = min(x1, bbox[0])
-                x2 = max(x2, bbox[2])
-                y1 += bbox[1]
-                y2 += bbox[3]+20
+        """The frames' content changed: lay the canvas out again, once, when the GUI is next idle."""
+        self.layout.request(self.canvas_widget, content=True)
 
-            # Set the scrollregion to the combined bounding box
-            self.canvases[self.canvas_name].configure(scrollregion=(x1, y1, x2, y2))
-
-        except Exception as e:
-            print(f"An error occurred in update_scrollbar_visibility: {e}")
-
-    def debounced_update(self, event=None):
-        current_time = int(time.time() * 1000)
-        if current_time - self.last_resize_time > self.debounce_delay:
-            self.update_sizes()
-            self.update_scrollbar_visibility(event)
-            self.last_resize_time = current_time
-            
     def bind_mouse_wheel(self, event=None):
         """Binds the mouse wheel event when the mouse enters the widget."""
         self.canvas_widget.bind_all("<MouseWheel>", self.on_mouse_wheel)
@@ -351,7 +380,8 @@ class ManagedCTkScrollbar(ctk.CTkScrollbar):
 
 
 class MCR():
-    def __init__(self, mcr_path, ref, res, res_placeholder, isig, isig_placeholder, AP, ANOM, SKIP, TEMPLATE, TEMPLATE_placeholder, progress, *args):
+    def __init__(self, mcr_path, ref, res, res_placeholder, isig, isig_placeholder, AP, ANOM, SKIP, TEMPLATE, TEMPLATE_placeholder, progress, *args,
+                 datasets=None, state_path=None, concurrency=None, executor=None):
         self.mcr_path=mcr_path
         self.ref=ref
         self.res=res
@@ -365,144 +395,337 @@ class MCR():
         self.TEMPLATE_placeholder=TEMPLATE_placeholder
         self.progress = {pr['name']: pr['widget'] for pr in progress}
         self.progress_widget = self.progress.get("self.mcr_progress")
-        self.mcr_process=None
+        self.dashboard_widget = self.progress.get("self.mcr_dashboard")
+        self.datasets=datasets  # one run per dataset directory (codgas_mcr.McrScheduler), None: one run for all
+        self.state_path=state_path
+        self.concurrency=concurrency
+        self.executor=executor  # codgas_mcr.MCR_EXECUTORS name of where the per-dataset runs go, None: this machine
+        self.mcr_process=None  # codgas_mcr.McrRun or McrScheduler, same interface
         
     def process_run_mcr(self):
+        """Start the script (codgas_mcr.McrRun or McrScheduler) and follow it from the Tk main loop with poll_mcr."""
+        from codgas_mcr import McrRun, McrScheduler, make_executor, mcr_command
         print("accessed process_run_mcr")
-        if not self.mcr_process or not self.mcr_process.is_alive():
-            self.mcr_process = multiprocessing.Process(target=self.run_mcr)
-            self.mcr_process.start()
-
-    def stop_mcr(self):
-        print("accessed stop_mcr")
-        if self.mcr_process and self.mcr_process.is_alive():
-            self.mcr_process.terminate()
-            self.mcr_process.join()
-
-    def run_mcr(self):
-        print("accessed run_mcr")
-        autoproc = "--autoproc" if self.AP == 1 else "" 
-        anom = "--anom" if self.ANOM == 1 else ""
-        skipdone = "--skipdone" if self.SKIP == 1 else ""
+        if self.mcr_running():
+            return
         template = self.TEMPLATE_placeholder if self.TEMPLATE == None else self.TEMPLATE
         highrescut = self.res_placeholder if self.res == None else self.res
         isigcut = self.isig_placeholder if self.isig == None else self.isig
+        # per dataset, "Skip reprocessed" is the scheduler's: datasets its state file has as done are not started
+        argv = mcr_command(self.mcr_path, self.ref, highrescut, isigcut, template,
+                           autoproc=self.AP == 1, anom=self.ANOM == 1, skipdone=self.SKIP == 1 and self.datasets is None)
+        print(" ".join(argv))
+        try:
+            if self.datasets is None:
+                self.mcr_process = McrRun(argv)
+            else:
+                self.mcr_process = McrScheduler(self.datasets, argv, self.state_path, concurrency=self.concurrency,
+                                                skipdone=self.SKIP == 1, executor=make_executor(self.executor or "local"))
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not start {self.mcr_path}:\n{e}")
+            return
+        self.progress_widget.configure(text="MCR started")
+        self.progress_widget.after(MCR_POLL_MS, self.poll_mcr)
 
-        mycommand = f"{self.mcr_path} --ref {self.ref} --resolution {highrescut} --i_sig_cut {isigcut} {autoproc} {anom} {skipdone} --template_host {template}"
+    def mcr_running(self):
+        return self.mcr_process is not None and self.mcr_process.running
 
-        print(mycommand)
-        for i in range(10):
-            print(i)
-            self.progress_widget.configure(text=i)
-            time.sleep(1)
+    def stop_mcr(self):
+        print("accessed stop_mcr")
+        if self.mcr_running():
+            self.mcr_process.stop()  # the whole process group, SIGKILL if SIGTERM is not enough
+            self.progress_widget.configure(text="MCR stopping ..")
 
-        
-class plot_histograms():
-    def __init__(self):
-        return
-    
-    def plot_all_ucc(self, directory, filename_pattern, dpi, plots_starting_row):
-        if not filename_pattern in self.plots_info_entries or not self.plotted:
-            plots_info = ctk.CTkLabel(self.indexing_plots_frame, text=f"Unit cell distribution among datasets with files: {filename_pattern}")
-            plots_info.grid(row=plots_starting_row, column=0, columnspan=4, padx=(10,10), pady=(0,0), sticky="w")
-            row=plots_starting_row+1
-            (_,a,a_mean,a_std,b,b_mean,b_std,c,c_mean,c_std,target_files_counter)=self.collect_sg_cell(directory, filename_pattern)
-            self.plot_ucc_histograms(a, "a", row, 0, dpi,filename_pattern)
-            self.plot_ucc_histograms(b, "b", row, 1, dpi,filename_pattern)
-            self.plot_ucc_histograms(c, "c", row, 2, dpi,filename_pattern)
-            # Update the scroll region of the canvas to include the content
-            self.indexing_plots_frame.update_idletasks()
-            self.canvas_plots.config(scrollregion=self.canvas_plots.bbox("all"))
-            self.plotted = True
-            self.download_plots.configure(state="normal", fg_color=self.default_button_fg_color)
-            if not filename_pattern in self.plots_info_entries:
-                self.plots_info_entries[filename_pattern] = plots_starting_row
-                self.plots_starting_row += 2
-        else:
-            print("already plotted")
-            
-    def plot_ucc_histograms(self, ucc, name, row, col, dpi, filename_pattern):
-        # Remove existing frame in the specified grid cell
-        for widget in self.indexing_plots_frame.grid_slaves(row=row, column=col):
-            widget.destroy()
-        
-        # Create a frame for the plot within the tab
-        self.frame = ctk.CTkFrame(self.indexing_plots_frame, width=100)
-        self.frame.grid(row=row, column=col, padx=10, pady=10, sticky="nsew")
-        
-        # Configure grid row and column weights
-        self.indexing_plots_frame.grid_rowconfigure(row, weight=1)
-        self.indexing_plots_frame.grid_columnconfigure(col, weight=1)
-        self.frame.grid_rowconfigure(row, weight=1)
-        self.frame.grid_columnconfigure(col, weight=1)
+    def poll_mcr(self):
+        """Show the run's output and progress, MCR_POLL_LINES events at most per call, until it exits."""
+        for _ in range(MCR_POLL_LINES):
+            try:
+                event = self.mcr_process.events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == "output":
+                print(f"[MCR {event[1]}] {event[2]}")
+            elif event[0] == "progress":
+                done, total, label = event[1:]
+                self.progress_widget.configure(text=f"{done}/{total} {label}")
+            elif event[0] == "exit":
+                returncode = event[1]
+                self.show_mcr_status()
+                if self.mcr_process.stopping:
+                    status = "stopped"
+                else:
+                    status = "done" if returncode == 0 else f"failed (exit status {returncode})"
+                print(f"MCR {status}")
+                self.progress_widget.configure(text=f"MCR {status}")
+                return
+        self.show_mcr_status()
+        self.progress_widget.after(MCR_POLL_MS, self.poll_mcr)
 
+    def show_mcr_status(self):
+        """Per-dataset runs: the scheduler's resources and queue in the dashboard label."""
+        if self.dashboard_widget is None or not hasattr(self.mcr_process, "status"):
+            return
+        status = self.mcr_process.status()
+        if not status:
+            return
+        parts = []
+        if "cpu" in status:
+            parts.append(f"CPU {status['cpu']:.0f}%   RAM {status['memory_available'] / 2**30:.1f} of "
+                         f"{status['memory_total'] / 2**30:.1f} GiB free")
+        parts.append(f"running {status['running']}, paused {status['paused']}, queued {status['queued']}")
+        parts.append(f"done {status['done']}, failed {status['failed']}   {status['datasets_per_minute']:.1f} datasets/min")
+        if status["held"]:
+            parts.append(f"waiting: {status['held']}")
+        text = "\n".join(parts)
+        if self.dashboard_widget.cget("text") != text:
+            self.dashboard_widget.configure(text=text)
+
+
+class JobCancelled(Exception):
+    """Raised in a job's work function by Job.check() / Job.progress() once the job is cancelled."""
+
+
+class Job:
+    """Handed to a job's work function: progress reporting and cooperative cancellation, thread-safe."""
+
+    def __init__(self, runner, title):
+        self.runner = runner
+        self.title = title
+        self._cancel = threading.Event()
+        self._last_progress = 0.0
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise JobCancelled(self.title)
+
+    def progress(self, done, total, text=None):
+        """Report progress, at most one event per JOB_PROGRESS_INTERVAL (the last step always goes through)."""
+        self.check()
+        now = time.perf_counter()
+        if done >= total or now - self._last_progress >= JOB_PROGRESS_INTERVAL:
+            self._last_progress = now
+            self.runner.events.put(("progress", self, (done, total, text)))
+
+
+class JobRunner:
+    """Runs App's long operations on a thread pool, with every Tk call kept on the main thread.
+
+    submit() runs work(job) on a worker. The work function computes only: no widget, no
+    Tk variable, and reports through job.progress(), which also raises JobCancelled once
+    Cancel was pressed. Progress, results and errors are queued and handed to the progress
+    window, on_done, on_error and on_cancel by dispatch(), which drains the queue on the
+    main thread with after() while jobs are running.
+    """
+
+    def __init__(self, root, workers=JOB_WORKERS):
+        self.root = root
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.events = queue.Queue()
+        self.active = {}  # job -> (on_done, on_error, on_cancel, progress window or None)
+        self._dispatch = None
+
+    def submit(self, title, work, on_done=None, on_error=None, on_cancel=None, progress=True):
+        job = Job(self, title)
+        window = self.progress_window(job) if progress else None
+        self.active[job] = (on_done, on_error, on_cancel, window)
+        self.pool.submit(self._run, job, work)
+        if self._dispatch is None:
+            self._dispatch = self.root.after(JOB_POLL_MS, self.dispatch)
+        return job
+
+    def _run(self, job, work):
+        start = time.perf_counter()
         try:
-            # Create a Matplotlib figure and plot
-            fig, ax = plt.subplots(figsize=(3, 3), dpi=dpi)  # Adjust size as needed
-            self.fig_entries.append(fig)
-            sns.histplot(ucc, bins=100, kde=False, ax=ax)
-            ax.axvline(np.min(ucc), color='r', linestyle='dashed', linewidth=1, label=f'Min: {np.min(ucc)}')
-            ax.axvline(np.max(ucc), color='g', linestyle='dashed', linewidth=1, label=f'Max: {np.max(ucc)}')
-            ax.axvline(np.mean(ucc), color='b', linestyle='dashed', linewidth=1, label=f'Mean: {np.mean(ucc):.2f}')
-            ax.axvline(np.mean(ucc) + np.std(ucc), color='y', linestyle='dashed', linewidth=1, label=f'Std Dev: {np.std(ucc):.2f}')
-            ax.axvline(np.mean(ucc) - np.std(ucc), color='y', linestyle='dashed', linewidth=1)
-            ax.legend(fontsize=7, loc='upper right')
-            ax.set_title(f'Unit cell constant {name}', fontsize=9)
-            ax.set_xlabel('Value', fontsize=9)
-            ax.set_ylabel('Frequency', fontsize=9)
-            title=f'Unit cell constant {name}'
-            self.fig_details_entries.append([fig,title,filename_pattern])
-        finally:
-            plt.close('all')  # Ensure all figures are closed
-        
-        # Create a canvas to display the plot and add it to the frame
-        canvas = FigureCanvasTkAgg(fig, master=self.frame)
-        canvas_height = self.canvas_plots.winfo_height()-20
-        canvas_width = (self.canvas_plots.winfo_width()-60)/3
-        canvas.draw()
-        canvas_widget = canvas.get_tk_widget()
-        canvas_widget.bind("<Button-1>", lambda event, f=fig: self.open_figure_in_new_window(f))
-
-        if self.fit_by == "height":
-            canvas_widget.config(width=canvas_height, height=canvas_height)
+            result = work(job)
+        except JobCancelled:
+            self.events.put(("cancelled", job, None))
+        except Exception as e:
+            traceback.print_exc()
+            self.events.put(("error", job, e))
         else:
-            canvas_widget.config(width=canvas_width, height=canvas_width)
-        canvas_widget.grid(row=0, column=0, sticky="nsew")  # Ensure proper grid placement
-        self.plots_canvases.append(canvas_widget)
-        gc.collect()
-
-    def download_plots(self):
-        dpi = simpledialog.askinteger("DPI", "Enter DPI (e.g., 100, 200):", minvalue=1, maxvalue=1000)
-        if dpi:
-            for detail in self.fig_details_entries:
-                fig, title, filename_pattern = detail
-                fig_name = str(filename_pattern) + "_" + str(title) + "_DPI" + str(dpi) + ".png"
-                fig_path = os.path.join(self.dir_entry.get(), fig_name)
-                fig.savefig(fig_path, dpi=dpi)
-            messagebox.showinfo("Downloaded", f"Figures of UCC collected from datasets with pattern {filename_pattern} were saved in {self.dir_entry.get()}")
+            self.events.put(("cancelled" if job.cancelled else "done", job, result))
+        finally:
+            metrics.timing(f"job {job.title}", time.perf_counter() - start)
 
-    def fitting_plots(self, value):
-        if value == 'Fit H':
-            self.fitplots_byHeight()
-            # self.update_scrollbars()
-        elif value == 'Fit W':
-            self.fitplots_byWidth()
-            # self.update_scrollbars()
+    def dispatch(self):
+        try:
+            self._dispatch_events()
+        finally:
+            # whatever a callback did, the jobs still running are polled again
+            self._dispatch = self.root.after(JOB_POLL_MS, self.dispatch) if self.active else None
 
-    def fitplots_byHeight(self):
-        plot_h = round(self.canvas_plots.winfo_height()-80, 0)
-        for plot in self.plots_canvases:
-            plot.config(width=plot_h, height=plot_h)
-        self.indexing_plots_frame.update_idletasks()
-        self.canvas_plots.config(scrollregion=self.canvas_plots.bbox("all"))
-        self.fit_by="height"
-    def fitplots_byWidth(self):
-        plot_w = round((self.canvas_plots.winfo_width()-80)/3, 0)
-        for plot in self.plots_canvases:
-            plot.config(width=plot_w, height=plot_w)
-        self.indexing_plots_frame.update_idletasks()
-        self.canvas_plots.config(scrollregion=self.canvas_plots.bbox("all"))
-        self.fit_by="width"
+    def _dispatch_events(self):
+        latest, finished = {}, []
+        while True:
+            try:
+                kind, job, payload = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                latest[job] = payload  # only the newest progress of each job is drawn
+            else:
+                finished.append((kind, job, payload))
+        for job, (done, total, text) in latest.items():
+            window = self.active.get(job, (None,) * 4)[3]
+            if window is not None:
+                window.label.config(text=text or f"{job.title} {done}/{total}")
+                window.bar.set(done / total if total else 0)
+        for kind, job, payload in finished:
+            on_done, on_error, on_cancel, window = self.active.pop(job)
+            if window is not None:
+                window.destroy()
+            try:
+                if kind == "done" and on_done is not None:
+                    on_done(payload)
+                elif kind == "error":
+                    (on_error or self.show_error)(job, payload)
+                elif kind == "cancelled":
+                    print(f"{job.title}: cancelled")
+                    if on_cancel is not None:
+                        on_cancel()
+            except Exception as e:  # a failing callback must not keep the other jobs' results from being handled
+                traceback.print_exc()
+                self.show_error(job, e)
+
+    def show_error(self, job, error):
+        messagebox.showerror(job.title, f"{job.title} failed:\n{error}")
+
+    def progress_window(self, job):
+        window = tk.Toplevel(self.root)
+        window.title(job.title)
+        window.label = tk.Label(window, text="In progress ..", padx=10, pady=10, anchor="w")
+        window.label.pack(pady=10, anchor="w")
+        self.root.center_window(window, 800, 140)
+        window.bar = ctk.CTkProgressBar(window, mode="determinate")
+        window.bar.set(0)
+        window.bar.pack(pady=10, padx=10, fill='x')
+        ctk.CTkButton(window, text="Cancel", command=job.cancel, width=80).pack(pady=(0, 10))
+        window.protocol("WM_DELETE_WINDOW", job.cancel)
+        return window
+
+    def cancel_all(self):
+        for job in self.active:
+            job.cancel()
+
+    def shutdown(self):
+        """Cancel every job and drop the queued ones; the running ones end at their next progress report."""
+        self.cancel_all()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class StallWatchdog:
+    """Finds what froze the GUI: a heartbeat on the main loop, watched from a helper thread.
+
+    The main loop runs tick() every WATCHDOG_TICK_MS. Once no tick came for
+    WATCHDOG_STALL seconds, the helper thread samples the main thread's stack
+    every WATCHDOG_SAMPLE seconds with sys._current_frames() until the ticks are
+    back. The stall is then logged to WATCHDOG_LOG with how long the loop was
+    blocked, the innermost App method on the stack (the one that blocks)
+    and the stack seen most often, and recorded in the metrics: the counter
+    gui.stalls and a timing "stall <method>" per method. worst() ranks the
+    methods by the time they blocked the GUI, over this session.
+    """
+
+    def __init__(self, root, owner=None, log_path=WATCHDOG_LOG):
+        self.root = root
+        owner = type(root) if owner is None else owner
+        self.owner_prefix = f"{owner.__qualname__}."
+        self.owner_file = sys.modules[owner.__module__].__file__
+        self.main_id = threading.main_thread().ident
+        self.interval = WATCHDOG_TICK_MS / 1000
+        self.beat = time.perf_counter()
+        self.blocked = {}  # method -> [stalls, seconds blocked, longest]
+        self.log = logging.getLogger("codgas.stalls")
+        self.log.setLevel(logging.INFO)
+        self.log.propagate = False
+        if not self.log.handlers:
+            try:
+                from logging.handlers import RotatingFileHandler
+                os.makedirs(os.path.dirname(log_path), exist_ok=True)
+                handler = RotatingFileHandler(log_path, maxBytes=WATCHDOG_LOG_BYTES, backupCount=WATCHDOG_LOG_BACKUPS)
+            except OSError as e:
+                print(f"Stall log {log_path} not available ({e}), stalls are only printed")
+                handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self.log.addHandler(handler)
+        self._stop = threading.Event()
+        self.root.after(WATCHDOG_TICK_MS, self.tick)
+        threading.Thread(target=self.watch, name="stall-watchdog", daemon=True).start()
+
+    def tick(self):
+        now = time.perf_counter()
+        metrics.gauge("gui.loop_latency", max(0.0, now - self.beat - self.interval))
+        self.beat = now
+        if not self._stop.is_set():
+            self.root.after(WATCHDOG_TICK_MS, self.tick)
+
+    def stop(self):
+        self._stop.set()
+
+    def watch(self):
+        methods, stacks, last_beat = None, None, None
+        while not self._stop.wait(WATCHDOG_SAMPLE):
+            beat = self.beat
+            if time.perf_counter() - beat < WATCHDOG_STALL:
+                if methods is not None:
+                    self.report(beat - last_beat - self.interval, methods, stacks)
+                    methods = None
+                continue
+            frame = sys._current_frames().get(self.main_id)
+            if frame is None:
+                continue  # main thread gone, the process is exiting
+            if methods is None:
+                methods, stacks, last_beat = collections.Counter(), collections.Counter(), beat
+            method, stack = self.attribute(frame)
+            methods[method] += 1
+            stacks[stack] += 1
+            del frame
+
+    def attribute(self, frame):
+        """The innermost owner method in the stack of `frame` and the stack, outermost first.
+
+        Lambdas and nested functions are skipped: a button's lambda made in
+        build_indexing_tab blames the method it calls, not build_indexing_tab.
+        Only without an owner method on the stack is the innermost one of them
+        named, and "?" without either.
+        """
+        stack = []
+        method = nested = None
+        while frame is not None:
+            code = frame.f_code
+            name = getattr(code, "co_qualname", code.co_name)
+            if method is None and code.co_filename == self.owner_file and name.startswith(self.owner_prefix):
+                if "<" in name:  # <locals>, <lambda>
+                    nested = nested or name
+                else:
+                    method = name
+            stack.append((code.co_filename, frame.f_lineno, name))
+            frame = frame.f_back
+        return method or nested or "?", tuple(reversed(stack))
+
+    def report(self, seconds, methods, stacks):
+        method = methods.most_common(1)[0][0]
+        stack = stacks.most_common(1)[0][0]
+        entry = self.blocked.setdefault(method, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        metrics.count("gui.stalls")
+        metrics.timing(f"stall {method}", seconds, operation=False)
+        lines = "".join(f"\n    {os.path.basename(path)}:{line} {name}" for path, line, name in stack[-12:])
+        self.log.warning(f"stall {seconds:.2f} s in {method} ({sum(methods.values())} samples){lines}")
+
+    def worst(self, n=10):
+        """[(method, stalls, seconds blocked, longest)], the methods that blocked the GUI longest first."""
+        ranked = sorted(self.blocked.items(), key=lambda item: item[1][1], reverse=True)
+        return [(method, *entry) for method, entry in ranked[:n]]
 
 
 class App(ctk.CTk):
@@ -531,18 +754,24 @@ class App(ctk.CTk):
                                                           
         self.placeholder_entries = []
         self.plots_info_entries = {}
+        self.histogram_cache = {}  # filename pattern -> (directory, {"a": HistogramModel, "b": ..., "c": ...})
+        self.render_pool = None  # ProcessPoolExecutor, started with the first plot
+        self.render_results = queue.Queue()  # (plot canvas, generation, future) of finished renders
+        self.renders_pending = 0
+        self._render_poll = None
+        self._plot_sync = None
+        self.jobs = JobRunner(self)  # every long operation runs through it, see JobRunner
         self.plots_starting_row = 1
         self.ucc_entries = {}
         self.flashing_interval = 0.2
         self.has_run = False
         self.previous_size = self.winfo_width(), self.winfo_height()
         self.plotted = False
-        self.plots_canvases = []
-        self.fig_entries = []
+        self.plot_registry = None  # codgas_plots.PlotRegistry, created with the first plot
         self.fit_by="height"
-        self.fig_details_entries = []
         self.refs_options = None
         self.refs_hall_of_fame = []
+        self.refs_tables = {}  # CORRECT.LP path -> its lines, the table shown for the selected reference
         self.named_frames = []
         self.named_canvases = []
         self.named_scrollable_frames = []
@@ -550,7 +779,10 @@ class App(ctk.CTk):
         self.frames_list = []
         self.frame_bars = []
         self._resize_after = None
+        self._resize_step = None
+        self.resizing = False  # while the window is being resized, plots show scaled previews, see resize_preview
         self.selected_ref = ""
+        self.filename_pattern = None  # the Indexing tab's pattern, set once that tab is built
         self.buttons = []
         self.best_ref_found = tk.BooleanVar()
         self.best_ref_found.set(False)
@@ -559,6 +791,8 @@ class App(ctk.CTk):
         self.mcr_instance = None
         self.REF = None
         self.disabled_entry_fgcolor = "#A9A9A9"
+        self.scan_workers = 16  # threads used to list and parse sub datasets
+        self.header_index = HeaderIndex()  # parsed headers persisted between clicks and sessions
 
         
 
@@ -589,12 +823,17 @@ class App(ctk.CTk):
         self.appearance_mode_label = ctk.CTkLabel(self.sidebar_frame, text="Appearance Mode:", anchor="w")
         self.appearance_mode_label.grid(row=5, column=0, padx=20, pady=(10, 0))
         self.appearance_mode_optionemenu = ctk.CTkOptionMenu(self.sidebar_frame, values=["Light", "Dark"], command=self.change_appearance_mode_event) 
-        default_bg_color = self.get_default_bg_color()
-
         self.appearance_mode_optionemenu.grid(row=6, column=0, padx=20, pady=(10, 10))
 
+        # live telemetry from codgas_metrics, see update_telemetry
+        self.telemetry_label = ctk.CTkLabel(self.sidebar_frame, text="", justify="left", anchor="w", wraplength=180,
+                                            font=ctk.CTkFont(size=11))
+        self.telemetry_label.grid(row=7, column=0, padx=20, pady=(10, 0), sticky="w")
+        self.save_metrics_button = ctk.CTkButton(self.sidebar_frame, text="Save metrics", command=self.save_metrics)
+        self.save_metrics_button.grid(row=8, column=0, padx=20, pady=(10, 20))
+
         # create tabview
-        self.tabview = ctk.CTkTabview(self, width=850, height=560)
+        self.tabview = ctk.CTkTabview(self, width=850, height=560, command=self.on_tab_change)
         self.tabview.grid(row=0, column=1, padx=(10, 10), pady=(10, 10), sticky="nsew")
 
         
@@ -688,8 +927,65 @@ class App(ctk.CTk):
         self.add_labels_ucc_gathered_info(grid_X_origin_labels_ucc_gathered_info+2, grid_Y_origin_labels_ucc_gathered_info+4 , "mean(c)=")
         self.add_labels_ucc_gathered_info(grid_X_origin_labels_ucc_gathered_info+3, grid_Y_origin_labels_ucc_gathered_info+4 , "std(c)=")
 
+        # only the Data tab is built now, the others the first time they are selected (see build_tab)
+        self.default_button_fg_color = self.browse_button.cget("fg_color")
+        self.tabview.add("Indexing")
+        self.tabview.add("ReIndexing")
+        self.tabview.add("Processing")
+        self.tabview.add("Analysing")
+        self.tab_builders = {"Indexing": self.build_indexing_tab, "ReIndexing": self.build_reindexing_tab}
+        self.current_mode = ctk.get_appearance_mode()
+
+#######           Processing tab           #######
+#######           Analysing tab            #######
+        # nothing in them yet, so no builders
 
 
+#          ██████  ██████  ███    ██ ███████ ██  ██████  ██    ██ ██████  ███████ 
+#         ██      ██    ██ ████   ██ ██      ██ ██       ██    ██ ██   ██ ██      
+#         ██      ██    ██ ██ ██  ██ █████   ██ ██   ███ ██    ██ ██████  █████   
+#         ██      ██    ██ ██  ██ ██ ██      ██ ██    ██ ██    ██ ██   ██ ██      
+#          ██████  ██████  ██   ████ ██      ██  ██████   ██████  ██   ██ ███████ 
+                                                                        
+                                                                    
+        # Configure the grid of the parent tab
+        self.tabview.grid_rowconfigure(0, weight=1)
+        self.tabview.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)  # Make the row with the Tabview expand vertically
+        self.grid_columnconfigure(1, weight=1)  # Make the column with the Tabview expand horizontally
+        
+
+        # Bind the configure event to the resize callback
+        self.bind("<Configure>", self.on_resize)        
+        
+        
+        for button in self.buttons:
+            if button.cget("state") == "normal":
+                button.bind("<ButtonPress-1>", self.on_button_press)  # Button press event
+                button.bind("<ButtonRelease-1>", self.on_button_release)  # Button release event
+
+        
+        self.after_idle(lambda: print(f"Memory usage: {self.memory_usage() / (1024 * 1024):.2f} MB"))
+        self.after(TELEMETRY_MS, self.update_telemetry)
+        self.watchdog = StallWatchdog(self)
+
+        # self.bind('<Configure>', ManagedCTkScrollbar.update_scrollbar_visibility)
+
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.bind("<Alt-q>", lambda event: self.on_close())
+
+            
+
+    def on_tab_change(self):
+        self.build_tab(self.tabview.get())
+
+    def build_tab(self, name):
+        """Build the widgets of a tab if that has not been done yet."""
+        builder = self.tab_builders.pop(name, None)
+        if builder is not None:
+            start = time.perf_counter()
+            builder()
+            print(f"{name} tab built in {time.perf_counter() - start:.3f} s")
 
 #                     ██ ███    ██ ██████  ███████ ██   ██ ██ ███    ██  ██████  
 #                     ██ ████   ██ ██   ██ ██       ██ ██  ██ ████   ██ ██       
@@ -700,7 +996,9 @@ class App(ctk.CTk):
                                                            
                                                  
                                                  
-        self.tabview.add("Indexing")
+    def build_indexing_tab(self):
+        """Widgets of the Indexing tab, built the first time the tab is selected."""
+        default_bg_color = self.get_default_bg_color()
 
         # Create a frame inside the canvas to hold the content
         self.indexing_content_frame = ctk.CTkFrame(self.tabview.tab("Indexing"), bg_color=default_bg_color, border_width=0,corner_radius=0)
@@ -733,7 +1031,8 @@ class App(ctk.CTk):
             frames_list=self.new_frame_list,
             canvases_list=self.new_canvas_list,
             frames_names=["self.indexing_plots_frame"],
-            canvas_name="self.canvas_plots"
+            canvas_name="self.canvas_plots",
+            view_command=self.schedule_plot_sync
             )
         self.indexing_v_scrollbar.grid(row=0, column=1, sticky="ns")
     
@@ -793,21 +1092,32 @@ class App(ctk.CTk):
         self.dpi_box = ctk.CTkComboBox(self.indexing_content_frame, values=["100", "150", "200", "50"], command=self.update_dpi_value, width=80)
         self.dpi_box.grid(row=1, column=1, padx=4, pady=4)
 
+        self.export_ucc_log = tk.BooleanVar(value=False)
+        self.export_ucc_log_check = ctk.CTkCheckBox(self.indexing_content_frame, text="Save cell_param log", variable=self.export_ucc_log)
+        self.export_ucc_log_check.grid(row=1, column=2, padx=4, pady=4)
+
         self.fit = ctk.CTkSegmentedButton(self.indexing_content_frame, values=['Fit H', 'Fit W'], command=self.fitting_plots)
         self.fit.grid(row=1, column=4, padx=4, pady=4)
         self.fit.set(value='Fit H')
 
-        self.bind("<Configure>", self.on_resize)
         self.canvas_plots.config(scrollregion=self.indexing_plots_frame.bbox("all"))
         
-        self.current_mode = ctk.get_appearance_mode()
         self.tabview.tab("Indexing").update_idletasks()
-        # self.tabview.set("ReIndexing")
-        
+        self.configure_grids(self.indexing_content_frame)
+
+        # Update the scroll region of the canvas to include the content
+        self.indexing_plots_frame.update_idletasks()
+        self.canvas_plots.config(scrollregion=self.canvas_plots.bbox("all"))
+        self.update_canvas_size(self.canvas_plots,self.indexing_plots_frame)
+        # Configure weight for grid columns and rows
+        self.tabview.tab("Indexing").grid_rowconfigure(0, weight=1)
+        self.tabview.tab("Indexing").grid_columnconfigure(0, weight=1)
+        self.indexing_content_frame.grid_rowconfigure(0, weight=0)
+        self.indexing_content_frame.grid_rowconfigure(1, weight=0)
+        for col in range(6):
+            self.indexing_content_frame.grid_columnconfigure(col, weight=1)
+        self.indexing_content_frame.grid_rowconfigure(2, weight=1)
 
-        
-        
-        
 #                 ██████  ███████     ██ ███    ██ ██████  ███████ ██   ██ ██ ███    ██  ██████  
 #                 ██   ██ ██          ██ ████   ██ ██   ██ ██       ██ ██  ██ ████   ██ ██       
 #                 ██████  █████       ██ ██ ██  ██ ██   ██ █████     ███   ██ ██ ██  ██ ██   ███ 
@@ -816,7 +1126,9 @@ class App(ctk.CTk):
                                                                                             
                                                                                
                                                                                                                       
-        self.tabview.add("ReIndexing")        
+    def build_reindexing_tab(self):
+        """Widgets of the ReIndexing tab, built the first time the tab is selected."""
+        default_bg_color = self.get_default_bg_color()
 
 
 
@@ -867,7 +1179,6 @@ class App(ctk.CTk):
             width=100, 
             command=self.mcr_browse_path)
         self.mcr_browse_button.grid(row=1, column=4, padx=10, pady=10)
-        self.default_button_fg_color = self.mcr_browse_button.cget("fg_color")
         self.ref_label = ctk.CTkLabel(
             self.Reindexing_content_frame, 
             text="Finding Reference dataset:")
@@ -881,6 +1192,12 @@ class App(ctk.CTk):
         self.find_ref_button.grid(row=2, column=1, padx=10, pady=10)
         self.previous_selection_find_ref = None
 
+        # what "Auto" and "Auto-guided" rank the CORRECT.LPs on; "Weighted" combines rank_weights
+        self.rank_metrics = {"I/SIGMA": "isig", "CC(1/2)": "cc12", "COMPLETENESS": "completeness", "R-meas": "rmeas", "SigAno": "sigano", "Weighted": None}
+        self.rank_weights = {"isig": 1.0, "cc12": 1.0, "completeness": 1.0, "rmeas": 1.0}
+        self.rank_by = ctk.CTkOptionMenu(self.Reindexing_content_frame, values=list(self.rank_metrics), width=120)
+        self.rank_by.grid(row=2, column=5, padx=10, pady=10)
+
         self.best_ref_label = ctk.CTkLabel(self.Reindexing_content_frame, text="Best REF dataset is:")
         self.best_ref_label.grid(row=3, column=0, columnspan=1, sticky="w", padx=10, pady=10)
         self.set_ref_button = ctk.CTkButton(
@@ -893,6 +1210,7 @@ class App(ctk.CTk):
         self.set_ref_button.grid(row=3, column=4, padx=10, pady=10)
         self.buttons.append(self.set_ref_button)
         # Load the green check mark image
+        from PIL import Image
         self.check_mark_image = Image.open("./green_check.png")
         self.check_mark_image = self.check_mark_image.resize((100, 100))  # Resize to 50x50 pixels
         # Ensure the image has an alpha channel
@@ -934,7 +1252,6 @@ class App(ctk.CTk):
         self.Reindexing_canvas.config(scrollregion=self.Reindexing_content_frame.bbox("all"))
 
         self.configure_grids(self.Reindexing_content_frame)
-        self.configure_grids(self.indexing_content_frame)
         
         self.tabview.tab("ReIndexing").update_idletasks()
 
@@ -994,6 +1311,16 @@ class App(ctk.CTk):
         self.skipdone = ctk.CTkSwitch(master=self.mesh_collect_frame, text="Skip reprocessed")
         self.skipdone.grid(row=3, column=2, padx=10, pady=4, sticky="ew")
 
+        # one run per dataset directory, several at a time (codgas_mcr.McrScheduler)
+        self.per_dataset = ctk.CTkSwitch(master=self.mesh_collect_frame, text="Per dataset")
+        self.per_dataset.grid(row=1, column=3, padx=10, pady=4, sticky="ew")
+        self.parallel_runs = ctk.CTkLabel(self.mesh_collect_frame, text="Parallel runs")
+        self.parallel_runs.grid(row=2, column=3, padx=10, pady=4, sticky="w")
+        self.parallel_runs_val_placeholder = str(os.cpu_count() or 1)
+        self.parallel_runs_val = PlaceholderEntry(self.mesh_collect_frame, placeholder_text=self.parallel_runs_val_placeholder, width=50)
+        self.parallel_runs_val.grid(row=3, column=3, padx=10, pady=4, sticky="w")
+        self.placeholder_entries.append([self.parallel_runs_val, self.parallel_runs_val_placeholder])
+
         for col in range(4):
             self.mesh_collect_frame.grid_columnconfigure(col, weight=1, uniform="a")
 
@@ -1019,6 +1346,10 @@ class App(ctk.CTk):
         self.mcr_progress = ctk.CTkLabel(self.mesh_collect_frame, text="")
         self.mcr_progress.grid(row=4, column=0, padx=10, pady=10)
 
+        # per-dataset runs: CPU, memory and queue of the scheduler, see MCR.show_mcr_status
+        self.mcr_dashboard = ctk.CTkLabel(self.mesh_collect_frame, text="", justify="left", anchor="w")
+        self.mcr_dashboard.grid(row=5, column=0, columnspan=5, padx=10, pady=(0, 10), sticky="w")
+
 
 
 #scrollbars
@@ -1045,74 +1376,18 @@ class App(ctk.CTk):
         )
         self.reindexing_v_scrollbar.grid(row=0, column=1, sticky="ns")
 
-
-#######           Processing tab           #######
-        self.tabview.add("Processing")
-        self.tabview.add("Analysing")
-
-#######           Analysing tab            #######
-
-
-
-        
-#          ██████  ██████  ███    ██ ███████ ██  ██████  ██    ██ ██████  ███████ 
-#         ██      ██    ██ ████   ██ ██      ██ ██       ██    ██ ██   ██ ██      
-#         ██      ██    ██ ██ ██  ██ █████   ██ ██   ███ ██    ██ ██████  █████   
-#         ██      ██    ██ ██  ██ ██ ██      ██ ██    ██ ██    ██ ██   ██ ██      
-#          ██████  ██████  ██   ████ ██      ██  ██████   ██████  ██   ██ ███████ 
-                                                                        
-                                                                    
-        # Configure the grid of the parent tab
-        self.tabview.grid_rowconfigure(0, weight=1)
-        self.tabview.grid_columnconfigure(0, weight=1)
-        self.grid_rowconfigure(0, weight=1)  # Make the row with the Tabview expand vertically
-        self.grid_columnconfigure(1, weight=1)  # Make the column with the Tabview expand horizontally
-        
-        # Update the scroll region of the canvas to include the content
-        self.indexing_plots_frame.update_idletasks()
-        self.canvas_plots.config(scrollregion=self.canvas_plots.bbox("all"))
-        self.update_canvas_size(self.canvas_plots,self.indexing_plots_frame)
-        
-        # Configure weight for grid columns and rows
-        self.tabview.tab("Indexing").grid_rowconfigure(0, weight=1)
-        self.tabview.tab("Indexing").grid_columnconfigure(0, weight=1)
-        self.indexing_content_frame.grid_rowconfigure(0, weight=0)
-        self.indexing_content_frame.grid_rowconfigure(1, weight=0)
-        for col in range(6):
-            self.indexing_content_frame.grid_columnconfigure(col, weight=1)
-        self.indexing_content_frame.grid_rowconfigure(2, weight=1)
-
         # Configure grid weights
         self.tabview.tab("ReIndexing").grid_rowconfigure(0, weight=1)
         self.tabview.tab("ReIndexing").grid_columnconfigure(0, weight=1)
         self.Reindexing_content_frame.grid_rowconfigure(0, weight=1)
         self.Reindexing_content_frame.grid_columnconfigure(0, weight=1)
-
         # Configure weight for grid columns and rows
         self.Reindexing_canvas.grid_rowconfigure(0, weight=1)
         self.Reindexing_canvas.grid_columnconfigure(0, weight=1)
         self.Reindexing_content_frame.update_idletasks()
         self.Reindexing_canvas.update_idletasks()
         self.update_canvas_size(self.Reindexing_canvas,self.Reindexing_content_frame)
-        
 
-        # Bind the configure event to the resize callback
-        self.bind("<Configure>", self.on_resize)        
-        
-        
-        for button in self.buttons:
-            if button.cget("state") == "normal":
-                button.bind("<ButtonPress-1>", self.on_button_press)  # Button press event
-                button.bind("<ButtonRelease-1>", self.on_button_release)  # Button release event
-
-        
-        print(f"Memory usage: {self.memory_usage() / (1024 * 1024):.2f} MB")
-
-        # self.bind('<Configure>', ManagedCTkScrollbar.update_scrollbar_visibility)
-
-        self.bind("<Alt-q>", lambda event: self.quit())
-
-            
 
 #                ███████ ██    ██ ███    ██  ██████ ████████ ██  ██████  ███    ██ ███████ 
 #                ██      ██    ██ ████   ██ ██         ██    ██ ██    ██ ████   ██ ██      
@@ -1123,25 +1398,54 @@ class App(ctk.CTk):
  
 # MCR
     def run_MCR(self):
+        if self.mcr_instance and self.mcr_instance.mcr_running():
+            messagebox.showinfo("MCR", "MCR is already running, STOP it first")
+            return
+        if not self.mcr_path.get_value():
+            messagebox.showerror("Error", "Select the mesh_collect_reproc script first")
+            return
+        if not self.REF:
+            messagebox.showerror("Error", f"You have to set the selected dataset as a reference first!")
+        elif self.per_dataset.get() or self.slurm_check.get() == "on":  # a Slurm job per dataset
+            from codgas_mcr import find_datasets, MCR_STATE_FILE
+            directory = self.dir_entry.get_value()
+            executor = MCR_BATCH_EXECUTOR if self.slurm_check.get() == "on" else "local"
+            try:  # an empty Parallel runs: the CPU count here, codgas_mcr.MCR_BATCH_JOBS queued Slurm jobs
+                concurrency = int(self.parallel_runs_val.get_value() or (0 if executor != "local" else self.parallel_runs_val_placeholder)) or None
+            except ValueError:
+                messagebox.showerror("Error", "Parallel runs must be a whole number")
+                return
+
+            def start(datasets):
+                if not datasets:
+                    messagebox.showerror("Error", f"No dataset (directory with XDS_ASCII.HKL) under {directory}")
+                    return
+                self.start_MCR(datasets=datasets, state_path=os.path.join(directory, MCR_STATE_FILE), concurrency=concurrency,
+                               executor=executor)
+
+            self.jobs.submit("Listing datasets", lambda job: find_datasets(directory), on_done=start)
+        else:
+            self.start_MCR()
+
+    def start_MCR(self, **scheduling):
         widget_dict=[]
         widget_dict.append({"name": "self.mcr_progress", "widget": self.mcr_progress})
-        if self.REF:
-            self.mcr_instance = MCR(self.mcr_path.get_value(),
-                        self.selected_ref,
-                        self.highREScut_val.get_value(),
-                        self.highREScut_val_placeholder,
-                        self.Isig_cut_val.get_value(),
-                        self.Isig_cut_val_placeholder,
-                        self.autoproc.get(),
-                        self.anom.get(),
-                        self.skipdone.get(),
-                        self.template_host_val.get_value(),
-                        self.template_host_val_placeholder,
-                        widget_dict
-                        )
-            self.mcr_instance.process_run_mcr()
-        else:
-            messagebox.showerror("Error", f"You have to set the selected dataset as a reference first!")
+        widget_dict.append({"name": "self.mcr_dashboard", "widget": self.mcr_dashboard})
+        self.mcr_instance = MCR(self.mcr_path.get_value(),
+                    self.selected_ref,
+                    self.highREScut_val.get_value(),
+                    self.highREScut_val_placeholder,
+                    self.Isig_cut_val.get_value(),
+                    self.Isig_cut_val_placeholder,
+                    self.autoproc.get(),
+                    self.anom.get(),
+                    self.skipdone.get(),
+                    self.template_host_val.get_value(),
+                    self.template_host_val_placeholder,
+                    widget_dict,
+                    **scheduling
+                    )
+        self.mcr_instance.process_run_mcr()
         
         # if state == "start":
         #     print("start button is clicked")
@@ -1177,8 +1481,8 @@ class App(ctk.CTk):
         valueX.grid(row=row, column=(col+1), padx=10, pady=0, sticky="w")
         self.ucc_entries[text] = valueX
 
-    def insert_ucc_sg_mean_std_indata(self, directory, filename_pattern):
-        (_,a,a_mean,a_std,b,b_mean,b_std,c,c_mean,c_std,target_files_counter)=self.collect_sg_cell(directory, filename_pattern)
+    def insert_ucc_sg_mean_std_indata(self, filename_pattern, sg_cell):
+        (_,a,a_mean,a_std,b,b_mean,b_std,c,c_mean,c_std,target_files_counter)=sg_cell
         self.a_mean = a_mean
         self.b_mean = b_mean
         self.c_mean = c_mean
@@ -1235,9 +1539,11 @@ class App(ctk.CTk):
             self.label_pattern_counter.configure(text_color=self.label_original_color)
             
     def insert_ucc_gathered_update_fgcolor(self, directory, filename_pattern):
-        self.insert_ucc_sg_mean_std_indata(directory, filename_pattern)
-        self.after(int(self.flashing_interval*1000), self.reset_ucc_entries_gathered)
-        self.update_with_mean_button.configure(state="normal", fg_color=self.default_button_fg_color)
+        def insert(sg_cell):
+            self.insert_ucc_sg_mean_std_indata(filename_pattern, sg_cell)
+            self.after(int(self.flashing_interval*1000), self.reset_ucc_entries_gathered)
+            self.update_with_mean_button.configure(state="normal", fg_color=self.default_button_fg_color)
+        self.collect_sg_cell_job(directory, filename_pattern, insert)
 
     def update_ucc_gathered_value(self, ucc_info, ucc_value):
         if ucc_info in self.ucc_entries:
@@ -1410,75 +1716,64 @@ class App(ctk.CTk):
         ref_dir = os.path.dirname(ref_file)
         ascii_file = os.path.join(ref_dir, "XDS_ASCII.HKL")
         print(ascii_file)
-        self.REF = os.path.join(self.dir_entry.get_value(), "REF.hkl")
-        with open(self.REF, 'w') as file:
-            # Optionally, write some initial data
-            file.write("")
-
-        with open(ascii_file, 'r') as file:
-            file_contents = file.readlines()
-        print("done reading")
-        SG_pattern = "!SPACE_GROUP_NUMBER="
-        UCC_pattern = "!UNIT_CELL_CONSTANTS=" 
-        #updates
-        for line in file_contents:
-            try:
-                if re.search(SG_pattern, line):
-                    if self.SG.get_value():
-                        line = f"{SG_pattern}\t{self.SG.get_value()}\n"
-                        # print("SG found")
-                    else:
-                        print("SG empty")
-                        self.REF
-                        return
-                if re.search(UCC_pattern, line):
-                    #UNIT_CELL_CONSTANTS=   101.490    60.601    63.094  90.000 116.196  90.000
-                    if self.UCC_a.get_value() and self.UCC_b.get_value() and self.UCC_c.get_value():
-                        
-                        # Remove the label part before splitting
-                        line = line.split('=')[1].strip()
-                        
-                        # Use regex to find all numbers
-                        numbers = re.findall(r'\d+\.\d+', line)
-                        
-                        numbers[0] = self.UCC_a.get_value()
-                        numbers[1] = self.UCC_b.get_value()
-                        numbers[2] = self.UCC_c.get_value()
-                        ucc = '\t'.join(numbers)
-                        line= f"{UCC_pattern}\t{ucc}\n"
-                    else:
-                        print("ucc empty")
-                        messagebox.showerror("Error", f"UCC and/or SG are empty in tab 'Data'")
-                        return
-            except TypeError:
-                pass
-                    
-            with open(self.REF, 'a') as file:
-                # Optionally, write some initial data
-                file.write(line)  
-        print("done writing REF")
-        if os.path.isfile(self.REF):
-            self.check_mark_label = ctk.CTkLabel(self.Reindexing_content_frame, image=self.check_mark_photo, text="")
-            self.check_mark_label.grid(row=2, column=4, padx=10, pady=10)
+        if not self.SG.get_value():
+            print("SG empty")
+            return
+        if not (self.UCC_a.get_value() and self.UCC_b.get_value() and self.UCC_c.get_value()):
+            print("ucc empty")
+            messagebox.showerror("Error", f"UCC and/or SG are empty in tab 'Data'")
+            return
+        ref, sg, cell = (os.path.join(self.dir_entry.get_value(), "REF.hkl"), self.SG.get_value(),
+                         (self.UCC_a.get_value(), self.UCC_b.get_value(), self.UCC_c.get_value()))
+        self.REF = None  # until the new REF.hkl is written, RUN must not take an old one
+
+        def written(nbytes):
+            print("done writing REF")
+            self.REF = ref
+            if os.path.isfile(ref):
+                self.check_mark_label = ctk.CTkLabel(self.Reindexing_content_frame, image=self.check_mark_photo, text="")
+                self.check_mark_label.grid(row=2, column=4, padx=10, pady=10)
+
+        def failed(job, e):
+            messagebox.showerror("Error", f"Could not write {ref}:\n{e}")
+
+        # header rewritten, reflections copied as they are, then renamed into place
+        self.jobs.submit("Writing REF.hkl", lambda job: write_reference_hkl(ascii_file, ref, sg, *cell),
+                         on_done=written, on_error=failed, progress=False)
                 
     def find_ref_button_function(self, value):
         if value == 'Auto':
             self.find_best_ref(self.dir_entry.get())
         elif value == 'Auto-guided':
-            self.thread_show_top_refs()
+            self.show_top_refs(self.dir_entry.get())
         elif value == 'Manual':
             self.browse_ref()
             
     def find_best_ref(self, directory):
         self.REF = None
-        files = self.find_files(directory, '**/CORRECT.LP')
-        self.nb_of_refs=len(files)
-        best_reference = self.find_reference(files, 1)
+        options = self.ranking_options()
+
+        def work(job):
+            files = self.find_files(directory, '**/CORRECT.LP')
+            progress = lambda done, total: job.progress(done, total, f"Reading CORRECT.LP {done}/{total}")
+            return len(files), self.rank_refs(files, options, top_k=1, progress=progress)
+
+        self.jobs.submit("Looking for the best reference", work, on_done=self.show_best_ref,
+                         on_error=self.ref_search_failed, on_cancel=self.ref_search_failed)
+
+    def ref_search_failed(self, job=None, error=None):
+        """A reference search was cancelled (no arguments) or failed: back to the previous choice."""
+        self.find_ref_button.set(self.previous_selection_find_ref)
+        if error is not None:
+            self.jobs.show_error(job, error)
+
+    def show_best_ref(self, result):
+        self.nb_of_refs, ranked = result
         mode = ctk.get_appearance_mode()
         textcolor = "black" if mode == "Light" else "white"
 
-        if best_reference:
-            best_ref, _ = best_reference
+        if ranked and ranked[0].total is not None:
+            best_ref = ranked[0].path
             print("looking for the best ref automatically!")
             print(f"best ref is {best_ref}")
             self.best_ref.configure(state="normal")
@@ -1503,48 +1798,22 @@ class App(ctk.CTk):
             self.find_ref_button.set(self.previous_selection_find_ref)
             print("No results found")
 
-    def find_reference(self, files, ranking):
-        all_results = []
-        for file in files:
-            all_results.extend(self.grep_total(file))
-        sorted_results = sorted(
-            all_results,
-            key=lambda x: float(x[1].split()[8]) if len(x[1].split()) > 8 else float('-inf')
-        )
-       
-        if sorted_results:
-            key = int(f"-{ranking}")
-            best_ref, last_line = sorted_results[key]
-            return best_ref, last_line 
-        else:
-            print("No results found")
-            
+    def ranking_options(self):
+        """(metric, weights) selected in 'Rank by', read on the main thread for rank_refs."""
+        metric = self.rank_metrics[self.rank_by.get()]
+        return metric or "isig", None if metric else self.rank_weights
+
+    def rank_refs(self, files, options, top_k=None, progress=None):
+        """Rank CORRECT.LP files as references, best first, with ranking_options(). No Tk: runs in jobs."""
+        metric, weights = options
+        return rank_references(files, metric=metric, weights=weights, top_k=top_k, index=self.header_index, progress=progress)
+
     def extract_correctlp_table(self, correctlp_path):
-        """Search for lines containing 'total' in the given file."""
-        table = []
-        look_for_total = False
-        checkpoint="RESOLUTION     NUMBER OF REFLECTIONS    COMPLETENESS R-FACTOR  R-FACTOR COMPARED I/SIGMA   R-meas  CC(1/2)  Anomal  SigAno   Nano"
-        checkpoint_normalized = re.sub(r'\s+', ' ', checkpoint).strip()
+        """Return the resolution shells and 'total' line of the last statistics table of a CORRECT.LP."""
         try:
-            with open(correctlp_path, 'r') as file:
-                for line in file:
-                    line_normalized = re.sub(r'\s+', ' ', line).strip()
-                    if checkpoint_normalized in line_normalized:
-                        # print("found the table")
-                        look_for_total = True
-                        next(file)
-                        next(file)
-                    if look_for_total and line.strip()[0].isdigit():
-                        table.append(line.strip())
-                    if 'total' in line and look_for_total:
-                        table.append(line.strip())
-                        break
+            return load_correctlp(correctlp_path, self.header_index).lines
         except IOError:
-            pass  # Handle file read errors
-        return table
-
-    def thread_show_top_refs(self):
-        threading.Thread(target=self.show_top_refs, args=(self.dir_entry.get(),)).start()
+            return []  # Handle file read errors
 
     def show_top_refs(self, directory):
         self.REF = None
@@ -1566,7 +1835,7 @@ class App(ctk.CTk):
             self.best_ref.set_value(correctlp)
             self.best_ref.configure(state="readonly", text_color="black", fg_color="#E0E0E0")
             self.previous_selection_find_ref = self.find_ref_button.get()
-            table = refs_tables.get(correctlp)
+            table = self.refs_tables.get(correctlp)
 
             table_as_text = self.format_table_for_output(table)
             self.correctlp_header.configure(text=header)
@@ -1605,48 +1874,38 @@ class App(ctk.CTk):
             
         
             
-        files = self.find_files(directory, '**/CORRECT.LP')
-        nb_of_refs=len(files)
         self.best_ref.configure(state="normal")
         self.best_ref.delete(0, "end")
         self.best_ref.configure(state="readonly")
-        top_refs = [None]*nb_of_refs
-        top_table = [None]*nb_of_refs
-        refs_tables = {}
-        value_0 = None
-        self.progress_window = tk.Toplevel(self)
-        self.progress_window.title("Searching for CORRECT.LPs")
-        self.progress_label = tk.Label(self.progress_window, text="In progress ..", padx=10, pady=10, anchor="w")
-        self.progress_label.pack(pady=10, anchor="w")
-        width = 800
-        height = 100
-        # Center the window
-        self.center_window(self.progress_window, width, height)
-
-
-        # Create and add a Progress Bar
-        self.progress_bar = ctk.CTkProgressBar(self.progress_window, mode="determinate")
-        self.progress_bar.pack(pady=10, padx=10, fill='x')
+        options = self.ranking_options()
+
+        def work(job):
+            files = self.find_files(directory, '**/CORRECT.LP')
+            # every CORRECT.LP is read once and ranked with a single sort
+            progress = lambda done, total: job.progress(done, total, f"Reading CORRECT.LP {done}/{total}")
+            return [ref for ref in self.rank_refs(files, options, progress=progress) if ref.total is not None]
+
+        def fill(ranked):
+            # new ones for each search: the combobox keeps the show_table of the first search,
+            # which reads them through self
+            self.refs_hall_of_fame, self.refs_tables = [], {}
+            value_0 = None
+            for i, ref in enumerate(ranked):
+                self.refs_tables[ref.path] = ref.correctlp.lines  # parsed while ranking, no second read
+                value = f"{i} - {ref.path}"
+                if value_0 is None: value_0 = value
+                self.refs_hall_of_fame.append(value)
+            self.refs_options.configure(values=self.refs_hall_of_fame)
+
+            if value_0 is None:
+                print("No results found")
+                self.find_ref_button.set(self.previous_selection_find_ref)
+                return
+            self.refs_options.set(value_0)
+            show_table(value_0)
 
-        
-        for i in range(nb_of_refs):
-            top_refs[i] = self.find_reference(files, i+1)[0]
-            top_table[i] = (self.extract_correctlp_table(top_refs[i]))
-            refs_tables[top_refs[i]] = top_table[i]
-            value = f"{i} - {top_refs[i]}"
-            if value_0 is None: value_0 = value
-            self.combobox_append_refs(value)
-            
-            if value in self.refs_hall_of_fame:
-                print(f"value alraedy appended: {value}")
-            self.refs_hall_of_fame.append(value)
-            self.progress_label.config(text=value)
-            self.progress_bar.set(i / nb_of_refs)  # Set the progress (normalized to 0-1)
-            self.progress_window.update_idletasks()
-        self.progress_window.destroy()
-        
-        self.refs_options.set(value_0)
-        show_table(value_0)
+        self.jobs.submit("Searching for CORRECT.LPs", work, on_done=fill,
+                         on_error=self.ref_search_failed, on_cancel=self.ref_search_failed)
 
     def center_window(self, window, width, height):
         # Get screen width and height
@@ -1660,17 +1919,6 @@ class App(ctk.CTk):
         # Set the window size and position
         window.geometry(f"{width}x{height}+{x}+{y}")
 
-    def combobox_append_refs(self, new_values):
-        # Get current values (returns a tuple)
-        current_values = self.refs_options.cget("values")
-        # Check if current_values is empty (when initialized with no values)
-        if not current_values:
-            current_values = []
-        # Append new values
-        updated_values = current_values+[new_values]
-        # Update ComboBox with new values
-        self.refs_options.configure(values=updated_values)
-    
     def format_table_for_output(self, table):
         def normalize_data(raw_data):
             normalized = []
@@ -1732,14 +1980,81 @@ class App(ctk.CTk):
 
 # plots UCC                
     def download_plots(self):
-        dpi = simpledialog.askinteger("DPI", "Enter DPI (e.g., 100, 200):", minvalue=1, maxvalue=1000)
-        if dpi:
-            for detail in self.fig_details_entries:
-                fig, title, filename_pattern = detail
-                fig_name = str(filename_pattern) + "_" + str(title) + "_DPI" + str(dpi) + ".png"
-                fig_path = os.path.join(self.dir_entry.get(), fig_name)
-                fig.savefig(fig_path, dpi=dpi)
-            messagebox.showinfo("Downloaded", f"Figures of UCC collected from datasets with pattern {filename_pattern} were saved in {self.dir_entry.get()}")
+        """Ask for the formats and the DPI of the export, see start_export."""
+        from codgas_plots import EXPORT_FORMATS
+        window = tk.Toplevel(self)
+        window.title("Download plots")
+        self.center_window(window, 420, 170)
+        labels = {"png": "PNG per plot", "svg": "SVG per plot", "pdf": "Multi-page PDF", "sheet": "Contact sheet PNG"}
+        format_boxes = {}
+        for i, fmt in enumerate(EXPORT_FORMATS):
+            format_boxes[fmt] = ctk.CTkCheckBox(window, text=labels[fmt])
+            format_boxes[fmt].grid(row=i // 2, column=i % 2, padx=10, pady=6, sticky="w")
+        format_boxes["png"].select()
+        tk.Label(window, text="DPI").grid(row=2, column=0, padx=10, pady=6, sticky="e")
+        dpi_entry = ctk.CTkEntry(window, width=80)
+        dpi_entry.insert(0, str(self.dpi))
+        dpi_entry.grid(row=2, column=1, padx=10, pady=6, sticky="w")
+        ctk.CTkButton(window, text="Export", command=lambda: self.start_export(window, dpi_entry, format_boxes)).grid(
+            row=3, column=0, columnspan=2, pady=10)
+
+    def start_export(self, window, dpi_entry, format_boxes):
+        """Save the plotted histograms on a process pool, one job per file, with progress and Cancel in `window`."""
+        import multiprocessing
+        from codgas_plots import export_jobs
+        try:
+            dpi = int(dpi_entry.get())
+            if not 1 <= dpi <= 1000:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("DPI", "Enter a DPI between 1 and 1000", parent=window)
+            return
+        formats = {fmt for fmt, box in format_boxes.items() if box.get()}
+        directory = self.dir_entry.get()
+        jobs = export_jobs(self.plot_registry.plotted(), directory, dpi, formats)
+        if not jobs:
+            messagebox.showinfo("Download plots", "Nothing to export: plot some histograms and pick a format", parent=window)
+            return
+
+        for widget in window.winfo_children():
+            widget.destroy()
+        label = tk.Label(window, text=f"Exporting 0/{len(jobs)}", padx=10, pady=10, anchor="w")
+        label.pack(pady=10, anchor="w")
+        bar = ctk.CTkProgressBar(window, mode="determinate")
+        bar.set(0)
+        bar.pack(pady=10, padx=10, fill='x')
+
+        # spawn: a forked child would inherit the Tk interpreter
+        pool = ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1), mp_context=multiprocessing.get_context("spawn"))
+        futures = [pool.submit(func, *args) for func, args in jobs]
+        cancelled = []
+
+        def cancel():
+            cancelled.append(True)
+            pool.shutdown(wait=False, cancel_futures=True)  # the files being written are finished, the rest dropped
+
+        ctk.CTkButton(window, text="Cancel", command=cancel).pack(pady=10)
+        window.protocol("WM_DELETE_WINDOW", cancel)
+
+        def poll():
+            done = [future for future in futures if future.done() and not future.cancelled()]
+            label.config(text=f"Exporting {len(done)}/{len(futures)}")
+            bar.set(len(done) / len(futures))
+            if len(done) < len(futures) and not cancelled:
+                window.after(EXPORT_POLL_MS, poll)
+                return
+            pool.shutdown(wait=False, cancel_futures=True)
+            window.destroy()
+            errors = [future.exception() for future in done if future.exception() is not None]
+            saved = len(done) - len(errors)
+            if errors:
+                messagebox.showerror("Download plots", f"{len(errors)} of {len(futures)} files could not be saved: {errors[0]}")
+            elif cancelled:
+                messagebox.showinfo("Download plots", f"Cancelled, {saved} of {len(futures)} files saved in {directory}")
+            else:
+                messagebox.showinfo("Downloaded", f"{saved} files of UCC histograms at {dpi} DPI were saved in {directory}")
+
+        window.after(EXPORT_POLL_MS, poll)
 
     def fitting_plots(self, value):
         if value == 'Fit H':
@@ -1756,6 +2071,7 @@ class App(ctk.CTk):
         self.indexing_plots_frame.update_idletasks()
         self.canvas_plots.config(scrollregion=self.canvas_plots.bbox("all"))
         self.fit_by="height"
+        self.schedule_plot_sync()
         self.indexing_h_scrollbar.update_scrollbar_visibility()
         self.indexing_v_scrollbar.update_scrollbar_visibility()
 
@@ -1766,6 +2082,7 @@ class App(ctk.CTk):
         self.indexing_plots_frame.update_idletasks()
         self.canvas_plots.config(scrollregion=self.canvas_plots.bbox("all"))
         self.fit_by="width"
+        self.schedule_plot_sync()
         self.indexing_h_scrollbar.update_scrollbar_visibility()
         self.indexing_v_scrollbar.update_scrollbar_visibility()
 
@@ -1780,13 +2097,18 @@ class App(ctk.CTk):
         self.dpi = int(self.dpi_box.get())
         for widget in self.indexing_plots_frame.winfo_children():
             widget.destroy()
-        self.plots_canvases = []
+        if self.plot_registry is not None:
+            self.plot_registry.detach_all()  # the renders at the old DPI are kept, within codgas_plots.PLOT_MEMORY_BUDGET
         # print(self.plots_info_entries.items())
+        # redrawn from the histogram cache, the datasets are not scanned again
         for filename_pattern, plots_starting_row in self.plots_info_entries.items():
-            self.plotted = False
-            self.plot_all_ucc(self.dir_entry.get(),filename_pattern, self.dpi, plots_starting_row)
+            self.render_ucc_pattern(filename_pattern, self.dpi, plots_starting_row)
+        self.plotted = bool(self.plots_info_entries)
 
-    def open_figure_in_new_window(self, fig):
+    def open_figure_in_new_window(self, model):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+        from codgas_plots import draw_histogram, AdaptiveBins, ADAPTIVE_MIN_VALUES
         # Create a new top-level window
         new_window = tk.Toplevel(self)
         new_window.title("Figure")
@@ -1795,23 +2117,8 @@ class App(ctk.CTk):
         fig_new = Figure(figsize=(6, 4), dpi=150)
         ax_new = fig_new.add_subplot(111)
 
-        # Extract data from the original figure's histogram patches
-        for ax in fig.axes:
-            for patch in ax.patches:
-                # Extract the data from the patch
-                x = patch.get_x()  # x-coordinate of the rectangle's left side
-                width = patch.get_width()  # width of the rectangle
-                height = patch.get_height()  # height of the rectangle
-
-                # Plot this data in the new figure
-                ax_new.bar(x, height, width=width, alpha=0.7, color="blue", edgecolor="#483D8B")
-
-        # Copy other plot attributes
-        if fig.axes:
-            source_ax = fig.axes[0]
-            ax_new.set_title(source_ax.get_title())
-            ax_new.set_xlabel(source_ax.get_xlabel())
-            ax_new.set_ylabel(source_ax.get_ylabel())            
+        # Drawn from the cached model like the small plot, min/max/mean/std lines and legend included
+        bars = draw_histogram(ax_new, model, fontsize=10)
 
         # Create a canvas for the new window
         canvas = FigureCanvasTkAgg(fig_new, master=new_window)
@@ -1820,6 +2127,14 @@ class App(ctk.CTk):
         # Create and add the navigation toolbar
         toolbar = NavigationToolbar2Tk(canvas, new_window)
         toolbar.pack(side=tk.TOP, fill=tk.X)  # Pack toolbar first
+        if len(model.values) >= ADAPTIVE_MIN_VALUES:
+            # re-bin the raw values to the zoomed range, as many bins as the full view
+            adaptive = AdaptiveBins(ax_new, bars, model)
+            adaptive_on = tk.BooleanVar(value=False)
+            def toggle_adaptive():
+                adaptive.enable(adaptive_on.get())
+                canvas.draw_idle()
+            tk.Checkbutton(toolbar, text="Adaptive bins", variable=adaptive_on, command=toggle_adaptive).pack(side=tk.RIGHT)
         canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
         
         # Update the window to ensure the toolbar is rendered and get its height
@@ -1847,29 +2162,59 @@ class App(ctk.CTk):
         new_window.canvas = canvas
         new_window.fig = fig_new
 
+    def ucc_histograms(self, directory, filename_pattern, on_done):
+        """on_done(histogram models of a, b and c for a pattern); the datasets are only scanned, as a job, if not cached for this directory."""
+        cached = self.histogram_cache.get(filename_pattern)
+        if cached is not None and cached[0] == directory:
+            on_done(cached[1])
+            return
+
+        def store(sg_cell):
+            (_,a,a_mean,a_std,b,b_mean,b_std,c,c_mean,c_std,target_files_counter)=sg_cell
+            models = {name: histogram_model(name, values) for name, values in (("a", a), ("b", b), ("c", c))}
+            self.histogram_cache[filename_pattern] = (directory, models)
+            on_done(models)
+
+        self.collect_sg_cell_job(directory, filename_pattern, store)
+
+    def render_ucc_pattern(self, filename_pattern, dpi, plots_starting_row):
+        """Draw the a, b, c histograms of a pattern from the cache, no file system access."""
+        plots_info = ctk.CTkLabel(self.indexing_plots_frame, text=f"Unit cell distribution among datasets with files: {filename_pattern}")
+        plots_info.grid(row=plots_starting_row, column=0, columnspan=4, padx=(10,10), pady=(0,0), sticky="w")
+        row=plots_starting_row+1
+        models = self.histogram_cache[filename_pattern][1]
+        for col, name in enumerate(("a", "b", "c")):
+            self.plot_ucc_histograms(models[name], row, col, dpi, filename_pattern)
+        # Update the scroll region of the canvas to include the content
+        self.indexing_plots_frame.update_idletasks()
+        self.canvas_plots.config(scrollregion=self.canvas_plots.bbox("all"))
+
     def plot_all_ucc(self, directory, filename_pattern, dpi, plots_starting_row):
         if not filename_pattern in self.plots_info_entries or not self.plotted:
-            plots_info = ctk.CTkLabel(self.indexing_plots_frame, text=f"Unit cell distribution among datasets with files: {filename_pattern}")
-            plots_info.grid(row=plots_starting_row, column=0, columnspan=4, padx=(10,10), pady=(0,0), sticky="w")
-            row=plots_starting_row+1
-            (_,a,a_mean,a_std,b,b_mean,b_std,c,c_mean,c_std,target_files_counter)=self.collect_sg_cell(directory, filename_pattern)
-            self.plot_ucc_histograms(a, "a", row, 0, dpi,filename_pattern)
-            self.plot_ucc_histograms(b, "b", row, 1, dpi,filename_pattern)
-            self.plot_ucc_histograms(c, "c", row, 2, dpi,filename_pattern)
-            # Update the scroll region of the canvas to include the content
-            self.indexing_plots_frame.update_idletasks()
-            self.canvas_plots.config(scrollregion=self.canvas_plots.bbox("all"))
-            self.plotted = True
-            self.download_plots.configure(state="normal", fg_color=self.default_button_fg_color)
-            if not filename_pattern in self.plots_info_entries:
-                self.plots_info_entries[filename_pattern] = plots_starting_row
-                self.plots_starting_row += 2
-            self.indexing_h_scrollbar.update_scrollbar_visibility()
-            self.indexing_v_scrollbar.update_scrollbar_visibility()
+            if filename_pattern in self.plots_info_entries:
+                plots_starting_row = self.plots_info_entries[filename_pattern]
+            self.ucc_histograms(directory, filename_pattern,
+                                lambda models: self.show_ucc_pattern(filename_pattern, dpi, plots_starting_row))
         else:
             print("already plotted")
+
+    def show_ucc_pattern(self, filename_pattern, dpi, plots_starting_row):
+        """Second half of plot_all_ucc, once the histograms are in the cache."""
+        # a second click may have plotted the pattern while this one was scanning
+        plots_starting_row = self.plots_info_entries.get(filename_pattern, plots_starting_row)
+        self.render_ucc_pattern(filename_pattern, dpi, plots_starting_row)
+        self.plotted = True
+        self.download_plots.configure(state="normal", fg_color=self.default_button_fg_color)
+        if not filename_pattern in self.plots_info_entries:
+            self.plots_info_entries[filename_pattern] = plots_starting_row
+            self.plots_starting_row += 2
+        stats = self.plot_registry.stats()
+        print(f"Plots: {stats['plots']} on display, {stats['images']} renders in memory ({stats['image_bytes'] / 2**20:.1f} MB), "
+              f"{stats['pngs']} compressed ({stats['png_bytes'] / 2**20:.1f} MB)")
+        self.indexing_h_scrollbar.update_scrollbar_visibility()
+        self.indexing_v_scrollbar.update_scrollbar_visibility()
             
-    def plot_ucc_histograms(self, ucc, name, row, col, dpi, filename_pattern):
+    def plot_ucc_histograms(self, model, row, col, dpi, filename_pattern):
         # Remove existing frame in the specified grid cell
         for widget in self.indexing_plots_frame.grid_slaves(row=row, column=col):
             widget.destroy()
@@ -1884,48 +2229,139 @@ class App(ctk.CTk):
         self.frame.grid_rowconfigure(row, weight=1)
         self.frame.grid_columnconfigure(col, weight=1)
 
-        try:
-            # Create a Matplotlib figure and plot
-            fig, ax = plt.subplots(figsize=(3, 3), dpi=dpi)  # Adjust size as needed
-            self.fig_entries.append(fig)
-            sns.histplot(ucc, bins=100, kde=False, ax=ax)
-            ax.axvline(np.min(ucc), color='r', linestyle='dashed', linewidth=1, label=f'Min: {np.min(ucc)}')
-            ax.axvline(np.max(ucc), color='g', linestyle='dashed', linewidth=1, label=f'Max: {np.max(ucc)}')
-            ax.axvline(np.mean(ucc), color='b', linestyle='dashed', linewidth=1, label=f'Mean: {np.mean(ucc):.2f}')
-            ax.axvline(np.mean(ucc) + np.std(ucc), color='y', linestyle='dashed', linewidth=1, label=f'Std Dev: {np.std(ucc):.2f}')
-            ax.axvline(np.mean(ucc) - np.std(ucc), color='y', linestyle='dashed', linewidth=1)
-            ax.legend(fontsize=7, loc='upper right')
-            ax.set_title(f'Unit cell constant {name}', fontsize=9)
-            ax.set_xlabel('Value', fontsize=9)
-            ax.set_ylabel('Frequency', fontsize=9)
-            title=f'Unit cell constant {name}'
-            self.fig_details_entries.append([fig,title,filename_pattern])
-        finally:
-            plt.close('all')  # Ensure all figures are closed
-        
-        # Create a canvas to display the plot and add it to the frame
-        canvas = FigureCanvasTkAgg(fig, master=self.frame)
+        # The histogram is drawn by the render pool and shown as an image; the interactive
+        # matplotlib canvas is only created when the plot is clicked (open_figure_in_new_window)
         canvas_height = self.canvas_plots.winfo_height()-20
         canvas_width = (self.canvas_plots.winfo_width()-60)/3
-        canvas.draw()
-        canvas_widget = canvas.get_tk_widget()
-        canvas_widget.bind("<Button-1>", lambda event, f=fig: self.open_figure_in_new_window(f))
-
-        if self.fit_by == "height":
-            canvas_widget.config(width=canvas_height, height=canvas_height)
-        else:
-            canvas_widget.config(width=canvas_width, height=canvas_width)
+        size = canvas_height if self.fit_by == "height" else canvas_width
+        if size <= 1:
+            size = 3 * dpi  # not mapped yet, the old 3 inch figure
+        canvas_widget = tk.Canvas(self.frame, width=size, height=size, borderwidth=0, highlightthickness=0, bg="white")
+        canvas_widget.model = model
+        canvas_widget.dpi = dpi
+        canvas_widget.image = None
+        canvas_widget.image_item = canvas_widget.create_image(0, 0, anchor="nw")
+        canvas_widget.render_generation = 0
+        canvas_widget.rendered_size = None  # size of the image shown or being rendered, None while a placeholder
+        canvas_widget.shown_size = None  # size the image on display was made for, differs from rendered_size in a preview
+        canvas_widget.key = (filename_pattern, model.name, dpi)  # its renders are kept in the plot registry
+        if self.plot_registry is None:
+            from codgas_plots import PlotRegistry, PLOT_MEMORY_BUDGET
+            self.plot_registry = PlotRegistry(PLOT_MEMORY_BUDGET)
+        self.plot_registry.add(canvas_widget.key, model, canvas_widget)
+        canvas_widget.bind("<Button-1>", lambda event, m=model: self.open_figure_in_new_window(m))
         canvas_widget.grid(row=0, column=0, sticky="nsew")  # Ensure proper grid placement
-        self.plots_canvases.append(canvas_widget)
-        gc.collect()
+        self.schedule_plot_sync()
+
+    @property
+    def plots_canvases(self):
+        """The plot widgets on display, from the plot registry."""
+        return self.plot_registry.widgets() if self.plot_registry is not None else []
+
+    def submit_plot_render(self, plot):
+        """Render a plot's histogram at the plot's current size on the render pool."""
+        from codgas_plots import render_histogram
+        if self.render_pool is None:
+            import multiprocessing
+            # spawn: a forked child would inherit the Tk interpreter
+            self.render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        plot.render_generation += 1
+        generation = plot.render_generation
+        plot.rendered_size = int(float(plot.cget("width")))
+        plot.render_started = time.perf_counter()
+        future = self.render_pool.submit(render_histogram, plot.model, plot.dpi, plot.rendered_size)
+        # runs on the pool's result thread: only hand the result over, Tk is touched in poll_plot_renders
+        future.add_done_callback(lambda f: self.render_results.put((plot, generation, f)))
+        self.renders_pending += 1
+        if self._render_poll is None:
+            self._render_poll = self.after(RENDER_POLL_MS, self.poll_plot_renders)
+
+    def poll_plot_renders(self):
+        """Show finished renders as PhotoImages, for at most RENDER_POLL_BUDGET per call."""
+        from PIL import Image, ImageTk
+        deadline = time.perf_counter() + RENDER_POLL_BUDGET
+        while time.perf_counter() < deadline:
+            try:
+                plot, generation, future = self.render_results.get_nowait()
+            except queue.Empty:
+                break
+            self.renders_pending -= 1
+            if generation != plot.render_generation or not plot.winfo_exists():
+                continue  # re-rendered since, or the plot was destroyed
+            try:
+                width, height, rgba = future.result()
+            except Exception as e:
+                print(f"Rendering histogram {plot.model.name} failed: {e}")
+                continue
+            metrics.timing("plots.render", time.perf_counter() - plot.render_started, operation=False)
+            raster = Image.frombuffer("RGBA", (width, height), rgba, "raw", "RGBA", 0, 1)
+            self.plot_registry.store(plot.key, raster, plot.rendered_size)
+            plot.image = ImageTk.PhotoImage(raster)
+            plot.itemconfigure(plot.image_item, image=plot.image)
+            plot.shown_size = plot.rendered_size
+        self._render_poll = self.after(RENDER_POLL_MS, self.poll_plot_renders) if self.renders_pending else None
+
+    def schedule_plot_sync(self):
+        if self._plot_sync is None:
+            self._plot_sync = self.after_idle(self.sync_visible_plots)
+
+    def sync_visible_plots(self):
+        """Virtualize the plot grid: only plots in (or near) the canvas_plots viewport hold an image.
+
+        Plots scrolling in show their render from the plot registry, or are rendered (again,
+        if their size changed since); plots scrolling out drop their PhotoImage and stay as
+        empty placeholders of the same size, so Tk memory follows the viewport and not the
+        number of plotted patterns. While the window is being resized, visible plots only
+        get their last render scaled to their new size.
+        """
+        self._plot_sync = None
+        view_height = self.canvas_plots.winfo_height()
+        top = self.canvas_plots.canvasy(0) - PLOT_PREFETCH * view_height
+        bottom = self.canvas_plots.canvasy(view_height) + PLOT_PREFETCH * view_height
+        deadline = time.perf_counter() + RESIZE_PREVIEW_BUDGET
+        for plot in self.plots_canvases:
+            if not plot.winfo_exists():
+                continue  # its grid cell was plotted again, the new widget took over its key
+            y = plot.master.winfo_y() + plot.winfo_y()  # in indexing_plots_frame, i.e. canvas coordinates
+            if y + plot.winfo_height() >= top and y <= bottom:
+                size = int(float(plot.cget("width")))
+                if self.resizing:
+                    if plot.shown_size != size and time.perf_counter() < deadline:
+                        self.show_plot_raster(plot, size)
+                elif plot.rendered_size != size:
+                    if self.plot_registry.has_render(plot.key, size):
+                        plot.render_generation += 1  # a render still in flight is not needed any more
+                        plot.rendered_size = size
+                        self.show_plot_raster(plot, size)
+                    else:
+                        self.submit_plot_render(plot)
+                elif plot.shown_size != size:
+                    self.show_plot_raster(plot, size)  # a preview resized back to the rendered size
+            elif plot.rendered_size is not None:
+                plot.render_generation += 1  # a render still in flight is dropped when it arrives
+                plot.rendered_size = None
+                plot.shown_size = None
+                plot.image = None
+                plot.itemconfigure(plot.image_item, image="")
+
+    def show_plot_raster(self, plot, size):
+        """Show a plot's last render, scaled to `size` pixels wide if it was rendered at another size."""
+        from PIL import Image, ImageTk
+        raster, rendered_size = self.plot_registry.render(plot.key)
+        if raster is None:
+            return  # evicted, rendered again once the resize is over
+        if size != rendered_size:
+            raster = raster.resize((size, max(1, round(size * raster.height / raster.width))), Image.NEAREST)  # a draft, 40x faster than bilinear
+        plot.image = ImageTk.PhotoImage(raster)
+        plot.itemconfigure(plot.image_item, image=plot.image)
+        plot.shown_size = size
 
     def plot_SG_pie_chart(self, directory, target_filename):
-        if os.path.isfile(directory+f"/cell_param_{target_filename}.log"):
-            data = np.genfromtxt(directory+f"/cell_param_{target_filename}.log")
-            data = data[:,1]
-        else:
-            data = self.collect_sg_cell(directory, target_filename)
-            data = data[0]
+        self.collect_sg_cell_job(directory, target_filename, self.show_SG_pie_chart)
+
+    def show_SG_pie_chart(self, sg_cell):
+        import matplotlib.pyplot as plt
+        data = sg_cell[0]
         
         # Count occurrences
         unique_values, counts = np.unique(data, return_counts=True)
@@ -1937,42 +2373,53 @@ class App(ctk.CTk):
         plt.show()
 
     def on_resize(self, event):
+        if event.widget is not self:
+            return  # a child widget's <Configure>, seen through the window's bindtag
         # If a resize event is already scheduled, cancel it
         if self._resize_after:
             self.after_cancel(self._resize_after)
 
-        # Schedule a resize event to be called after a short delay
-        self._resize_after = self.after(500, self.resize_action)
+        # Until the window keeps its size for RESIZE_SETTLE_MS, plots only get scaled previews
+        self._resize_after = self.after(RESIZE_SETTLE_MS, self.resize_action)
+        self.resizing = True
+        if self._resize_step is None:
+            self._resize_step = self.after_idle(self.resize_preview)
+
+    def resize_plots(self):
+        """Give the plots the size fitting canvas_plots, by height or by width (Fit H / Fit W)."""
+        if self.fit_by == "height":
+            size = self.canvas_plots.winfo_height()-20
+        else:
+            size = (self.canvas_plots.winfo_width()-60)/3
+        for plot in self.plots_canvases:
+            plot.config(width=size, height=size)
+
+    def resize_preview(self):
+        """One step of a window resize: the plots take their new size and show their last render scaled to it."""
+        self._resize_step = None
+        if "Indexing" in self.tab_builders or not self.plotted:
+            return
+        self.resize_plots()
+        self.schedule_plot_sync()
 
     def resize_action(self):
+        self._resize_after = None
+        self.resizing = False
         current_size = self.winfo_width(), self.winfo_height()
         if current_size != self.previous_size:
             # Get the new size of the window
             width, height = self.winfo_width(), self.winfo_height()
             # Update the dimensions of the CTkTabview
             self.tabview.configure(width=width, height=height)
-            # resize plots canvas
-            plot_height = self.canvas_plots.winfo_height()-20
-            plot_width = (self.canvas_plots.winfo_width()-60)/3
-
-            if self.plotted:
-                if self.fit_by == "height":
-                    for plot in self.plots_canvases:
-                        plot.config(width=plot_height, height=plot_height)
-                if self.fit_by == "width":
-                    for plot in self.plots_canvases:
-                        plot.config(width=plot_width, height=plot_width)
-
-            self.indexing_plots_frame.update_idletasks()
-            self.Reindexing_canvas.update_idletasks()
-            self.canvas_plots.config(scrollregion=self.canvas_plots.bbox("all"))
             self.previous_size = current_size
+            if "Indexing" in self.tab_builders:
+                return  # not built yet, nothing else to resize
+            if self.plotted:
+                self.resize_plots()
             self.indexing_h_scrollbar.update_scrollbar_visibility()
             self.indexing_v_scrollbar.update_scrollbar_visibility()
-            # self.update_scrollbars()
-            gc.collect()
-        else:
-            pass
+        if "Indexing" not in self.tab_builders:
+            self.schedule_plot_sync()  # the visible plots rendered again at their final size
 
 
     # def on_press(self, event):
@@ -2038,6 +2485,7 @@ class App(ctk.CTk):
  
  # sidebar               
     def open_documentation_url(self):
+        import webbrowser
         webbrowser.open("https://sites.google.com/site/codgas1/overview?authuser=0")
 
     def copy_citation(self):
@@ -2051,104 +2499,174 @@ class App(ctk.CTk):
             print(f"Failed to copy citation: {e}")
 
     def view_parameters(self):
-        best_ref = self.selected_ref if self.selected_ref else self.best_ref.get()
+        best_ref = self.selected_ref
+        if not best_ref and "ReIndexing" not in self.tab_builders:  # best_ref only exists once the tab is built
+            best_ref = self.best_ref.get()
         best_ref_ASCII = os.path.join(os.path.dirname(best_ref), "XDS_ASCII.HKL")
-        if not os.path.isfile(best_ref_ASCII):
+        if not best_ref or not os.path.isfile(best_ref_ASCII):
             best_ref_ASCII = "does not exist"
         messagebox.showinfo("Parameters", "User entered values                                                                             \n\n"f"Directory:   {self.dir_entry.get()}\n"
                             f"Spacegroup:   {self.SG.get()}\n"
                             f"Unit cell a:  {self.UCC_a.get_value()}\n"
                             f"Unit cell b:  {self.UCC_b.get()}\n"
                             f"Unit cell c:  {self.UCC_c.get()}\n"
-                            f"File name pattern:  {self.filename_pattern}\n"
+                            f"File name pattern:  {self.filename_pattern or 'not chosen yet'}\n"
                             f"REF dataset: {best_ref_ASCII}")
 
 
    
     def SG_INFO(self):
+        import webbrowser
         webbrowser.open("http://img.chem.ucl.ac.uk/sgp/large/sgp.htm")
 
 
 # tools        
-    def find_and_log_unit_cell_constants(self, directory, filename_pattern):
-        # print("function was called!!!!!!!!!!!")
+    def find_and_log_unit_cell_constants(self, directory, filename_pattern, export_log=False, progress=None):
         target_filename = filename_pattern
-        search_pattern1 = "SPACE_GROUP_NUMBER="
-        search_pattern2 = "UNIT_CELL_CONSTANTS"
-        log_file_path = os.path.join(directory, f"cell_param_{target_filename}.log")
-        target_files_counter = 0
-        # Open the log file for appending
-        with open(log_file_path, "w") as log_file:
-            # Walk through the directory structure up to a depth of 2
-            for root, dirs, files in os.walk(directory):
-                # Calculate the current depth
-                depth = root[len(directory):].count(os.sep)
-                if depth > 2:
-                    # If the depth is more than 2, skip further directories
-                    dirs[:] = []
-                    continue
-
-                # Check each file in the current directory
-                for file in files:
-                    if file == target_filename:
-                        # Construct the full path of the file
-                        file_path = os.path.join(root, file)
-                        
-                        try:
-                            # Open the file and search for the pattern
-                            with open(file_path, 'r') as f:
-                                for line in f:
-                                    if search_pattern1 in line:
-                                        # Write the matching line to the log file
-                                        log_file.write(f"{file_path}:\t{line.split()[1]}")
-                                        # break  # Stop after the first match
-                                    if search_pattern2 in line:
-                                        # Write the matching line to the log file
-                                        ucc_list = line.split()[1:7]
-                                        UCC = '\t'.join(map(str, ucc_list))
-                                        log_file.write(f"  {UCC} \n")
-                                        break  # Stop after the first match
-                            target_files_counter += 1
-                        except Exception as e:
-                            print(f"An error occurred while processing {file_path}: {e}")
-        return target_files_counter
-
-    def collect_sg_cell(self, directory, target_filename):
-        target_files_counter=self.find_and_log_unit_cell_constants(directory, target_filename)            
-        data = np.genfromtxt(directory+f"/cell_param_{target_filename}.log")
-        sg = data[:,1] ; sg = sg.astype(int)
-        a = data[:,2] ; a = a.astype(float) ; a_mean = round(np.mean(a), 2) ; a_std = round(np.std(a), 2)
-        b = data[:,3] ; b = b.astype(float) ; b_mean = round(np.mean(b), 2) ; b_std = round(np.std(b), 2)
-        c = data[:,4] ; c = c.astype(float) ; c_mean = round(np.mean(c), 2) ; c_std = round(np.std(c), 2)
-        return(sg,a,a_mean,a_std,b,b_mean,b_std,c,c_mean,c_std,target_files_counter)
+        # Walk the directory structure up to a depth of 2, listing and parsing in parallel
+        scan = scan_datasets(directory, target_filename, max_depth=2, workers=self.scan_workers, index=self.header_index,
+                             progress=progress)
+        print(f"scanned {scan.files_found} files with pattern {target_filename} in {scan.elapsed:.2f} s "
+              f"(index: {scan.cache_hits} hits, {scan.cache_misses} misses, {scan.total_bytes_read / 1024:.1f} kB read)")
+        if export_log:
+            log_file_path = os.path.join(directory, f"cell_param_{target_filename}.log")
+            try:
+                export_ucc_log(scan, log_file_path)
+            except OSError as e:
+                print(f"Could not write {log_file_path}: {e}")
+        return scan
+
+    def collect_sg_cell_job(self, directory, target_filename, on_done):
+        """Run collect_sg_cell as a job, on_done(its result) on the main thread, only if datasets were found."""
+        if directory == self.dir_placeholder or not os.path.isdir(directory):
+            messagebox.showerror("Error", "Enter the directory of the datasets in the 'Data' tab first")
+            return None
+        export_log = self.export_ucc_log.get()  # Tk variables are read here, not in the job
+
+        def found(sg_cell):
+            if len(sg_cell[1]) == 0:  # no cell to take a min, mean or histogram of
+                messagebox.showinfo("No datasets found", f"No dataset with a {target_filename} was found in {directory}")
+                return
+            on_done(sg_cell)
+
+        def work(job):
+            progress = lambda done, total: job.progress(done, total, f"Scanning {directory} for {target_filename}: "
+                                                                     f"level {min(int(done) + 1, total)}/{total}")
+            return self.collect_sg_cell(directory, target_filename, export_log, progress)
+
+        return self.jobs.submit(f"Scanning for {target_filename}", work, on_done=found)
+
+    def collect_sg_cell(self, directory, target_filename, export_log=False, progress=None):
+        scan = self.find_and_log_unit_cell_constants(directory, target_filename, export_log, progress)
+        data = scan.table
+        cell = cell_statistics(data)["cell"]
+        sg = data["sg"].astype(int)
+        a = data["a"] ; a_mean = round(cell["a"]["mean"], 2) ; a_std = round(cell["a"]["std"], 2)
+        b = data["b"] ; b_mean = round(cell["b"]["mean"], 2) ; b_std = round(cell["b"]["std"], 2)
+        c = data["c"] ; c_mean = round(cell["c"]["mean"], 2) ; c_std = round(cell["c"]["std"], 2)
+        return(sg,a,a_mean,a_std,b,b_mean,b_std,c,c_mean,c_std,scan.files_found)
     
     def find_files(self, directory, pattern):
         """Find files matching the given pattern in the specified directory."""
-        search_pattern = os.path.join(directory, pattern)
-        found_files = glob.glob(search_pattern, recursive=True)
-        return list(set(found_files))
+        return find_files(directory, pattern)
     
-    def grep_total(self, file_path):
-        """Search for lines containing 'total' in the given file."""
-        results = []
+    def update_telemetry(self):
+        """Refresh the sidebar telemetry: memory, plots, cache hit rates, scan speed and the last operation."""
         try:
-            with open(file_path, 'r') as file:
-                for line in file:
-                    if 'total' in line:
-                        results.append((file_path, line.strip()))
-        except IOError:
-            pass  # Handle file read errors
-        return results
+            metrics.gauge("gui.rss", self.memory_usage())
+        except ImportError:
+            pass  # no psutil, no RSS
+        figures = sum(hasattr(window, "fig") for window in self.winfo_children())  # open_figure_in_new_window
+        metrics.gauge("gui.figure_windows", figures)
+        lines = []
+        if self.plot_registry is not None:
+            stats = self.plot_registry.stats()
+            metrics.gauge("plots.shown", stats["plots"])
+            lines.append(f"Plots: {stats['plots']} shown, {stats['images']} renders "
+                         f"({stats['image_bytes'] / 2**20:.1f} MB), {stats['pngs']} as PNG ({stats['png_bytes'] / 2**20:.1f} MB)")
+        snapshot = metrics.sample()
+        gauges = snapshot["gauges"]
+        if "gui.rss" in gauges:
+            lines.insert(0, f"RSS: {gauges['gui.rss'] / 2**20:.0f} MB")
+        lines.append(f"Figure windows: {figures}")
+        for label, name in (("Render cache", "render_cache"), ("Header index", "index")):
+            rate = metrics.hit_rate(name)
+            if rate is not None:
+                lines.append(f"{label}: {rate:.0%} hits")
+        if "scan.files_per_second" in gauges:
+            lines.append(f"Last scan: {gauges['scan.files_per_second']:.0f} files/s")
+        if snapshot["last"] is not None:
+            lines.append(f"Last: {snapshot['last']['name']}, {snapshot['last']['seconds']:.2f} s")
+        worst = self.watchdog.worst(1)
+        if worst:
+            method, stalls, seconds, longest = worst[0]
+            lines.append(f"Stalls: {snapshot['counters']['gui.stalls']}, worst {method.split('.')[-1]} {seconds:.1f} s")
+        text = "\n".join(lines)
+        if self.telemetry_label.cget("text") != text:
+            self.telemetry_label.configure(text=text)
+        self.after(TELEMETRY_MS, self.update_telemetry)
+
+    def save_metrics(self):
+        """Save the metrics history (an hour of telemetry samples) as JSON, to look into a slow shift afterwards."""
+        path = filedialog.asksaveasfilename(title="Save metrics", defaultextension=".json", filetypes=[("JSON", "*.json")],
+                                            initialfile=f"codgas_metrics_{datetime.now():%Y%m%d_%H%M%S}.json")
+        if not path:
+            return
+        try:
+            metrics.dump(path)
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not save the metrics:\n{e}")
+            return
+        print(f"Metrics saved in {path}")
+
+    def on_close(self):
+        """Closing the window: cancel the jobs, stop the MCR, shut the pools down, then destroy the window."""
+        if self.mcr_instance is not None and self.mcr_instance.mcr_running():
+            if not messagebox.askokcancel("Quit", "MCR is still running. Stop it and quit?"):
+                return
+            self.mcr_instance.stop_mcr()
+        self.jobs.shutdown()
+        if self.render_pool is not None:
+            self.render_pool.shutdown(wait=False, cancel_futures=True)
+        self.watchdog.stop()
+        self.withdraw()
+        from codgas_mcr import MCR_STOP_GRACE
+        self.destroy_when_stopped(time.perf_counter() + MCR_STOP_GRACE + 1)
+
+    def destroy_when_stopped(self, deadline):
+        """Destroy the window once the MCR is gone: its SIGKILL timer would not outlive this process."""
+        if self.mcr_instance is not None and self.mcr_instance.mcr_running() and time.perf_counter() < deadline:
+            self.after(100, self.destroy_when_stopped, deadline)
+            return
+        self.destroy()
 
     def memory_usage(self):
+        import psutil
         process = psutil.Process(os.getpid())
         mem_info = process.memory_info()
         return mem_info.rss  # Return memory usage in bytes
- 
+
+    def report_startup(self):
+        """--startup-benchmark: print the time to the first window and what each heavy module costs to import, then quit."""
+        import subprocess
+        self.update_idletasks()
+        print(f"time to first window: {time.perf_counter() - START_TIME:.3f} s")
+        for module in STARTUP_MODULES:
+            # cold import in a fresh interpreter; the last -X importtime line is the module itself, cumulative in us
+            result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True)
+            cumulative_us = int(result.stderr.strip().splitlines()[-1].split("|")[1])
+            loaded = "at startup" if module in sys.modules else "lazy"
+            print(f"  import {module:<36} {cumulative_us / 1000:8.1f} ms  ({loaded})")
+        self.quit()
 
 
+# modules reported by --startup-benchmark
+STARTUP_MODULES = ("tkinter", "customtkinter", "numpy", "codgas_engine", "PIL.Image", "psutil",
+                   "matplotlib.pyplot", "matplotlib.backends.backend_tkagg", "codgas_plots")
 
         
 if __name__ == "__main__":
     app = App()
+    if "--startup-benchmark" in sys.argv:
+        app.after_idle(app.report_startup)
     app.mainloop()
\ No newline at end of file
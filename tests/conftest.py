@@ -0,0 +1,63 @@
+"""Fixtures of the engine tests: small synthetic CORRECT.LP and XDS_ASCII.HKL files, no beamline data needed."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TABLE_HEADER = (
+    " SUBSET OF INTENSITY DATA WITH SIGNAL/NOISE >= -3.0 AS FUNCTION OF RESOLUTION\n"
+    " RESOLUTION     NUMBER OF REFLECTIONS    COMPLETENESS R-FACTOR  R-FACTOR COMPARED I/SIGMA   R-meas  CC(1/2)  Anomal  SigAno   Nano\n"
+    "   LIMIT     OBSERVED  UNIQUE  POSSIBLE     OF DATA   observed  expected                                      Corr\n"
+    "\n")
+
+
+def shell_line(resolution, isig, cc12=99.0, completeness=98.5, rmeas=6.9, sigano=1.05):
+    label = "    total" if resolution is None else f"{resolution:9.2f}"
+    return (f"{label}{96532:12d}{14541:8d}{14772:10d}{completeness:11.1f}%{6.7:10.1f}%{7.0:10.1f}%{96531:9d}"
+            f"{isig:8.2f}{rmeas:10.1f}%{cc12:8.1f}*{-3:6d}{sigano:9.3f}{5900:8d}\n")
+
+
+def statistics_table(isig, **total):
+    shells = "".join(shell_line(resolution, isig * 2) for resolution in (8.87, 5.14, 3.64, 2.82))
+    return TABLE_HEADER + shells + shell_line(None, isig, **total)
+
+
+def correctlp_text(isig=20.0, sg=96, cell=(78.27, 78.27, 37.06, 90.0, 90.0, 90.0), isa=27.84, table=True, **total):
+    """A CORRECT.LP as XDS writes it: a first, provisional table and space group, then the final ones."""
+    text = (" ***** CORRECT *****\n SPACE_GROUP_NUMBER=   0\n"
+            " UNIT_CELL_CONSTANTS=    70.000    70.000    30.000  90.000  90.000  90.000\n")
+    text += "  per-frame statistics  1234  5678  0.123  4.56\n" * 50
+    text += statistics_table(isig + 5.0)
+    text += f"     a        b          ISa\n   1.089E+00  3.012E-03{isa:8.2f}\n"
+    text += f" SPACE_GROUP_NUMBER=   {sg}\n UNIT_CELL_CONSTANTS=" + "".join(f"{value:10.3f}" for value in cell) + "\n"
+    if table:
+        text += " STATISTICS OF SAVED DATA SET\n" + statistics_table(isig, **total)
+    return text + "\n cpu time used  12.3 sec\n"
+
+
+def hkl_text(sg=19, cell=(78.6, 78.7, 37.0, 90.0, 90.0, 90.0), reflections=200):
+    header = ("!FORMAT=XDS_ASCII    MERGE=FALSE    FRIEDEL'S_LAW=TRUE\n"
+              f"!SPACE_GROUP_NUMBER=   {sg}\n"
+              "!UNIT_CELL_CONSTANTS=" + "".join(f"{value:10.3f}" for value in cell) + "\n"
+              "!NUMBER_OF_ITEMS_IN_EACH_DATA_RECORD=5\n"
+              "!END_OF_HEADER\n")
+    body = "".join(f"{h:6d}{h % 7:6d}{h % 5:6d} 1.234E+03 5.678E+01\n" for h in range(reflections))
+    return header + body + "!END_OF_DATA\n"
+
+
+@pytest.fixture
+def dataset_tree(tmp_path):
+    """Four datasets with a CORRECT.LP and an XDS_ASCII.HKL each; d3 has no final statistics table.
+
+    I/sigma ranks d2 > d0 > d1, R-meas (lower is better) ranks d1 > d0 > d2.
+    """
+    totals = {"d0": dict(isig=20.0, rmeas=6.9), "d1": dict(isig=12.5, rmeas=4.1),
+              "d2": dict(isig=31.0, rmeas=9.8), "d3": dict(isig=40.0, table=False)}
+    for name, total in totals.items():
+        directory = tmp_path / name
+        directory.mkdir()
+        (directory / "CORRECT.LP").write_text(correctlp_text(**total))
+        (directory / "XDS_ASCII.HKL").write_text(hkl_text())
+    return tmp_path
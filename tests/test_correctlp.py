@@ -0,0 +1,67 @@
+import math
+import os
+
+import numpy as np
+
+from codgas_engine import (HeaderIndex, load_correctlp, parse_shell_line, read_correctlp, correctlp_total,
+                           SHELL_DTYPE)
+from conftest import correctlp_text, shell_line
+
+
+def test_read_correctlp_takes_the_final_section(dataset_tree):
+    payload, nbytes = read_correctlp(dataset_tree / "d0" / "CORRECT.LP")
+    assert payload["sg"] == 96
+    assert payload["cell"] == [78.27, 78.27, 37.06, 90.0, 90.0, 90.0]
+    assert payload["isa"] == 27.84
+    assert len(payload["lines"]) == 5 and payload["lines"][-1].startswith("total")
+    assert [row[8] for row in payload["rows"]] == [40.0, 40.0, 40.0, 40.0, 20.0]  # not the first table's 25
+    assert 0 < nbytes < os.path.getsize(dataset_tree / "d0" / "CORRECT.LP")
+
+
+def test_read_correctlp_without_a_table(dataset_tree):
+    payload, _ = read_correctlp(dataset_tree / "d3" / "CORRECT.LP")
+    # the provisional table before the final space group is the only one left
+    assert payload["sg"] == 96
+    assert payload["rows"][-1][8] == 45.0
+
+
+def test_read_correctlp_missing_everything(tmp_path):
+    path = tmp_path / "CORRECT.LP"
+    path.write_text(" nothing to see\n")
+    payload, _ = read_correctlp(path)
+    assert payload == {"sg": None, "cell": None, "isa": None, "lines": [], "rows": []}
+    assert correctlp_total(load_correctlp(path)) is None
+
+
+def test_parse_shell_line():
+    row = parse_shell_line(shell_line(None, 20.0, cc12=99.8, completeness=97.1))
+    assert len(row) == len(SHELL_DTYPE.names)
+    assert math.isnan(row[0])
+    assert row[4] == 97.1 and row[8] == 20.0 and row[10] == 99.8
+    assert parse_shell_line(shell_line(2.82, 3.5))[0] == 2.82
+    assert parse_shell_line("    total   96532   14541") is None
+    assert parse_shell_line(shell_line(2.82, 3.5).replace("3.50", "n/a")) is None
+
+
+def test_load_correctlp_is_served_from_the_index(dataset_tree):
+    path = str(dataset_tree / "d1" / "CORRECT.LP")
+    index = HeaderIndex(":memory:")
+    first = load_correctlp(path, index)
+    second = load_correctlp(path, index)
+    assert (index.hits, index.misses) == (1, 1)
+    assert second.sg == first.sg and second.cell == first.cell and second.lines == first.lines
+    for name in SHELL_DTYPE.names:
+        np.testing.assert_equal(second.shells[name], first.shells[name])
+
+    with open(path, "a") as f:  # a changed file is parsed again
+        f.write(" reprocessed\n")
+    load_correctlp(path, index)
+    assert index.misses == 2
+
+
+def test_correctlp_text_round_trip(tmp_path):
+    path = tmp_path / "CORRECT.LP"
+    path.write_text(correctlp_text(isig=7.5, sg=19, cell=(60.0, 70.0, 80.0, 90.0, 90.0, 90.0)))
+    record = load_correctlp(str(path))
+    assert record.sg == 19 and record.cell == (60.0, 70.0, 80.0, 90.0, 90.0, 90.0)
+    assert correctlp_total(record)[8] == 7.5
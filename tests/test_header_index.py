@@ -0,0 +1,63 @@
+import os
+import threading
+
+from codgas_engine import HeaderIndex, UCC_KIND, CORRECTLP_KIND, load_correctlp, scan_datasets
+
+
+def test_relative_and_absolute_paths_share_entries(dataset_tree, monkeypatch):
+    index = HeaderIndex(":memory:")
+    first = scan_datasets(str(dataset_tree), "XDS_ASCII.HKL", index=index)
+    assert (first.cache_hits, first.cache_misses) == (0, 4)
+    monkeypatch.chdir(dataset_tree.parent)
+    second = scan_datasets(dataset_tree.name, "XDS_ASCII.HKL", index=index)
+    assert (second.cache_hits, second.cache_misses) == (4, 0)
+    assert all(not os.path.isabs(path) for path in second.paths)  # still reported the way they were asked for
+
+    load_correctlp(os.path.join(dataset_tree.name, "d0", "CORRECT.LP"), index)
+    load_correctlp(str(dataset_tree / "d0" / "CORRECT.LP"), index)
+    assert (index.hits, index.misses) == (5, 5)
+
+
+def test_scan_prunes_deleted_files(dataset_tree):
+    index = HeaderIndex(":memory:")
+    scan_datasets(str(dataset_tree), "XDS_ASCII.HKL", index=index)
+    load_correctlp(str(dataset_tree / "d2" / "CORRECT.LP"), index)
+    os.remove(dataset_tree / "d1" / "XDS_ASCII.HKL")
+    scan_datasets(str(dataset_tree), "XDS_ASCII.HKL", index=index)
+    assert sorted(os.path.basename(os.path.dirname(path)) for path in index.load_prefix(UCC_KIND, str(dataset_tree))) \
+        == ["d0", "d2", "d3"]
+    assert len(index.load_prefix(CORRECTLP_KIND, str(dataset_tree))) == 1  # other kinds are left alone
+
+    # files deeper than a scan goes are not deleted, only not seen
+    scan_datasets(str(dataset_tree), "XDS_ASCII.HKL", max_depth=0, index=index)
+    assert len(index.load_prefix(UCC_KIND, str(dataset_tree))) == 3
+
+
+def test_outdated_kinds_are_dropped(tmp_path):
+    path = str(tmp_path / "index.sqlite")
+    index = HeaderIndex(path)
+    index.store_many("sg_ucc_v1", [("/data/d0/XDS_ASCII.HKL", (1, 2, 3), {"sg": 19})])
+    index.store_many(UCC_KIND, [("/data/d0/XDS_ASCII.HKL", (1, 2, 3), {"sg": 19})])
+    index.close()
+    index = HeaderIndex(path)
+    assert index.load_prefix("sg_ucc_v1", "/data") == {}
+    assert len(index.load_prefix(UCC_KIND, "/data")) == 1
+
+
+def test_lookup_counts_from_several_threads(dataset_tree):
+    index = HeaderIndex(":memory:")
+    files = [str(dataset_tree / name / "CORRECT.LP") for name in ("d0", "d1", "d2", "d3")]
+    for path in files:
+        load_correctlp(path, index)
+
+    def lookups():
+        for _ in range(200):
+            for path in files:
+                load_correctlp(path, index)
+
+    threads = [threading.Thread(target=lookups) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (index.hits, index.misses) == (4 * 200 * 4, 4)
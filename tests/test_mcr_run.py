@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+
+import pytest
+
+from codgas_mcr import McrRun, parse_progress
+
+STAND_IN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "codgas_mcr.py")
+
+
+def drain(run, timeout=20.0):
+    """The events of `run` up to its ("exit", returncode), which is last."""
+    events = []
+    deadline = time.monotonic() + timeout
+    while not events or events[-1][0] != "exit":
+        events.append(run.events.get(timeout=max(0.0, deadline - time.monotonic())))
+    return events
+
+
+def gone(pid):
+    """True once `pid` has exited; a zombie counts, whoever its new parent is may never reap it here."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] == "Z"
+    except FileNotFoundError:
+        return True
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("3/120", (3, 120, "")),
+    ("[3/120] fake_dataset_0003", (3, 120, "fake_dataset_0003")),
+    ("dataset 3 of 120", (3, 120, "")),
+    ("Processing dataset 3/120: d3", (3, 120, "d3")),
+    ("resolution 1.8/2.0", None),
+    ("5/3 more done than there are", None),
+    ("0/0", None),
+    ("WARNING low completeness", None),
+])
+def test_parse_progress(line, expected):
+    assert parse_progress(line) == expected
+
+
+def test_run_streams_progress_and_exit():
+    events = drain(McrRun([sys.executable, STAND_IN, "--fake", "5", "--delay", "0.01", "--ref", "REF.hkl"]))
+    assert events[-1] == ("exit", 0)
+    assert [event for event in events if event[0] == "exit"] == [events[-1]]
+    assert [event[1:3] for event in events if event[0] == "progress"] == [(i, 5) for i in range(1, 6)]
+    assert ("output", "stdout", "mesh_collect_reproc stand-in: --ref REF.hkl") in events
+    assert ("output", "stderr", "fake_dataset_0005: WARNING low completeness") in events
+
+
+def test_run_reports_exit_status():
+    events = drain(McrRun([sys.executable, STAND_IN, "--fake", "2", "--delay", "0", "--fail", "3"]))
+    assert events[-1] == ("exit", 3)
+    assert sum(event[0] == "progress" for event in events) == 2
+
+
+def test_stop_terminates_the_process_group(tmp_path):
+    # the script starts a child of its own and reports its pid; stop() must take both
+    script = tmp_path / "parent.py"
+    script.write_text("import subprocess, sys, time\n"
+                      "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])\n"
+                      "print('child', child.pid, flush=True)\n"
+                      "time.sleep(60)\n")
+    run = McrRun([sys.executable, str(script)])
+    kind, stream, line = run.events.get(timeout=20)
+    child = int(line.split()[1])
+    run.stop(grace=5)
+    events = drain(run)
+    assert run.stopping and not run.running
+    assert events[-1][1] == -15  # SIGTERM was enough
+    deadline = time.monotonic() + 5
+    while not gone(child) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert gone(child)
+
+
+def test_stop_kills_a_group_ignoring_sigterm(tmp_path):
+    script = tmp_path / "stubborn.py"
+    script.write_text("import signal, time\n"
+                      "signal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+                      "print('ready', flush=True)\n"
+                      "time.sleep(60)\n")
+    run = McrRun([sys.executable, str(script)])
+    assert run.events.get(timeout=20) == ("output", "stdout", "ready")
+    start = time.monotonic()
+    run.stop(grace=0.5)
+    time.sleep(0.2)
+    assert run.running  # SIGTERM ignored, still within the grace
+    events = drain(run)
+    assert events[-1] == ("exit", -9)
+    assert 0.5 <= time.monotonic() - start < 10
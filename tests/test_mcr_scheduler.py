@@ -0,0 +1,101 @@
+import json
+import sys
+import time
+
+import pytest
+
+import codgas_mcr
+from codgas_mcr import McrScheduler, MockExecutor
+
+# counts its runs in the dataset directory; fails the first run in the directories named on its command line
+FLAKY = """import os, sys
+with open("runs", "a") as f:
+    f.write("run\\n")
+with open("runs") as f:
+    first = len(f.read().split()) == 1
+sys.exit(1 if first and os.path.basename(os.getcwd()) in sys.argv[1:] else 0)
+"""
+
+
+@pytest.fixture
+def datasets(tmp_path, monkeypatch):
+    monkeypatch.setattr(codgas_mcr, "MCR_SAMPLE_INTERVAL", 0.05)
+    (tmp_path / "flaky.py").write_text(FLAKY)
+    directories = []
+    for name in ("d0", "d1", "d2"):
+        (tmp_path / name).mkdir()
+        directories.append(tmp_path / name)
+    return directories
+
+
+def schedule(tmp_path, datasets, argv, **options):
+    scheduler = McrScheduler([str(dataset) for dataset in datasets], argv, str(tmp_path / "state.json"), admission=None,
+                             executor=MockExecutor(spool=str(tmp_path / "spool"), interval=0.05), **options)
+    scheduler._thread.join(timeout=60)
+    assert not scheduler.running
+    return scheduler
+
+
+def runs(dataset):
+    return len((dataset / "runs").read_text().split()) if (dataset / "runs").exists() else 0
+
+
+def last_event(scheduler):
+    events = []
+    while not scheduler.events.empty():
+        events.append(scheduler.events.get())
+    return events[-1]
+
+
+def test_failed_run_is_retried(tmp_path, datasets):
+    scheduler = schedule(tmp_path, datasets, [sys.executable, str(tmp_path / "flaky.py"), "d1"], retries=1)
+    assert last_event(scheduler) == ("exit", 0)
+    assert scheduler.summary["done"] == 3 and scheduler.summary["failed"] == 0
+    d1 = scheduler.state[str(datasets[1])]
+    assert (d1["status"], d1["attempts"], d1["returncode"]) == ("done", 2, 0)
+    assert [runs(dataset) for dataset in datasets] == [1, 2, 1]
+    assert list((datasets[1]).glob("codgas_mcr_*.log"))  # MCR_BATCH_LOG, one per job
+    with open(tmp_path / "state.json") as f:
+        assert json.load(f) == scheduler.state
+
+
+def test_failed_after_the_retries(tmp_path, datasets):
+    scheduler = schedule(tmp_path, datasets, [sys.executable, str(tmp_path / "flaky.py"), "d1"], retries=0)
+    assert last_event(scheduler) == ("exit", 1)
+    assert (scheduler.summary["done"], scheduler.summary["failed"]) == (2, 1)
+    d1 = scheduler.state[str(datasets[1])]
+    assert (d1["status"], d1["attempts"], d1["returncode"]) == ("failed", 1, 1)
+
+
+def test_skipdone_resumes_from_the_state_file(tmp_path, datasets):
+    argv = [sys.executable, str(tmp_path / "flaky.py"), "d1"]
+    schedule(tmp_path, datasets, argv, retries=0)
+
+    scheduler = schedule(tmp_path, datasets, argv, retries=0, skipdone=True)
+    assert (scheduler.summary["skipped"], scheduler.summary["done"]) == (2, 1)
+    assert [runs(dataset) for dataset in datasets] == [1, 2, 1]  # only the failed one again
+    assert all(entry["status"] == "done" for entry in scheduler.state.values())
+
+    scheduler = schedule(tmp_path, datasets, argv, retries=0, skipdone=False)
+    assert (scheduler.summary["skipped"], scheduler.summary["done"]) == (0, 3)
+    assert [runs(dataset) for dataset in datasets] == [2, 3, 2]
+
+
+def test_stopped_runs_stay_pending(tmp_path, datasets):
+    (tmp_path / "slow.py").write_text("import time\ntime.sleep(60)\n")
+    scheduler = McrScheduler([str(dataset) for dataset in datasets], [sys.executable, str(tmp_path / "slow.py")],
+                             str(tmp_path / "state.json"), admission=None,
+                             executor=MockExecutor(spool=str(tmp_path / "spool"), interval=0.05))
+    deadline = time.monotonic() + 20
+    while scheduler.status().get("running", 0) < 3 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    scheduler.stop()
+    scheduler._thread.join(timeout=60)
+    assert not scheduler.running
+    assert scheduler.summary["pending"] == 3
+    with open(tmp_path / "state.json") as f:
+        state = json.load(f)
+    assert all((entry["status"], entry["attempts"]) == ("pending", 0) for entry in state.values())
+
+    scheduler = schedule(tmp_path, datasets, [sys.executable, str(tmp_path / "flaky.py")])
+    assert (scheduler.summary["skipped"], scheduler.summary["done"]) == (0, 3)
@@ -0,0 +1,40 @@
+import math
+import os
+
+import pytest
+
+from codgas_engine import rank_references
+
+
+def _files(tree):
+    return [str(tree / name / "CORRECT.LP") for name in ("d0", "d1", "d2", "d3")]
+
+
+def _names(ranked):
+    return [os.path.basename(os.path.dirname(ref.path)) for ref in ranked]
+
+
+def test_rank_references_by_isig(dataset_tree):
+    ranked = rank_references(_files(dataset_tree))
+    # d3 has only the provisional table, whose 'total' row counts too
+    assert _names(ranked) == ["d3", "d2", "d0", "d1"]
+    assert [ref.score for ref in ranked] == [45.0, 31.0, 20.0, 12.5]
+    assert ranked[1].correctlp.sg == 96 and ranked[1].total[8] == 31.0
+
+
+def test_rank_references_lower_is_better_and_top_k(dataset_tree):
+    files = _files(dataset_tree)[:3]
+    assert _names(rank_references(files, metric="rmeas")) == ["d1", "d0", "d2"]
+    assert _names(rank_references(files, metric="rmeas", top_k=1)) == ["d1"]
+
+
+def test_rank_references_weights_and_invalid(dataset_tree, tmp_path):
+    broken = tmp_path / "broken.LP"
+    broken.write_text(" no statistics\n")
+    files = _files(dataset_tree)[:3] + [str(broken), str(tmp_path / "missing.LP")]
+    ranked = rank_references(files, weights={"isig": 1.0, "rmeas": 1.0})
+    assert {os.path.basename(ref.path) for ref in ranked[-2:]} == {"broken.LP", "missing.LP"}
+    assert all(ref.score == -math.inf and ref.total is None for ref in ranked[-2:])
+    assert all(math.isfinite(ref.score) for ref in ranked[:3])
+    with pytest.raises(ValueError):
+        rank_references(files, metric="bogus")
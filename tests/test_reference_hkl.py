@@ -0,0 +1,73 @@
+import os
+import stat
+
+import pytest
+
+from codgas_engine import write_reference_hkl
+from conftest import hkl_text
+
+
+def test_write_reference_hkl(dataset_tree):
+    source = dataset_tree / "d0" / "XDS_ASCII.HKL"
+    dest = dataset_tree / "REF.hkl"
+    nbytes = write_reference_hkl(str(source), str(dest), 96, 78.3, 78.3, 37.1)
+    written = dest.read_bytes()
+    assert nbytes == len(written)
+    header, body = written.split(b"!END_OF_HEADER\n")
+    assert b"!SPACE_GROUP_NUMBER=\t96\n" in header
+    assert b"!UNIT_CELL_CONSTANTS=\t78.3\t78.3\t37.1\t90.000\t90.000\t90.000\n" in header
+    assert body == source.read_bytes().split(b"!END_OF_HEADER\n")[1]  # reflections copied as they are
+    assert sorted(os.listdir(dataset_tree)) == ["REF.hkl", "d0", "d1", "d2", "d3"]  # no temporary file left
+
+
+def test_write_reference_hkl_from_a_read_only_source(tmp_path):
+    source = tmp_path / "XDS_ASCII.HKL"
+    source.write_text(hkl_text())
+    source.chmod(0o444)
+    dest = tmp_path / "REF.hkl"
+    write_reference_hkl(str(source), str(dest), 19, 1.0, 2.0, 3.0)
+    assert os.stat(dest).st_mode & stat.S_IWUSR
+    write_reference_hkl(str(source), str(dest), 19, 4.0, 5.0, 6.0)  # and it can be replaced again
+    assert b"\t4.0\t5.0\t6.0\t" in dest.read_bytes()
+
+
+def test_write_reference_hkl_keeps_dest_when_failing(tmp_path):
+    dest = tmp_path / "REF.hkl"
+    dest.write_text("previous\n")
+    with pytest.raises(OSError):
+        write_reference_hkl(str(tmp_path / "missing.HKL"), str(dest), 19, 1.0, 2.0, 3.0)
+    assert dest.read_text() == "previous\n"
+    assert os.listdir(tmp_path) == ["REF.hkl"]
+
+
+def test_write_reference_hkl_when_the_kernel_copy_stalls(tmp_path, monkeypatch):
+    source = tmp_path / "XDS_ASCII.HKL"
+    source.write_text(hkl_text(reflections=5000))
+    real_copy = os.copy_file_range
+    calls = []
+
+    def stalling_copy(src, dst, count, offset_src=None):
+        calls.append(count)
+        return real_copy(src, dst, min(count, 4096), offset_src) if len(calls) == 1 else 0
+
+    real_write = os.write
+    monkeypatch.setattr(os, "copy_file_range", stalling_copy)
+    monkeypatch.setattr(os, "sendfile", lambda *args: 0)
+    monkeypatch.setattr(os, "write", lambda fd, data: real_write(fd, bytes(data[:1000])))  # short writes
+    dest = tmp_path / "REF.hkl"
+    write_reference_hkl(str(source), str(dest), 19, 1.0, 2.0, 3.0)
+    assert dest.read_bytes().split(b"!END_OF_HEADER\n")[1] == source.read_bytes().split(b"!END_OF_HEADER\n")[1]
+
+
+def test_write_reference_hkl_fails_on_a_short_source(tmp_path, monkeypatch):
+    source = tmp_path / "XDS_ASCII.HKL"
+    source.write_text(hkl_text())
+    dest = tmp_path / "REF.hkl"
+    dest.write_text("previous\n")
+    for kernel_copy in ("copy_file_range", "sendfile"):
+        monkeypatch.delattr(os, kernel_copy, raising=False)
+    monkeypatch.setattr(os, "pread", lambda fd, n, offset: b"")  # the file ends before its size says
+    with pytest.raises(OSError):
+        write_reference_hkl(str(source), str(dest), 19, 1.0, 2.0, 3.0)
+    assert dest.read_text() == "previous\n"
+    assert sorted(os.listdir(tmp_path)) == ["REF.hkl", "XDS_ASCII.HKL"]